@@ -0,0 +1,130 @@
+import math
+import threading
+import time
+import logging
+from typing import Callable, Dict, NamedTuple, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class Rejection(NamedTuple):
+    status_code: int  # 429 when the lane's queue is full, 503 when the instance is saturated
+    retry_after: int
+    reason: str
+
+
+class AdmissionController:
+    """Admission control for the send endpoints, one budget per lane.
+
+    Each lane has two limits: ``max_queued`` messages waiting in the outbox
+    (shared by every worker process, so it is the real backlog) and
+    ``max_inflight`` requests being handled by this process right now. A
+    full queue is answered with 429, too many concurrent requests with 503;
+    both carry a Retry-After estimated from how fast the lane drains.
+
+    Queue depth comes from ``depth`` (a GROUP BY over the outbox), read at
+    most every ``refresh`` seconds; between reads each admitted request
+    counts as one more queued message, so a burst cannot overshoot the
+    limit by more than the messages of the requests already admitted.
+    ``delivered`` returns this process's delivered count per lane and
+    gives the drain rate.
+    """
+
+    def __init__(
+        self,
+        max_queued: Dict[str, int],
+        max_inflight: Dict[str, int],
+        depth: Callable[[], Dict[str, int]],
+        delivered: Callable[[], Dict[str, int]],
+        refresh: float = 0.25,
+        default_retry_after: int = 5,
+        max_retry_after: int = 300,
+    ):
+        self.max_queued = max_queued
+        self.max_inflight = max_inflight
+        self.depth = depth
+        self.delivered = delivered
+        self.refresh = refresh
+        self.default_retry_after = default_retry_after
+        self.max_retry_after = max_retry_after
+        self._lock = threading.Lock()
+        self._queued: Dict[str, int] = {}
+        self._inflight: Dict[str, int] = {lane: 0 for lane in max_inflight}
+        self._drain: Dict[str, float] = {}
+        self._last_delivered: Optional[Dict[str, int]] = None
+        self._read_at = 0.0
+        self._stats = {"admitted": 0, "rejected_queue": 0, "rejected_inflight": 0}
+
+    def _refresh(self):
+        now = time.monotonic()
+        if now - self._read_at < self.refresh:
+            return
+        try:
+            queued = self.depth()
+            delivered = self.delivered()
+        except Exception as e:
+            # Keep the last reading rather than failing requests on a metrics read
+            logger.error(f"Admission depth refresh failed: {str(e)}")
+            self._read_at = now
+            return
+        if self._last_delivered is not None and now > self._read_at:
+            elapsed = now - self._read_at
+            for lane, count in delivered.items():
+                rate = (count - self._last_delivered.get(lane, 0)) / elapsed
+                self._drain[lane] = 0.7 * self._drain.get(lane, rate) + 0.3 * rate
+        self._queued = dict(queued)
+        self._last_delivered = dict(delivered)
+        self._read_at = now
+
+    def _retry_after(self, lane: str, excess: float) -> int:
+        rate = self._drain.get(lane, 0.0)
+        if rate <= 0:
+            return self.default_retry_after
+        return max(1, min(self.max_retry_after, math.ceil(excess / rate)))
+
+    def enter(self, lane: str) -> Optional[Rejection]:
+        """Admit a request into ``lane`` or say why not; pair with ``leave``"""
+        with self._lock:
+            self._refresh()
+            inflight = self._inflight.get(lane, 0)
+            if inflight >= self.max_inflight.get(lane, math.inf):
+                self._stats["rejected_inflight"] += 1
+                # Requests finish far faster than the queue drains
+                return Rejection(503, 1, f"Too many concurrent {lane} requests")
+            queued = self._queued.get(lane, 0)
+            limit = self.max_queued.get(lane, math.inf)
+            if queued >= limit:
+                self._stats["rejected_queue"] += 1
+                return Rejection(
+                    429, self._retry_after(lane, queued - limit + 1), f"The {lane} delivery queue is full"
+                )
+            self._inflight[lane] = inflight + 1
+            self._queued[lane] = queued + 1
+            self._stats["admitted"] += 1
+            return None
+
+    def leave(self, lane: str):
+        with self._lock:
+            self._inflight[lane] = max(0, self._inflight.get(lane, 0) - 1)
+
+    def snapshot(self) -> Dict[str, dict]:
+        """Per-lane depth, in-flight requests, limits, utilisation and drain rate"""
+        with self._lock:
+            self._refresh()
+            report = {}
+            for lane in sorted(set(self.max_queued) | set(self.max_inflight)):
+                queued = self._queued.get(lane, 0)
+                limit = self.max_queued.get(lane)
+                report[lane] = {
+                    "queued": queued,
+                    "max_queued": limit,
+                    "inflight": self._inflight.get(lane, 0),
+                    "max_inflight": self.max_inflight.get(lane),
+                    "utilisation": round(queued / limit, 3) if limit else 0.0,
+                    "drain_per_second": round(self._drain.get(lane, 0.0), 2),
+                }
+            return report
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._stats)
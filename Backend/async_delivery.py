@@ -0,0 +1,123 @@
+import asyncio
+import multiprocessing
+import threading
+import logging
+from concurrent.futures import BrokenExecutor, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncDelivery:
+    """Non-blocking front for the blocking smtplib send functions.
+
+    Sends run on a bounded thread pool so the event loop keeps serving other
+    requests while a relay is slow. ``max_concurrency`` caps how many sends
+    may be awaiting at once; callers past that limit wait on a semaphore
+    without holding a thread.
+    """
+
+    def __init__(self, max_workers: int = 4, max_concurrency: int = 500):
+        self.max_workers = max(1, max_workers)
+        self.max_concurrency = max(1, max_concurrency)
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.max_workers, thread_name_prefix="smtp-send"
+        )
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._stats = {"submitted": 0, "completed": 0, "errors": 0}
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        # Created lazily so it binds to the loop uvicorn is actually running
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    async def run(self, func, *args, **kwargs):
+        """Run a blocking send function on the pool and await its result"""
+        loop = asyncio.get_running_loop()
+        async with self._get_semaphore():
+            with self._lock:
+                self._in_flight += 1
+                self._stats["submitted"] += 1
+            try:
+                result = await loop.run_in_executor(
+                    self._executor, partial(func, *args, **kwargs)
+                )
+            except Exception:
+                with self._lock:
+                    self._stats["errors"] += 1
+                raise
+            finally:
+                with self._lock:
+                    self._in_flight -= 1
+                    self._stats["completed"] += 1
+            return result
+
+    def shutdown(self, wait: bool = True):
+        self._executor.shutdown(wait=wait)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                **self._stats,
+                "in_flight": self._in_flight,
+                "max_workers": self.max_workers,
+                "max_concurrency": self.max_concurrency,
+            }
+
+
+class RenderPool:
+    """Spawned process pool for CPU-bound rendering that replaces itself when broken.
+
+    A ProcessPoolExecutor whose worker died (killed, out of memory) is
+    unusable for good. ``run`` then shuts it down, starts a fresh pool for
+    later calls and re-raises, so callers decide whether to retry or fall
+    back. Workers are spawned rather than forked: the parent has SMTP,
+    SQLite and executor threads running.
+    """
+
+    def __init__(self, max_workers: int = 1):
+        self.max_workers = max(1, max_workers)
+        self._lock = threading.Lock()
+        self._executor = self._create()
+        self._stats = {"submitted": 0, "broken": 0, "restarts": 0}
+
+    def _create(self) -> ProcessPoolExecutor:
+        # Workers start lazily, on the first submit
+        return ProcessPoolExecutor(
+            max_workers=self.max_workers, mp_context=multiprocessing.get_context("spawn")
+        )
+
+    async def run(self, func, *args):
+        """Run ``func(*args)`` in a worker process and await its result"""
+        with self._lock:
+            executor = self._executor
+            self._stats["submitted"] += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(executor, func, *args)
+        except BrokenExecutor:
+            self._replace(executor)
+            raise
+
+    def _replace(self, broken: ProcessPoolExecutor):
+        with self._lock:
+            self._stats["broken"] += 1
+            # Every call that was running on the broken pool lands here; only the first rebuilds it
+            if self._executor is not broken:
+                return
+            self._executor = self._create()
+            self._stats["restarts"] += 1
+        logger.error("Render pool broke; started a new one")
+        broken.shutdown(wait=False, cancel_futures=True)
+
+    def shutdown(self):
+        with self._lock:
+            executor = self._executor
+        executor.shutdown(cancel_futures=True)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self._stats, "max_workers": self.max_workers}
@@ -0,0 +1,183 @@
+import asyncio
+import base64
+import hashlib
+import mmap
+import os
+import re
+import tempfile
+import time
+import logging
+from contextlib import contextmanager
+from email.utils import encode_rfc2231
+from typing import BinaryIO, Dict, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+# Raw bytes per base64 line: 57 bytes encode to exactly 76 characters
+LINE_BYTES = 57
+# Raw bytes encoded per step; a whole number of lines so chunks join cleanly
+ENCODE_CHUNK = LINE_BYTES * 16384
+COPY_CHUNK = 1024 * 1024
+
+ATTACHMENT_ID = re.compile(r"[0-9a-f]{64}")
+
+
+class AttachmentTooLarge(ValueError):
+    """Raised when an upload exceeds the configured maximum size"""
+
+
+class AttachmentMissing(LookupError):
+    """Raised when a queued message refers to an attachment no longer on disk"""
+
+
+def part_headers(filename: str, content_type: str) -> bytes:
+    """MIME headers (and the blank line) opening one base64 attachment part"""
+    if filename.isascii() and '"' not in filename and "\\" not in filename:
+        name = f'filename="{filename}"'
+    else:
+        # RFC 2231 keeps non-ASCII names intact in every mainstream client
+        name = f"filename*={encode_rfc2231(filename, 'utf-8')}"
+    return (
+        f"Content-Type: {content_type}\r\n"
+        "Content-Transfer-Encoding: base64\r\n"
+        f"Content-Disposition: attachment; {name}\r\n"
+        "\r\n"
+    ).encode("ascii")
+
+
+class AttachmentStore:
+    """Uploaded attachments kept on disk, already base64-encoded for the wire.
+
+    ``save`` copies an upload to disk in chunks while hashing it, then
+    encodes it once from a memory map into ``<sha256>.b64``: CRLF-wrapped
+    76-character lines, exactly the bytes that go inside the MIME part. The
+    same file uploaded again (or attached to every message of a bulk send)
+    reuses that encoding. ``encoded`` maps it read-only so the sender writes
+    it to the socket straight from the page cache.
+    """
+
+    def __init__(self, directory: str, max_bytes: int = 25 * 1024 * 1024, retention_days: float = 7):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.retention_days = retention_days
+        self._task: Optional[asyncio.Task] = None
+        self._stats = {"saved": 0, "reused": 0, "bytes_encoded": 0, "pruned": 0}
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, attachment_id: str) -> str:
+        if not ATTACHMENT_ID.fullmatch(attachment_id):
+            raise ValueError(f"Invalid attachment id: {attachment_id!r}")
+        return os.path.join(self.directory, f"{attachment_id}.b64")
+
+    def save(self, source: BinaryIO, filename: str, content_type: Optional[str]) -> Dict[str, object]:
+        """Store one upload and return the reference a message payload carries"""
+        digest = hashlib.sha256()
+        size = 0
+        fd, raw_path = tempfile.mkstemp(dir=self.directory, suffix=".upload")
+        try:
+            with os.fdopen(fd, "wb") as raw:
+                while True:
+                    chunk = source.read(COPY_CHUNK)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    if size > self.max_bytes:
+                        raise AttachmentTooLarge(
+                            f"Attachment {filename!r} exceeds the {self.max_bytes} byte limit"
+                        )
+                    digest.update(chunk)
+                    raw.write(chunk)
+            attachment_id = digest.hexdigest()
+            path = self._path(attachment_id)
+            if os.path.exists(path):
+                # Refresh its age so pruning keeps it for this send too
+                os.utime(path)
+                self._stats["reused"] += 1
+            else:
+                self._encode(raw_path, path, size)
+                self._stats["saved"] += 1
+                self._stats["bytes_encoded"] += size
+        finally:
+            os.unlink(raw_path)
+        return {
+            "id": attachment_id,
+            "filename": os.path.basename(filename or "attachment"),
+            "content_type": content_type or "application/octet-stream",
+            "size": size,
+        }
+
+    def _encode(self, raw_path: str, path: str, size: int):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".b64tmp")
+        try:
+            with os.fdopen(fd, "wb") as out:
+                if size:
+                    with open(raw_path, "rb") as raw, mmap.mmap(raw.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                        view = memoryview(mapped)
+                        try:
+                            for offset in range(0, size, ENCODE_CHUNK):
+                                encoded = base64.b64encode(view[offset:offset + ENCODE_CHUNK])
+                                out.write(b"\r\n".join(
+                                    encoded[i:i + 76] for i in range(0, len(encoded), 76)
+                                ))
+                                out.write(b"\r\n")
+                        finally:
+                            view.release()
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def exists(self, attachment_id: str) -> bool:
+        return os.path.exists(self._path(attachment_id))
+
+    @contextmanager
+    def encoded(self, attachment_id: str) -> Iterator[memoryview]:
+        """Read-only view of an attachment's encoded bytes, valid inside the block"""
+        with open(self._path(attachment_id), "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                yield memoryview(b"")
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                view = memoryview(mapped)
+                try:
+                    yield view
+                finally:
+                    view.release()
+
+    def prune(self) -> int:
+        """Delete encoded attachments not used for longer than the retention period"""
+        if self.retention_days <= 0:
+            return 0
+        cutoff = time.time() - self.retention_days * 86400
+        removed = 0
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith((".b64", ".upload", ".b64tmp")) and entry.stat().st_mtime < cutoff:
+                try:
+                    os.unlink(entry.path)
+                    removed += 1
+                except FileNotFoundError:
+                    pass
+        self._stats["pruned"] += removed
+        return removed
+
+    def start(self):
+        self._task = asyncio.create_task(self._run(), name="attachment-pruner")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                removed = await asyncio.to_thread(self.prune)
+                if removed:
+                    logger.info(f"Pruned {removed} expired attachments")
+            except OSError as e:
+                logger.error(f"Attachment pruning failed: {str(e)}")
+            await asyncio.sleep(3600)
+
+    def stats(self) -> Dict[str, int]:
+        return dict(self._stats)
@@ -0,0 +1,113 @@
+"""Message-construction benchmark: cached MessageBuilder vs per-message MIME objects.
+
+The previous path built a fresh MIMEMultipart with two MIMEText parts for
+every message and serialised it through the email generator, re-encoding
+the shared HTML body each time. The bulk case sends one notification to
+many recipients, so the builder serves the body from its cache and only
+the headers change; the unique case has a different body every message
+and measures the cost of a cache miss.
+
+Run from the Backend directory:
+
+    python -m benchmarks.bench_mime [--iterations N] [--json]
+"""
+import argparse
+import json
+import timeit
+import tracemalloc
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+import templates
+from message_builder import BodyCache, MessageBuilder
+
+SENDER = "devclub@example.com"
+SUBJECT = "📚 [ANNOUNCEMENT] Hackathon registration"
+TEXT = "ANNOUNCEMENT NOTIFICATION\n\nHackathon registration\n\nRegistration closes on Friday at 5 PM.\n"
+HTML = templates.get_notification_template(
+    "Hackathon registration", "Registration closes on Friday at 5 PM.", "announcement"
+)
+
+
+def legacy_build(recipient: str, text: str = TEXT, html: str = HTML) -> bytes:
+    msg = MIMEMultipart("alternative")
+    msg["From"] = SENDER
+    msg["To"] = recipient
+    msg["Subject"] = SUBJECT
+    msg.attach(MIMEText(text, "plain"))
+    msg.attach(MIMEText(html, "html"))
+    # smtplib.send_message serialises with the SMTP policy
+    return msg.as_bytes(policy=msg.policy.clone(linesep="\r\n"))
+
+
+def cases(builder: MessageBuilder):
+    counter = iter(range(1 << 62))
+
+    def unique_text() -> str:
+        return f"{TEXT}#{next(counter)}"
+
+    return {
+        "bulk_same_body": (
+            lambda: legacy_build("student@example.com"),
+            lambda: builder.build(["student@example.com"], SUBJECT, TEXT, HTML),
+        ),
+        "unique_body": (
+            lambda: legacy_build("student@example.com", unique_text()),
+            lambda: builder.build(["student@example.com"], SUBJECT, unique_text(), HTML),
+        ),
+    }
+
+
+def bench(func, iterations: int) -> float:
+    """Best-of-5 microseconds per message"""
+    timer = timeit.Timer(func)
+    return min(timer.repeat(repeat=5, number=iterations)) / iterations * 1e6
+
+
+def peak_allocation(func, iterations: int) -> float:
+    """Average transient peak of traced allocations while building one message"""
+    func()
+    tracemalloc.start()
+    total = 0
+    for _ in range(iterations):
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+        func()
+        total += tracemalloc.get_traced_memory()[1] - baseline
+    tracemalloc.stop()
+    return total / iterations if iterations else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--json", action="store_true", help="emit machine-readable results")
+    args = parser.parse_args()
+
+    results = {}
+    builder = MessageBuilder(SENDER, BodyCache(max_entries=64))
+    for name, (legacy, cached) in cases(builder).items():
+        legacy_us = bench(legacy, args.iterations)
+        cached_us = bench(cached, args.iterations)
+        results[name] = {
+            "legacy_us": round(legacy_us, 3),
+            "builder_us": round(cached_us, 3),
+            "speedup": round(legacy_us / cached_us, 2),
+            "legacy_peak_bytes": round(peak_allocation(legacy, 200)),
+            "builder_peak_bytes": round(peak_allocation(cached, 200)),
+        }
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{'case':<16}{'legacy µs':>12}{'builder µs':>13}{'speedup':>10}{'legacy B':>12}{'builder B':>12}")
+    for name, row in results.items():
+        print(
+            f"{name:<16}{row['legacy_us']:>12}{row['builder_us']:>13}{row['speedup']:>9}x"
+            f"{row['legacy_peak_bytes']:>12}{row['builder_peak_bytes']:>12}"
+        )
+
+
+if __name__ == "__main__":
+    main()
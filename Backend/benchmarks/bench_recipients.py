@@ -0,0 +1,124 @@
+"""Recipient validation benchmark: cached validator vs per-field EmailStr.
+
+Validates bulk recipient lists the way a request body is validated, once
+with ``List[EmailStr]`` (email_validator on every address, every request)
+and once with the cached ``RecipientValidator`` type, cold (every address
+new) and warm (the same roster sent again). Before timing, a corpus of
+awkward addresses is checked to get the same verdict and normalised form
+from both.
+
+Run from the Backend directory:
+
+    python -m benchmarks.bench_recipients [--recipients N] [--requests N] [--json]
+"""
+import argparse
+import json
+import time
+from typing import List
+
+from pydantic import EmailStr, TypeAdapter, ValidationError
+
+from recipients import RecipientValidator
+
+CORPUS = [
+    "student@example.com",
+    "Student.Name+club@Example.COM",
+    "a@b.co",
+    "first.last@sub.domain.example.org",
+    "o'brien@example.ie",
+    "user@my--club.example.com",
+    "user@xn--bcher-kva.example",
+    "user@bücher.example",
+    "üser@example.com",
+    '"quoted local"@example.com',
+    "Asha Rao <asha@example.com>",
+    "  padded@example.com  ",
+    "user@localhost",
+    "user@printer.local",
+    "user@example.test",
+    "user@example.123",
+    "user@127.0.0.1",
+    "user@[127.0.0.1]",
+    "no-at-sign.example.com",
+    "two@@example.com",
+    ".leading@example.com",
+    "trailing.@example.com",
+    "dou..ble@example.com",
+    "user@-hyphen.example.com",
+    "user@example",
+    "x" * 65 + "@example.com",
+    "user@" + "a" * 64 + ".com",
+    "user@" + ".".join(["abcdefghij"] * 24) + ".com",
+    "",
+]
+
+
+def verdict(adapter: TypeAdapter, address: str):
+    try:
+        return adapter.validate_python(address)
+    except ValidationError as e:
+        return f"invalid: {e.errors()[0]['msg']}"
+
+
+def check_equivalence() -> List[str]:
+    legacy = TypeAdapter(EmailStr)
+    cached = TypeAdapter(RecipientValidator().annotated())
+    return [
+        f"{address!r}: {verdict(legacy, address)!r} != {verdict(cached, address)!r}"
+        for address in CORPUS
+        if verdict(legacy, address) != verdict(cached, address)
+    ]
+
+
+def roster(size: int, offset: int = 0) -> List[str]:
+    return [f"member{offset + i}.name@club{(offset + i) % 40}.example.edu" for i in range(size)]
+
+
+def per_address_us(adapter: TypeAdapter, batches: List[List[str]]) -> float:
+    started = time.perf_counter()
+    for batch in batches:
+        adapter.validate_python(batch)
+    return (time.perf_counter() - started) / sum(len(batch) for batch in batches) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--recipients", type=int, default=2000, help="addresses per request")
+    parser.add_argument("--requests", type=int, default=10)
+    parser.add_argument("--json", action="store_true", help="emit machine-readable results")
+    args = parser.parse_args()
+
+    mismatches = check_equivalence()
+    if mismatches:
+        raise SystemExit("Cached validation disagrees with EmailStr:\n" + "\n".join(mismatches))
+
+    # Every request a new roster, vs the same roster sent repeatedly
+    fresh = [roster(args.recipients, offset=i * args.recipients) for i in range(args.requests)]
+    repeated = [roster(args.recipients)] * args.requests
+
+    legacy = TypeAdapter(List[EmailStr])
+    results = {}
+    for name, batches in (("fresh", fresh), ("repeated", repeated)):
+        validator = RecipientValidator(max_entries=args.recipients * args.requests)
+        cached = TypeAdapter(List[validator.annotated()])
+        legacy_us = per_address_us(legacy, batches)
+        cached_us = per_address_us(cached, batches)
+        results[name] = {
+            "legacy_us": round(legacy_us, 3),
+            "cached_us": round(cached_us, 3),
+            "speedup": round(legacy_us / cached_us, 2),
+            "validator": validator.stats(),
+        }
+
+    if args.json:
+        print(json.dumps({"corpus_checked": len(CORPUS), **results}, indent=2))
+        return
+
+    print(f"{len(CORPUS)} corpus addresses validate identically")
+    print(f"{'workload':<10}{'EmailStr µs':>14}{'cached µs':>12}{'speedup':>10}")
+    for name, row in results.items():
+        print(f"{name:<10}{row['legacy_us']:>14}{row['cached_us']:>12}{row['speedup']:>9}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""Bulk rendering benchmark: MIME encoding in sender threads vs the render process pool.
+
+Renders and MIME-encodes N attendance notifications two ways while an
+asyncio ticker measures how late the event loop wakes up, which is what
+request handling feels. ``threads`` encodes in a thread pool the size of
+the shared send executor, as the senders did for every bulk message;
+``pool`` sends chunks to a spawned process pool, as bulk endpoints now do,
+and only unpickles the results in the parent.
+
+Run from the Backend directory:
+
+    python -m benchmarks.bench_render_pool [--messages N] [--workers N] [--chunk-size N] [--json]
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import List
+
+from bulk_render import render_attendance
+from lanes import percentile
+
+
+def records(count: int) -> List[dict]:
+    return [
+        {
+            "student_email": f"student{i}@example.edu",
+            "student_name": f"Student Nº{i}",
+            "subject": "Data Structures",
+            "date": "2025-03-14",
+            "period": f"P{i % 6 + 1}",
+            "status": "absent" if i % 4 else "present",
+        }
+        for i in range(count)
+    ]
+
+
+async def measure(render, items: List[dict], tick: float = 0.005) -> dict:
+    lags: List[float] = []
+    done = asyncio.Event()
+
+    async def ticker():
+        while not done.is_set():
+            expected = time.perf_counter() + tick
+            await asyncio.sleep(tick)
+            lags.append(max(0.0, time.perf_counter() - expected))
+
+    task = asyncio.create_task(ticker())
+    started = time.perf_counter()
+    await render(items)
+    elapsed = time.perf_counter() - started
+    done.set()
+    await task
+    lags.sort()
+    return {
+        "seconds": round(elapsed, 3),
+        "messages_per_second": round(len(items) / elapsed, 1),
+        "loop_lag_p50_ms": round(percentile(lags, 50) * 1000, 2),
+        "loop_lag_p99_ms": round(percentile(lags, 99) * 1000, 2),
+        "loop_lag_max_ms": round(lags[-1] * 1000, 2) if lags else 0.0,
+    }
+
+
+async def run(args) -> dict:
+    items = records(args.messages)
+    loop = asyncio.get_running_loop()
+    results = {}
+
+    with ThreadPoolExecutor(max_workers=args.threads) as threads:
+        async def in_threads(batch):
+            # One message per call, as each sender encodes its own
+            await asyncio.gather(*(loop.run_in_executor(threads, render_attendance, [item]) for item in batch))
+        results["threads"] = await measure(in_threads, items)
+
+    with ProcessPoolExecutor(max_workers=args.workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        async def in_pool(batch):
+            size = args.chunk_size
+            await asyncio.gather(*(
+                loop.run_in_executor(pool, render_attendance, batch[i:i + size])
+                for i in range(0, len(batch), size)
+            ))
+        # Spawn and import in every worker before timing
+        await asyncio.gather(*(loop.run_in_executor(pool, render_attendance, items[:1]) for _ in range(args.workers)))
+        results["pool"] = await measure(in_pool, items)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--threads", type=int, default=10, help="sender threads (SEND_WORKERS)")
+    parser.add_argument("--workers", type=int, default=multiprocessing.cpu_count())
+    parser.add_argument("--chunk-size", type=int, default=100)
+    parser.add_argument("--json", action="store_true", help="emit machine-readable results")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{args.messages} attendance messages, {args.workers} render workers, chunks of {args.chunk_size}")
+    print(f"{'mode':<10}{'msg/s':>10}{'lag p50 ms':>12}{'lag p99 ms':>12}{'lag max ms':>12}")
+    for mode, row in results.items():
+        print(
+            f"{mode:<10}{row['messages_per_second']:>10}{row['loop_lag_p50_ms']:>12}"
+            f"{row['loop_lag_p99_ms']:>12}{row['loop_lag_max_ms']:>12}"
+        )
+
+
+if __name__ == "__main__":
+    main()
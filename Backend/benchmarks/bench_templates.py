@@ -0,0 +1,132 @@
+"""Render-time benchmark: compiled templates vs the previous str.format path.
+
+The previous implementation built each layout with an f-string and then ran
+``str.format`` over the whole ~7 KB base template for every message. That
+path is reproduced here from the same layout sources so both sides render
+identical HTML. The second table times the HTML MIME part bulk sends
+store: rendering then quoted-printable encoding the whole page, against
+``render_mime`` splicing encoded fields between pre-encoded static chunks.
+
+Run from the Backend directory:
+
+    python -m benchmarks.bench_templates [--iterations N] [--json]
+"""
+import argparse
+import json
+import timeit
+
+import templates
+from message_builder import _encode_part
+from templates import (
+    ATTENDANCE_CONTENT,
+    BASE_TEMPLATE,
+    CONTACT_FORM_CONTENT,
+    NOTIFICATION_CONTENT,
+    OTP_CONTENT,
+    attendance_fields,
+    notification_fields,
+)
+
+
+def legacy_otp(otp, user_name):
+    content = OTP_CONTENT.format(otp=otp, user_name=user_name, current_time=templates._now())
+    return BASE_TEMPLATE.format(title="Admin Login OTP", content=content)
+
+
+def legacy_contact(name, email, subject, message):
+    content = CONTACT_FORM_CONTENT.format(
+        name=name, email=email, subject=subject, message=message, current_time=templates._now()
+    )
+    return BASE_TEMPLATE.format(title="New Contact Form Submission", content=content)
+
+
+def legacy_attendance(student_name, subject, date, period, status):
+    content = ATTENDANCE_CONTENT.format(**attendance_fields(student_name, subject, date, period, status))
+    return BASE_TEMPLATE.format(title="Attendance Update", content=content)
+
+
+def legacy_notification(subject, message, notification_type):
+    fields = notification_fields(subject, message, notification_type)
+    content = NOTIFICATION_CONTENT.format(**fields)
+    return BASE_TEMPLATE.format(title=fields["title"], content=content)
+
+
+CASES = {
+    "otp": (
+        legacy_otp,
+        templates.get_otp_email_template,
+        ("482913", "Admin"),
+    ),
+    "contact_form": (
+        legacy_contact,
+        templates.get_contact_form_template,
+        ("Asha", "asha@example.com", "Club membership", "Hi,\nhow do I join the dev club?"),
+    ),
+    "attendance": (
+        legacy_attendance,
+        templates.get_attendance_email_template,
+        ("Ravi", "Data Structures", "2025-08-14", "3", "absent"),
+    ),
+    "notification": (
+        legacy_notification,
+        templates.get_notification_template,
+        ("Hackathon registration", "Registration closes on Friday at 5 PM.", "urgent"),
+    ),
+}
+
+
+# HTML MIME part: render then encode the whole page vs the pre-encoded layout
+ENCODED_CASES = {
+    "attendance": (
+        lambda *args: _encode_part(templates.get_attendance_email_template(*args), "html"),
+        templates.get_attendance_email_part,
+        CASES["attendance"][2],
+    ),
+    "notification": (
+        lambda *args: _encode_part(templates.get_notification_template(*args), "html"),
+        templates.get_notification_part,
+        CASES["notification"][2],
+    ),
+}
+
+
+def compare(cases: dict, iterations: int) -> dict:
+    results = {}
+    for name, (legacy, compiled, call_args) in cases.items():
+        legacy_us = bench(legacy, call_args, iterations)
+        compiled_us = bench(compiled, call_args, iterations)
+        results[name] = {
+            "legacy_us": round(legacy_us, 3),
+            "compiled_us": round(compiled_us, 3),
+            "speedup": round(legacy_us / compiled_us, 2),
+        }
+    return results
+
+
+def bench(func, args, iterations: int) -> float:
+    """Best-of-5 microseconds per render"""
+    timer = timeit.Timer(lambda: func(*args))
+    return min(timer.repeat(repeat=5, number=iterations)) / iterations * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=20000)
+    parser.add_argument("--json", action="store_true", help="emit machine-readable results")
+    args = parser.parse_args()
+
+    results = {"render": compare(CASES, args.iterations), "html_part": compare(ENCODED_CASES, args.iterations)}
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    for table, rows in results.items():
+        print(f"{table:<14}{'legacy µs':>12}{'compiled µs':>14}{'speedup':>10}")
+        for name, row in rows.items():
+            print(f"{name:<14}{row['legacy_us']:>12}{row['compiled_us']:>14}{row['speedup']:>9}x")
+        print()
+
+
+if __name__ == "__main__":
+    main()
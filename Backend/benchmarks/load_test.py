@@ -0,0 +1,459 @@
+"""End-to-end load test against a local SMTP sink.
+
+Starts ``benchmarks.smtp_sink`` in-process and the API under uvicorn as a
+subprocess pointed at it, then drives each send endpoint at a fixed
+concurrency. For every scenario it reports:
+
+- requests/sec and HTTP latency percentiles (time to the 202)
+- end-to-end latency percentiles (request start to the sink accepting the
+  message) and delivered messages/sec
+- SMTP sessions opened per delivered message, which shows whether the
+  connection pool is doing its job
+
+Every request uses its own recipient address so the sink can match each
+accepted message back to the request that queued it. ``otp_roundtrip`` runs
+sequentially because there is only one admin address: it requests an OTP,
+reads the code back out of the captured mail and verifies it.
+
+Run from the Backend directory (needs httpx, see benchmarks/requirements.txt):
+
+    python -m benchmarks.load_test --requests 500 --concurrency 50 --output results.json
+    python -m benchmarks.load_test --sink-latency-ms 50 --sink-tempfail-rate 0.02
+    python -m benchmarks.load_test --compare results.json  # exits 1 on regression
+"""
+import argparse
+import asyncio
+import json
+import os
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List, Optional
+
+import httpx
+
+from benchmarks.smtp_sink import SMTPSink
+from lanes import percentile
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ADMIN_EMAIL = "admin@example.com"
+OTP_PATTERN = re.compile(rb"OTP for secure access is: (\d{6})")
+
+# Metrics compared by --compare and whether a larger value is better
+COMPARED_METRICS = {
+    "requests_per_sec": True,
+    "delivered_per_sec": True,
+    "http_p50_ms": False,
+    "http_p95_ms": False,
+    "http_p99_ms": False,
+    "e2e_p50_ms": False,
+    "e2e_p95_ms": False,
+    "e2e_p99_ms": False,
+}
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _recipient(scenario: str, index: int) -> str:
+    return f"bench+{scenario}-{index}@example.com"
+
+
+def _send_email(index: int) -> dict:
+    recipient = _recipient("send_email", index)
+    return {
+        "url": "/send-email",
+        "json": {
+            "to": [recipient],
+            "subject": f"Benchmark message {index}",
+            "body": "Plain text body for the load test.",
+            "html_body": "<p>HTML body for the load test.</p>",
+        },
+        "recipient": recipient,
+    }
+
+
+def _contact_form(index: int) -> dict:
+    # Contact form mail always goes to the admin, so e2e latency is paired
+    # by arrival order rather than by recipient
+    return {
+        "url": "/contact-form",
+        "json": {
+            "name": f"Visitor {index}",
+            "email": _recipient("contact_form", index),
+            "subject": "Load test enquiry",
+            "message": "Hello,\nthis is a load-test submission.",
+        },
+        "recipient": ADMIN_EMAIL,
+    }
+
+
+def _send_notification(index: int) -> dict:
+    recipient = _recipient("send_notification", index)
+    return {
+        "url": "/send-notification",
+        "params": {
+            "recipient": recipient,
+            "subject": f"Notice {index}",
+            "message": "The library closes early today.",
+            "notification_type": "announcement",
+        },
+        "recipient": recipient,
+    }
+
+
+def _send_attendance(index: int) -> dict:
+    recipient = _recipient("send_attendance_notification", index)
+    return {
+        "url": "/send-attendance-notification",
+        "params": {
+            "student_email": recipient,
+            "student_name": f"Student {index}",
+            "subject": "Mathematics",
+            "date": "2024-03-01",
+            "period": "1",
+            "status": "absent" if index % 5 == 0 else "present",
+        },
+        "recipient": recipient,
+    }
+
+
+SCENARIOS: Dict[str, Callable[[int], dict]] = {
+    "send_email": _send_email,
+    "contact_form": _contact_form,
+    "send_notification": _send_notification,
+    "send_attendance_notification": _send_attendance,
+}
+
+
+def _latency_summary(prefix: str, samples: List[float]) -> dict:
+    ordered = sorted(samples)
+    return {
+        f"{prefix}_p50_ms": round(percentile(ordered, 50) * 1000, 2),
+        f"{prefix}_p95_ms": round(percentile(ordered, 95) * 1000, 2),
+        f"{prefix}_p99_ms": round(percentile(ordered, 99) * 1000, 2),
+        f"{prefix}_max_ms": round(ordered[-1] * 1000, 2) if ordered else 0.0,
+    }
+
+
+def _arrivals_since(sink: SMTPSink, since: float) -> Dict[str, float]:
+    """First arrival time per recipient for messages accepted after ``since``"""
+    arrivals: Dict[str, float] = {}
+    for arrived, rcpts, _ in list(sink.messages):
+        if arrived < since:
+            continue
+        for rcpt in rcpts:
+            arrivals.setdefault(rcpt, arrived)
+    return arrivals
+
+
+async def run_scenario(
+    client: httpx.AsyncClient,
+    sink: SMTPSink,
+    name: str,
+    requests: int,
+    concurrency: int,
+    drain_timeout: float,
+) -> dict:
+    build = SCENARIOS[name]
+    semaphore = asyncio.Semaphore(concurrency)
+    http_latencies: List[float] = []
+    started_at: Dict[int, float] = {}
+    errors = 0
+    before = sink.stats.snapshot()
+    scenario_start = time.monotonic()
+
+    async def one(index: int):
+        nonlocal errors
+        spec = build(index)
+        async with semaphore:
+            start = time.monotonic()
+            try:
+                response = await client.post(spec["url"], json=spec.get("json"), params=spec.get("params"))
+            except httpx.HTTPError:
+                errors += 1
+                return
+            http_latencies.append(time.monotonic() - start)
+            if response.status_code == 202:
+                started_at[index] = start
+            else:
+                errors += 1
+
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    http_elapsed = time.monotonic() - scenario_start
+
+    expected = before["messages"] + len(started_at)
+    await asyncio.to_thread(sink.wait_for_messages, expected, drain_timeout)
+    drain_elapsed = time.monotonic() - scenario_start
+    after = sink.stats.snapshot()
+
+    e2e: List[float] = []
+    if name == "contact_form":
+        # Every message goes to the admin; pair arrivals with requests in order
+        arrivals = sorted(t for t, _, _ in list(sink.messages) if t >= scenario_start)
+        e2e = [arrived - start for arrived, start in zip(arrivals, sorted(started_at.values()))]
+    else:
+        arrivals = _arrivals_since(sink, scenario_start)
+        for index, start in started_at.items():
+            arrived = arrivals.get(build(index)["recipient"])
+            if arrived is not None:
+                e2e.append(arrived - start)
+
+    delivered = after["messages"] - before["messages"]
+    sessions = after["sessions"] - before["sessions"]
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "accepted": len(started_at),
+        "errors": errors,
+        "delivered": delivered,
+        "undelivered": max(0, len(started_at) - delivered),
+        "requests_per_sec": round(requests / http_elapsed, 2) if http_elapsed else 0.0,
+        "delivered_per_sec": round(delivered / drain_elapsed, 2) if drain_elapsed else 0.0,
+        "smtp_sessions": sessions,
+        "smtp_sessions_per_message": round(sessions / delivered, 4) if delivered else None,
+        **_latency_summary("http", http_latencies),
+        **_latency_summary("e2e", e2e),
+    }
+
+
+async def run_otp_roundtrip(client: httpx.AsyncClient, sink: SMTPSink, rounds: int, timeout: float) -> dict:
+    """Request an OTP, read it from the captured mail, verify it; one at a time"""
+    http_latencies: List[float] = []
+    roundtrips: List[float] = []
+    failures = 0
+    before = sink.stats.snapshot()
+    scenario_start = time.monotonic()
+
+    for _ in range(rounds):
+        start = time.monotonic()
+        seen = sink.stats.snapshot()["messages"]
+        response = await client.post("/send-otp", data={"email": ADMIN_EMAIL})
+        http_latencies.append(time.monotonic() - start)
+        if response.status_code != 202:
+            failures += 1
+            continue
+        if not await asyncio.to_thread(sink.wait_for_messages, seen + 1, timeout):
+            failures += 1
+            continue
+        match = None
+        for _, rcpts, body in reversed(list(sink.messages)):
+            if ADMIN_EMAIL in rcpts:
+                match = OTP_PATTERN.search(body)
+                break
+        if match is None:
+            failures += 1
+            continue
+        verify_start = time.monotonic()
+        response = await client.post("/verify-otp", data={"email": ADMIN_EMAIL, "otp": match.group(1).decode()})
+        http_latencies.append(time.monotonic() - verify_start)
+        if response.status_code != 200:
+            failures += 1
+            continue
+        roundtrips.append(time.monotonic() - start)
+
+    elapsed = time.monotonic() - scenario_start
+    after = sink.stats.snapshot()
+    delivered = after["messages"] - before["messages"]
+    sessions = after["sessions"] - before["sessions"]
+    return {
+        "requests": rounds * 2,
+        "concurrency": 1,
+        "accepted": len(roundtrips),
+        "errors": failures,
+        "delivered": delivered,
+        "undelivered": max(0, rounds - delivered),
+        "requests_per_sec": round(rounds * 2 / elapsed, 2) if elapsed else 0.0,
+        "delivered_per_sec": round(delivered / elapsed, 2) if elapsed else 0.0,
+        "smtp_sessions": sessions,
+        "smtp_sessions_per_message": round(sessions / delivered, 4) if delivered else None,
+        **_latency_summary("http", http_latencies),
+        **_latency_summary("e2e", roundtrips),
+    }
+
+
+def start_api(port: int, smtp_port: int, workdir: str, extra_env: Dict[str, str]) -> subprocess.Popen:
+    env = dict(os.environ)
+    env.update({
+        "SMTP_SERVER": "127.0.0.1",
+        "SMTP_PORT": str(smtp_port),
+        "SMTP_USE_TLS": "false",
+        "EMAIL_ADDRESS": "sender@example.com",
+        "EMAIL_PASSWORD": "bench",
+        "ADMIN_EMAIL": ADMIN_EMAIL,
+        "OUTBOX_PATH": os.path.join(workdir, "outbox.db"),
+        "OTP_STORE_PATH": os.path.join(workdir, "otp_store.db"),
+        "IDEMPOTENCY_STORE_PATH": os.path.join(workdir, "idempotency.db"),
+        "DELIVERY_LOG_PATH": os.path.join(workdir, "deliveries.db"),
+        "ATTACHMENT_DIR": os.path.join(workdir, "attachments"),
+        # Retries back off for 30s by default, far longer than a benchmark run
+        "RETRY_BASE_DELAY": env.get("RETRY_BASE_DELAY", "0.5"),
+        "RETRY_MAX_DELAY": env.get("RETRY_MAX_DELAY", "2"),
+        # Measure the service, not the Gmail-sized pacing; pass --env to test it
+        "SMTP_RATE_PER_MINUTE": env.get("SMTP_RATE_PER_MINUTE", "0"),
+        "SMTP_DAILY_QUOTA": env.get("SMTP_DAILY_QUOTA", "0"),
+        # Digests hold attendance for hours; send per event unless asked to
+        "ATTENDANCE_DIGEST_WINDOW": env.get("ATTENDANCE_DIGEST_WINDOW", "0"),
+    })
+    env.update(extra_env)
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--log-level", "warning", "--no-access-log"],
+        cwd=BACKEND_DIR,
+        env=env,
+    )
+
+
+async def wait_until_healthy(base_url: str, process: subprocess.Popen, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(base_url=base_url) as client:
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError(f"API exited with code {process.returncode} during startup")
+            try:
+                if (await client.get("/health")).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.1)
+    raise RuntimeError("API did not become healthy in time")
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> List[str]:
+    """Return a line for every metric that regressed by more than ``threshold``"""
+    regressions = []
+    for name, current in results["scenarios"].items():
+        previous = baseline.get("scenarios", {}).get(name)
+        if not previous:
+            continue
+        for metric, higher_is_better in COMPARED_METRICS.items():
+            old, new = previous.get(metric), current.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            if (-change if higher_is_better else change) > threshold:
+                regressions.append(f"{name}.{metric}: {old} -> {new} ({change:+.1%})")
+    return regressions
+
+
+async def run(args) -> dict:
+    sink = SMTPSink(
+        port=args.sink_port,
+        latency_ms=args.sink_latency_ms,
+        connect_latency_ms=args.sink_connect_latency_ms,
+        tempfail_rate=args.sink_tempfail_rate,
+        permfail_rate=args.sink_permfail_rate,
+        disconnect_rate=args.sink_disconnect_rate,
+        max_per_minute=args.sink_max_per_minute,
+    ).start_in_thread()
+    api_port = args.api_port or _free_port()
+    base_url = f"http://127.0.0.1:{api_port}"
+    extra_env = dict(item.split("=", 1) for item in args.env)
+
+    with tempfile.TemporaryDirectory(prefix="email-bench-") as workdir:
+        process = start_api(api_port, sink.port, workdir, extra_env)
+        try:
+            await wait_until_healthy(base_url, process)
+            limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+            async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+                scenarios = {}
+                for name in args.scenarios:
+                    if name == "otp_roundtrip":
+                        result = await run_otp_roundtrip(client, sink, args.otp_rounds, args.drain_timeout)
+                    else:
+                        result = await run_scenario(
+                            client, sink, name, args.requests, args.concurrency, args.drain_timeout
+                        )
+                    scenarios[name] = result
+                    print(
+                        f"{name:30} {result['requests_per_sec']:9.1f} req/s  "
+                        f"http p50/p95/p99 {result['http_p50_ms']}/{result['http_p95_ms']}/{result['http_p99_ms']} ms  "
+                        f"e2e p50/p95/p99 {result['e2e_p50_ms']}/{result['e2e_p95_ms']}/{result['e2e_p99_ms']} ms  "
+                        f"{result['delivered']}/{result['accepted']} delivered  "
+                        f"{result['smtp_sessions_per_message']} sessions/msg",
+                        file=sys.stderr,
+                    )
+                server_stats = (await client.get("/smtp-pool/stats")).json()
+        finally:
+            process.terminate()
+            try:
+                process.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                process.kill()
+            sink.stop()
+
+    return {
+        "version": 1,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "config": {
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "otp_rounds": args.otp_rounds,
+            "sink_latency_ms": args.sink_latency_ms,
+            "sink_connect_latency_ms": args.sink_connect_latency_ms,
+            "sink_tempfail_rate": args.sink_tempfail_rate,
+            "sink_permfail_rate": args.sink_permfail_rate,
+            "sink_disconnect_rate": args.sink_disconnect_rate,
+            "sink_max_per_minute": args.sink_max_per_minute,
+            "env": extra_env,
+        },
+        "scenarios": scenarios,
+        "sink": sink.stats.snapshot(),
+        "server": server_stats,
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Load test the email API against a local SMTP sink")
+    parser.add_argument("--requests", type=int, default=200, help="requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--otp-rounds", type=int, default=20)
+    parser.add_argument(
+        "--scenarios", nargs="+", default=list(SCENARIOS) + ["otp_roundtrip"],
+        choices=list(SCENARIOS) + ["otp_roundtrip"],
+    )
+    parser.add_argument("--drain-timeout", type=float, default=60.0,
+                        help="seconds to wait for queued mail to reach the sink")
+    parser.add_argument("--api-port", type=int, default=0)
+    parser.add_argument("--sink-port", type=int, default=0)
+    parser.add_argument("--sink-latency-ms", type=float, default=0.0)
+    parser.add_argument("--sink-connect-latency-ms", type=float, default=0.0)
+    parser.add_argument("--sink-tempfail-rate", type=float, default=0.0)
+    parser.add_argument("--sink-permfail-rate", type=float, default=0.0)
+    parser.add_argument("--sink-disconnect-rate", type=float, default=0.0)
+    parser.add_argument("--sink-max-per-minute", type=int, default=0)
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE",
+                        help="extra environment for the API process, e.g. SMTP_POOL_SIZE=8")
+    parser.add_argument("--output", help="write results as JSON to this file")
+    parser.add_argument("--compare", help="baseline JSON from a previous --output run")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="relative change counted as a regression (default 0.2)")
+    args = parser.parse_args(argv)
+
+    results = asyncio.run(run(args))
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        for line in regressions:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
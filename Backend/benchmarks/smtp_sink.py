@@ -0,0 +1,265 @@
+"""Local stand-in SMTP relay for benchmarks.
+
+Accepts every message without delivering it, and can inject latency and
+errors so the service can be measured under realistic relay behaviour
+without sending real mail through Gmail. Counts sessions, messages and
+recipients so a benchmark can report SMTP sessions per message.
+
+Standalone use, from the Backend directory:
+
+    python -m benchmarks.smtp_sink --port 2525 --latency-ms 20 --tempfail-rate 0.01
+
+then start the API with SMTP_SERVER=127.0.0.1 SMTP_PORT=2525 SMTP_USE_TLS=false.
+"""
+import argparse
+import asyncio
+import random
+import ssl
+import threading
+import time
+from collections import deque
+from typing import Optional
+
+
+class SinkStats:
+    def __init__(self):
+        self.sessions = 0
+        self.messages = 0
+        self.recipients = 0
+        self.bytes = 0
+        self.tempfails = 0
+        self.permfails = 0
+        self.disconnects = 0
+        self.throttled = 0
+        self._lock = threading.Lock()
+
+    def add(self, **deltas):
+        with self._lock:
+            for name, value in deltas.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "sessions": self.sessions,
+                "messages": self.messages,
+                "recipients": self.recipients,
+                "bytes": self.bytes,
+                "tempfails": self.tempfails,
+                "permfails": self.permfails,
+                "disconnects": self.disconnects,
+                "throttled": self.throttled,
+            }
+
+
+class SMTPSink:
+    """Minimal asyncio SMTP server: EHLO, STARTTLS, AUTH, MAIL, RCPT, DATA, NOOP, RSET, QUIT.
+
+    ``latency_ms`` delays the reply to each DATA, ``connect_latency_ms``
+    delays the greeting. ``tempfail_rate`` answers a RCPT with 451,
+    ``permfail_rate`` with 550, and ``disconnect_rate`` drops the connection
+    after DATA instead of replying. ``max_per_minute`` answers MAIL FROM with
+    Gmail-style "421 4.7.28" throttling once that many messages were
+    accepted in the last minute, to exercise the sender's rate controller.
+    """
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 2525,
+        latency_ms: float = 0.0,
+        connect_latency_ms: float = 0.0,
+        tempfail_rate: float = 0.0,
+        permfail_rate: float = 0.0,
+        disconnect_rate: float = 0.0,
+        max_per_minute: int = 0,
+        tls_cert: Optional[str] = None,
+        tls_key: Optional[str] = None,
+        keep_messages: int = 100000,
+    ):
+        self.host = host
+        self.port = port
+        self.latency = latency_ms / 1000
+        self.connect_latency = connect_latency_ms / 1000
+        self.tempfail_rate = tempfail_rate
+        self.permfail_rate = permfail_rate
+        self.disconnect_rate = disconnect_rate
+        self.max_per_minute = max_per_minute
+        self._accepted_times = deque()
+        self.tls_context = None
+        if tls_cert:
+            self.tls_context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+            self.tls_context.load_cert_chain(tls_cert, tls_key)
+        self.stats = SinkStats()
+        # Recent (arrival time, recipients, raw message) tuples, e.g. to read an OTP back
+        self.messages = deque(maxlen=keep_messages)
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.stats.add(sessions=1)
+        if self.connect_latency:
+            await asyncio.sleep(self.connect_latency)
+
+        def reply(line: str):
+            writer.write(line.encode() + b"\r\n")
+
+        reply("220 smtp-sink ready")
+        rcpts = []
+        try:
+            while True:
+                await writer.drain()
+                raw = await reader.readline()
+                if not raw:
+                    break
+                line = raw.decode("utf-8", "replace").rstrip("\r\n")
+                verb = line.split(" ", 1)[0].upper()
+
+                if verb in ("EHLO", "HELO"):
+                    extensions = ["smtp-sink", "8BITMIME", "SIZE 52428800", "AUTH PLAIN LOGIN"]
+                    if self.tls_context is not None:
+                        extensions.append("STARTTLS")
+                    for ext in extensions[:-1]:
+                        reply(f"250-{ext}")
+                    reply(f"250 {extensions[-1]}")
+                elif verb == "STARTTLS" and self.tls_context is not None:
+                    reply("220 Ready to start TLS")
+                    await writer.drain()
+                    await writer.start_tls(self.tls_context)
+                elif verb == "AUTH":
+                    reply("235 2.7.0 Authentication successful")
+                elif verb == "MAIL":
+                    rcpts = []
+                    if self._over_rate():
+                        self.stats.add(throttled=1)
+                        reply("421 4.7.28 Our system has detected an unusual rate of unsolicited mail, try again later")
+                        continue
+                    reply("250 2.1.0 OK")
+                elif verb == "RCPT":
+                    roll = random.random()
+                    if roll < self.permfail_rate:
+                        self.stats.add(permfails=1)
+                        reply("550 5.1.1 No such user")
+                    elif roll < self.permfail_rate + self.tempfail_rate:
+                        self.stats.add(tempfails=1)
+                        reply("451 4.7.1 Greylisted, try again later")
+                    else:
+                        rcpts.append(line.split(":", 1)[1].strip().strip("<>"))
+                        reply("250 2.1.5 OK")
+                elif verb == "DATA":
+                    reply("354 End data with <CR><LF>.<CR><LF>")
+                    await writer.drain()
+                    chunks = []
+                    while True:
+                        data_line = await reader.readline()
+                        if data_line in (b".\r\n", b".\n", b""):
+                            break
+                        chunks.append(data_line[1:] if data_line.startswith(b"..") else data_line)
+                    if self.latency:
+                        await asyncio.sleep(self.latency)
+                    if random.random() < self.disconnect_rate:
+                        self.stats.add(disconnects=1)
+                        break
+                    body = b"".join(chunks)
+                    self.messages.append((time.monotonic(), tuple(rcpts), body))
+                    self._accepted_times.append(time.monotonic())
+                    self.stats.add(messages=1, recipients=len(rcpts), bytes=len(body))
+                    reply("250 2.0.0 OK queued")
+                elif verb == "RSET":
+                    rcpts = []
+                    reply("250 2.0.0 OK")
+                elif verb == "NOOP":
+                    reply("250 2.0.0 OK")
+                elif verb == "QUIT":
+                    reply("221 2.0.0 Bye")
+                    await writer.drain()
+                    break
+                else:
+                    reply("502 5.5.2 Command not recognized")
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    def _over_rate(self) -> bool:
+        if not self.max_per_minute:
+            return False
+        cutoff = time.monotonic() - 60
+        while self._accepted_times and self._accepted_times[0] < cutoff:
+            self._accepted_times.popleft()
+        return len(self._accepted_times) >= self.max_per_minute
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def serve_forever(self):
+        await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+
+    def start_in_thread(self) -> "SMTPSink":
+        """Run the sink on a private event loop in a daemon thread"""
+        started = threading.Event()
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            self._loop.run_until_complete(self.start())
+            started.set()
+            self._loop.run_forever()
+
+        threading.Thread(target=run, name="smtp-sink", daemon=True).start()
+        started.wait(10)
+        return self
+
+    def stop(self):
+        if self._loop is not None and self._server is not None:
+            self._loop.call_soon_threadsafe(self._server.close)
+            self._loop.call_soon_threadsafe(self._loop.stop)
+
+    def wait_for_messages(self, count: int, timeout: float) -> bool:
+        """Block until at least ``count`` messages were accepted"""
+        deadline = time.monotonic() + timeout
+        while self.stats.snapshot()["messages"] < count:
+            if time.monotonic() > deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local SMTP sink with latency and error injection")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=2525)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--connect-latency-ms", type=float, default=0.0)
+    parser.add_argument("--tempfail-rate", type=float, default=0.0)
+    parser.add_argument("--permfail-rate", type=float, default=0.0)
+    parser.add_argument("--disconnect-rate", type=float, default=0.0)
+    parser.add_argument("--max-per-minute", type=int, default=0,
+                        help="reply 421 to MAIL FROM beyond this many messages a minute")
+    parser.add_argument("--tls-cert")
+    parser.add_argument("--tls-key")
+    args = parser.parse_args()
+
+    sink = SMTPSink(
+        host=args.host,
+        port=args.port,
+        latency_ms=args.latency_ms,
+        connect_latency_ms=args.connect_latency_ms,
+        tempfail_rate=args.tempfail_rate,
+        permfail_rate=args.permfail_rate,
+        disconnect_rate=args.disconnect_rate,
+        max_per_minute=args.max_per_minute,
+        tls_cert=args.tls_cert,
+        tls_key=args.tls_key,
+    )
+    print(f"SMTP sink listening on {args.host}:{args.port}")
+    try:
+        asyncio.run(sink.serve_forever())
+    except KeyboardInterrupt:
+        print(sink.stats.snapshot())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from message_builder import encode_body
+from templates import get_attendance_email_part, get_attendance_email_template, get_notification_part
+
+# Message composition for bulk jobs. Everything here is picklable and free
+# of app state, so chunks of messages can be rendered and MIME-encoded in
+# the render process pool; the outbox payload then carries the encoded
+# body and the sender only adds headers.
+
+
+def attendance_message(
+    student_name: str, subject: str, date: str, period: str, status: str
+) -> Tuple[str, str, str]:
+    """Subject, text and HTML of one attendance notification"""
+    html_content = get_attendance_email_template(student_name, subject, date, period, status)
+    return (
+        attendance_subject(subject, status),
+        attendance_text(student_name, subject, date, period, status),
+        html_content,
+    )
+
+
+def attendance_subject(subject: str, status: str) -> str:
+    return f"📚 Attendance Update - {subject} ({status.title()})"
+
+
+def attendance_text(student_name: str, subject: str, date: str, period: str, status: str) -> str:
+    """Plain-text fallback of an attendance notification"""
+    return f"""
+    Attendance Update for {student_name}
+
+    Subject: {subject}
+    Date: {date}
+    Period: {period}
+    Status: {status.upper()}
+
+    {"Great job! Keep up the excellent attendance record!" if status.lower() == "present" else "Please ensure regular attendance for better academic performance."}
+
+    Recorded: {datetime.now().strftime('%B %d, %Y at %I:%M %p')}
+    """
+
+
+def mime_fields(text: str, html: Optional[str], html_part: Optional[bytes] = None) -> Dict[str, str]:
+    """The encoded body as it is stored in a payload's ``mime`` key; always ASCII"""
+    content_type, body = encode_body(text, html, html_part)
+    return {"content_type": content_type.decode("ascii"), "body": body.decode("ascii")}
+
+
+def payload_mime(payload: dict) -> Optional[Tuple[bytes, bytes]]:
+    """The pre-encoded body of an outbox payload, for MessageBuilder, if it has one"""
+    mime = payload.get("mime")
+    if not mime:
+        return None
+    return mime["content_type"].encode("ascii"), mime["body"].encode("ascii")
+
+
+def render_attendance(records: List[dict]) -> List[dict]:
+    """Outbox payloads for a chunk of attendance records, bodies already encoded"""
+    payloads = []
+    for record in records:
+        fields = (record["student_name"], record["subject"], record["date"], record["period"], record["status"])
+        # The layout's static HTML is pre-encoded; only the fields are encoded here
+        html, html_part = get_attendance_email_part(*fields)
+        text = attendance_text(*fields)
+        payloads.append({
+            "to": [record["student_email"]],
+            "subject": attendance_subject(record["subject"], record["status"]),
+            "body": text,
+            "html_body": html,
+            "mime": mime_fields(text, html, html_part),
+        })
+    return payloads
+
+
+def certificate_message(spec: dict, certificate: dict) -> dict:
+    """Subject and encoded body of the email that carries a participant's certificate"""
+    subject = f"Your certificate for {spec['event']}"
+    message = (
+        f"Dear {certificate['name']},\n\n"
+        f"Congratulations on completing {spec['event']}. Your certificate is attached.\n\n"
+        f"Certificate ID: {certificate['credential_id']}"
+    )
+    html, html_part = get_notification_part(subject, message, "success")
+    return {"subject": subject, "body": message, "html_body": html, "mime": mime_fields(message, html, html_part)}
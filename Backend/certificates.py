@@ -0,0 +1,376 @@
+import asyncio
+import io
+import json
+import re
+import time
+import unicodedata
+import zlib
+import logging
+from concurrent.futures import BrokenExecutor
+from functools import lru_cache
+from typing import Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Same designs as CertificateGenerator.jsx: background, border, accent
+STYLES: Dict[str, Dict[str, str]] = {
+    "classic": {"background": "#f8f4e6", "border": "#8B4513", "accent": "#B8860B"},
+    "modern": {"background": "#ffffff", "border": "#2c3e50", "accent": "#3498db"},
+    "elegant": {"background": "#fffaf0", "border": "#d4af37", "accent": "#a67c00"},
+}
+
+# A4 landscape, in points
+PAGE_WIDTH, PAGE_HEIGHT = 842, 595
+CENTER = PAGE_WIDTH / 2
+TEXT_GRAY = (0.29, 0.33, 0.39)
+TEXT_DARK = (0.12, 0.16, 0.22)
+
+# Advance widths (per 1000 em) of the standard Helvetica fonts for ASCII
+# 32..126, from their Adobe font metrics; needed to centre text
+_HELVETICA = (
+    "278 278 355 556 556 889 667 191 333 333 389 584 278 333 278 278 556 556 556 556 556 556 556 556 556 556"
+    " 278 278 584 584 584 556 1015 667 667 722 722 667 611 778 722 278 500 667 556 833 722 778 667 778 722 667"
+    " 611 722 667 944 667 667 611 278 278 278 469 556 333 556 556 500 556 556 278 556 556 222 222 500 222 833"
+    " 556 556 556 556 333 500 278 556 500 722 500 500 500 334 260 334 584"
+)
+_HELVETICA_BOLD = (
+    "278 333 474 556 556 889 722 238 333 333 389 584 278 333 278 278 556 556 556 556 556 556 556 556 556 556"
+    " 333 333 584 584 584 611 975 722 722 722 722 667 611 778 722 278 556 722 611 833 722 778 667 778 722 667"
+    " 611 722 667 944 667 667 611 333 278 333 584 556 333 556 611 556 611 556 333 611 611 278 278 556 278 889"
+    " 611 611 611 611 389 556 333 611 556 778 556 556 500 389 280 389 584"
+)
+WIDTHS = {
+    "F1": dict(zip(map(chr, range(32, 127)), map(int, _HELVETICA.split()))),
+    "F2": dict(zip(map(chr, range(32, 127)), map(int, _HELVETICA_BOLD.split()))),
+}
+
+# Objects that are the same in every certificate: catalog, page tree,
+# page, and the two standard fonts. Object 4 is the page content.
+_STATIC_OBJECTS = {
+    1: b"<< /Type /Catalog /Pages 2 0 R >>",
+    2: b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+    3: (
+        f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {PAGE_WIDTH} {PAGE_HEIGHT}]"
+        " /Resources << /Font << /F1 5 0 R /F2 6 0 R >> >> /Contents 4 0 R >>"
+    ).encode("ascii"),
+    5: b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>",
+    6: b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica-Bold /Encoding /WinAnsiEncoding >>",
+}
+
+
+def _rgb(hex_color: str) -> Tuple[float, float, float]:
+    value = hex_color.lstrip("#")
+    return tuple(round(int(value[i:i + 2], 16) / 255, 3) for i in (0, 2, 4))
+
+
+def _pdf_string(text: str) -> bytes:
+    """A PDF literal string in WinAnsi; characters it lacks become '?'"""
+    encoded = text.encode("cp1252", errors="replace")
+    return b"(" + encoded.replace(b"\\", b"\\\\").replace(b"(", b"\\(").replace(b")", b"\\)") + b")"
+
+
+def text_width(text: str, font: str, size: float) -> float:
+    widths = WIDTHS[font]
+    total = 0
+    for ch in text:
+        width = widths.get(ch)
+        if width is None:
+            # Accented letters are as wide as their base letter
+            width = widths.get(unicodedata.normalize("NFKD", ch)[:1], 556)
+        total += width
+    return total * size / 1000
+
+
+def _text(text: str, font: str, size: float, y: float, color, x: Optional[float] = None, max_width: float = 700) -> bytes:
+    """Draw one line, centred on ``x`` (the page centre by default) and shrunk to fit ``max_width``"""
+    width = text_width(text, font, size)
+    if width > max_width:
+        size = size * max_width / width
+        width = max_width
+    left = (CENTER if x is None else x) - width / 2
+    r, g, b = color
+    return (
+        f"BT {r} {g} {b} rg /{font} {size:.2f} Tf {left:.2f} {y:.2f} Td ".encode("ascii")
+        + _pdf_string(text) + b" Tj ET\n"
+    )
+
+
+def _line(x1: float, y1: float, x2: float, y2: float, color, width: float) -> bytes:
+    r, g, b = color
+    return f"{r} {g} {b} RG {width} w {x1:.2f} {y1:.2f} m {x2:.2f} {y2:.2f} l S\n".encode("ascii")
+
+
+def _circle(cx: float, cy: float, radius: float, color, width: float) -> bytes:
+    # Four Bézier quarter arcs
+    k = radius * 0.5523
+    r, g, b = color
+    return (
+        f"{r} {g} {b} RG {width} w {cx + radius} {cy} m "
+        f"{cx + radius} {cy + k} {cx + k} {cy + radius} {cx} {cy + radius} c "
+        f"{cx - k} {cy + radius} {cx - radius} {cy + k} {cx - radius} {cy} c "
+        f"{cx - radius} {cy - k} {cx - k} {cy - radius} {cx} {cy - radius} c "
+        f"{cx + k} {cy - radius} {cx + radius} {cy - k} {cx + radius} {cy} c S\n"
+    ).encode("ascii")
+
+
+class CertificateTemplate:
+    """One event's certificate, with everything but the participant's lines prepared once.
+
+    The page background, borders, titles, event, date, signature block and
+    seal are drawn into a content-stream prefix at construction; ``render``
+    only adds the participant's name, hours and credential ID, compresses
+    the page and writes the cross-reference table. Output is deterministic
+    (no timestamps), so re-rendering after a crash gives identical bytes.
+    """
+
+    def __init__(
+        self,
+        style: str,
+        event: str,
+        date: str,
+        signature: Optional[str] = None,
+        instructor: Optional[str] = None,
+        watermark: Optional[str] = None,
+    ):
+        colors = STYLES.get(style.lower(), STYLES["classic"])
+        background, border, accent = (_rgb(colors[key]) for key in ("background", "border", "accent"))
+        self.accent = accent
+        ops = [
+            f"{background[0]} {background[1]} {background[2]} rg 0 0 {PAGE_WIDTH} {PAGE_HEIGHT} re f\n".encode("ascii"),
+            f"{border[0]} {border[1]} {border[2]} RG 8 w 4 4 {PAGE_WIDTH - 8} {PAGE_HEIGHT - 8} re S\n".encode("ascii"),
+            f"{accent[0]} {accent[1]} {accent[2]} RG 2 w 20 20 {PAGE_WIDTH - 40} {PAGE_HEIGHT - 40} re S\n".encode("ascii"),
+        ]
+        if watermark:
+            # Faint diagonal text: the background darkened slightly
+            shade = tuple(round(channel * 0.9, 3) for channel in background)
+            size = min(72.0, 700 * 72 / max(text_width(watermark, "F2", 72), 1))
+            half = text_width(watermark, "F2", size) / 2
+            ops.append(
+                f"q 0.7071 0.7071 -0.7071 0.7071 {CENTER} {PAGE_HEIGHT / 2} cm "
+                f"BT {shade[0]} {shade[1]} {shade[2]} rg /F2 {size:.2f} Tf {-half:.2f} {-size / 3:.2f} Td ".encode("ascii")
+                + _pdf_string(watermark) + b" Tj ET Q\n"
+            )
+        ops += [
+            _text("CERTIFICATE", "F2", 48, 470, accent),
+            _text("OF ACHIEVEMENT", "F1", 16, 445, TEXT_GRAY),
+            _text("This is to certify that", "F1", 16, 395, TEXT_GRAY),
+            _line(CENTER - 280, 378, CENTER + 280, 378, accent, 2),
+            _text(event, "F2", 20, 280, TEXT_DARK, max_width=640),
+        ]
+        if instructor:
+            ops.append(_text(f"Under the guidance of {instructor}", "F1", 12, 258, TEXT_GRAY))
+        ops.append(_text(f"on {date}", "F1", 12, 238, TEXT_GRAY))
+        for x, label, value in (
+            (PAGE_WIDTH * 0.3, "Authorized Signature", signature or "Organization Representative"),
+            (PAGE_WIDTH * 0.7, "Date", date),
+        ):
+            ops += [
+                _line(x - 90, 130, x + 90, 130, accent, 2),
+                _text(label, "F1", 10, 115, TEXT_GRAY, x=x, max_width=180),
+                _text(value, "F2", 11, 100, TEXT_DARK, x=x, max_width=180),
+            ]
+        ops += [
+            _circle(PAGE_WIDTH - 80, 80, 40, accent, 2),
+            _text("OFFICIAL SEAL", "F1", 7, 77, accent, x=PAGE_WIDTH - 80),
+        ]
+        self._prefix = b"".join(ops)
+
+    def render(self, name: str, credential_id: str, hours: Optional[str] = None) -> bytes:
+        content = [
+            self._prefix,
+            _text(f"Certificate ID: {credential_id}", "F1", 8, PAGE_HEIGHT - 40, TEXT_GRAY, x=130, max_width=220),
+            _text(name, "F2", 30, 340, TEXT_DARK, max_width=620),
+        ]
+        if hours:
+            content.append(_text(f"Has successfully completed {hours} hours of", "F1", 12, 305, TEXT_GRAY))
+        stream = zlib.compress(b"".join(content), 6)
+
+        objects = dict(_STATIC_OBJECTS)
+        objects[4] = b"<< /Length %d /Filter /FlateDecode >>\nstream\n" % len(stream) + stream + b"\nendstream"
+        out = io.BytesIO()
+        out.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+        offsets = []
+        for number in range(1, len(objects) + 1):
+            offsets.append(out.tell())
+            out.write(b"%d 0 obj\n" % number + objects[number] + b"\nendobj\n")
+        xref = out.tell()
+        out.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+        out.write(b"".join(b"%010d 00000 n \n" % offset for offset in offsets))
+        out.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref))
+        return out.getvalue()
+
+
+@lru_cache(maxsize=32)
+def _cached_template(spec_json: str) -> CertificateTemplate:
+    return CertificateTemplate(**json.loads(spec_json))
+
+
+def render_certificates(
+    spec: dict, participants: List[dict], compose: Callable[[dict, dict], dict]
+) -> List[Tuple[bytes, dict]]:
+    """Render a chunk of certificates and their emails; runs in the render process pool.
+
+    The template for ``spec`` is built once per worker process and reused
+    for every chunk of the same event. ``compose(spec, participant)``
+    returns the email's payload fields.
+    """
+    template = _cached_template(json.dumps(spec, sort_keys=True))
+    return [
+        (
+            template.render(participant["name"], participant["credential_id"], participant.get("hours")),
+            compose(spec, participant),
+        )
+        for participant in participants
+    ]
+
+
+def certificate_filename(name: str) -> str:
+    """``Ada_Lovelace_certificate.pdf``, as the React generator names its downloads"""
+    stem = re.sub(r"[^\w.-]+", "_", name.strip(), flags=re.UNICODE).strip("_") or "certificate"
+    return f"{stem}_certificate.pdf"
+
+
+class CertificatePipeline:
+    """Renders certificate jobs in a process pool and hands them to delivery.
+
+    Participants are persisted as outbox jobs in RENDER_STATUS. The
+    pipeline claims them ``chunk_size`` at a time under a lease and renders
+    each chunk, with its emails, in ``pool`` (a RenderPool), keeping up to
+    ``max_in_flight`` chunks there. ``compose`` builds each email in the
+    worker, so it must be a top-level function. The PDFs are stored as
+    attachments, the chunk is queued in one transaction and
+    ``on_rendered`` wakes the senders. Sending therefore starts with the
+    first chunk while later ones are still rendering.
+
+    Nothing is held only in memory: after a crash, jobs whose lease ran
+    out are claimed again and re-rendered to the same bytes. A chunk whose
+    render worker died goes straight back for the rebuilt pool, and a job
+    claimed ``max_attempts`` times is failed. Rendering pauses while
+    ``max_queued`` messages already wait to be sent, so a large event
+    never renders far ahead of the relays.
+    """
+
+    def __init__(
+        self,
+        outbox,
+        store,
+        pool,
+        compose: Callable[[dict, dict], dict],
+        on_rendered: Callable[[], None],
+        kind: str = "certificate",
+        chunk_size: int = 25,
+        max_in_flight: int = 4,
+        max_queued: int = 2000,
+        lease_seconds: float = 300.0,
+        poll_interval: float = 5.0,
+        max_attempts: int = 3,
+    ):
+        self.outbox = outbox
+        self.store = store
+        self.pool = pool
+        self.compose = compose
+        self.on_rendered = on_rendered
+        self.kind = kind
+        self.chunk_size = max(1, chunk_size)
+        self.max_in_flight = max(1, max_in_flight)
+        self.max_queued = max_queued
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.max_attempts = max(1, max_attempts)
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._in_flight = 0
+        self._stats = {"rendered": 0, "failed": 0, "retried": 0, "chunks": 0, "render_seconds": 0.0}
+
+    def start(self):
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run(), name="certificate-pipeline")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def notify(self):
+        """Wake the pipeline for newly added certificate jobs"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _run(self):
+        chunks = set()
+        try:
+            while True:
+                self._wakeup.clear()
+                try:
+                    while len(chunks) < self.max_in_flight:
+                        jobs = await asyncio.to_thread(self._claim)
+                        if not jobs:
+                            break
+                        chunks.add(asyncio.create_task(self._render(jobs)))
+                except Exception as e:
+                    logger.error(f"Claiming certificate jobs failed: {str(e)}")
+                self._in_flight = len(chunks)
+                if chunks:
+                    _, chunks = await asyncio.wait(chunks, return_when=asyncio.FIRST_COMPLETED)
+                    continue
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            for chunk in chunks:
+                chunk.cancel()
+            # Cancelled chunks keep their lease and are picked up again later
+            await asyncio.gather(*chunks, return_exceptions=True)
+
+    def _claim(self) -> list:
+        if self.outbox.depth() >= self.max_queued:
+            return []
+        return self.outbox.claim_render(self.kind, self.chunk_size, self.lease_seconds, self.max_attempts)
+
+    async def _render(self, jobs: list):
+        groups: Dict[str, list] = {}
+        for job in jobs:
+            groups.setdefault(json.dumps(job.payload["template"], sort_keys=True), []).append(job)
+        for spec_json, group in groups.items():
+            try:
+                started = time.perf_counter()
+                results = await self.pool.run(
+                    render_certificates, json.loads(spec_json),
+                    [job.payload["certificate"] for job in group], self.compose,
+                )
+                self._stats["render_seconds"] += time.perf_counter() - started
+                refs = await asyncio.to_thread(self._store, group, [pdf for pdf, _ in results])
+                rendered = [
+                    (job.id, {**message, "to": job.payload["to"], "attachments": [ref]})
+                    for job, (_, message), ref in zip(group, results, refs)
+                ]
+                await asyncio.to_thread(self.outbox.mark_rendered, rendered)
+            except asyncio.CancelledError:
+                raise
+            except BrokenExecutor as e:
+                # A render worker died and the pool has been replaced; hand
+                # the chunk straight back rather than waiting out the lease
+                logger.error(f"Render worker died, {len(group)} certificates will be retried: {str(e)}")
+                await asyncio.to_thread(self.outbox.release_render, [job.id for job in group])
+                self._stats["retried"] += len(group)
+                continue
+            except Exception as e:
+                logger.error(f"Rendering {len(group)} certificates failed: {str(e)}")
+                for job in group:
+                    await asyncio.to_thread(self.outbox.mark_failed, job.id, f"Certificate rendering failed: {str(e)}")
+                self._stats["failed"] += len(group)
+                continue
+            self._stats["rendered"] += len(group)
+            self._stats["chunks"] += 1
+            self.on_rendered()
+
+    def _store(self, jobs: list, pdfs: List[bytes]) -> List[dict]:
+        return [
+            self.store.save(io.BytesIO(pdf), certificate_filename(job.payload["certificate"]["name"]), "application/pdf")
+            for job, pdf in zip(jobs, pdfs)
+        ]
+
+    def stats(self) -> dict:
+        return {**self._stats, "render_seconds": round(self._stats["render_seconds"], 3), "chunks_in_flight": self._in_flight}
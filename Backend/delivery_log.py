@@ -0,0 +1,227 @@
+import asyncio
+import sqlite3
+import threading
+import time
+import logging
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS deliveries (
+    id INTEGER PRIMARY KEY,
+    ts REAL NOT NULL,
+    job_id TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    recipient TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempt INTEGER NOT NULL,
+    relay TEXT,
+    smtp_code INTEGER,
+    subject TEXT,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_deliveries_ts ON deliveries (ts);
+CREATE INDEX IF NOT EXISTS idx_deliveries_recipient ON deliveries (recipient, ts);
+CREATE INDEX IF NOT EXISTS idx_deliveries_status ON deliveries (status, ts);
+CREATE INDEX IF NOT EXISTS idx_deliveries_kind ON deliveries (kind, ts);
+CREATE INDEX IF NOT EXISTS idx_deliveries_job ON deliveries (job_id, ts);
+"""
+
+COLUMNS = ("id", "ts", "job_id", "kind", "recipient", "status", "attempt", "relay", "smtp_code", "subject", "error")
+
+# Row as buffered before it has an id
+PendingRow = Tuple[float, str, str, str, str, int, Optional[str], Optional[int], Optional[str], Optional[str]]
+
+
+class DeliveryLog:
+    """Append-only SQLite record of every delivery attempt, one row per recipient.
+
+    ``record`` only appends to an in-memory buffer, so logging never waits
+    on disk on the send path; a background task writes the buffer out in
+    one transaction every ``flush_interval`` seconds, or sooner once
+    ``batch_size`` rows are waiting. If the disk falls behind by more than
+    ``max_pending`` rows the oldest are dropped (and counted) rather than
+    letting memory grow. Rows older than ``retention_days`` are pruned.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        flush_interval: float = 1.0,
+        batch_size: int = 500,
+        max_pending: int = 100000,
+        retention_days: float = 90,
+    ):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.batch_size = max(1, batch_size)
+        self.retention_days = retention_days
+        self._pending: "deque[PendingRow]" = deque(maxlen=max(1, max_pending))
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._last_prune = 0.0
+        self._stats = {"written": 0, "dropped": 0, "flushes": 0}
+        self._conn().executescript(SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, isolation_level=None, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def record(
+        self,
+        job_id: str,
+        kind: str,
+        recipients: List[str],
+        status: str,
+        attempt: int,
+        relay: Optional[str] = None,
+        smtp_code: Optional[int] = None,
+        subject: Optional[str] = None,
+        error: Optional[str] = None,
+    ):
+        """Buffer one attempt's outcome for each of its recipients"""
+        now = time.time()
+        with self._lock:
+            for recipient in recipients:
+                if len(self._pending) == self._pending.maxlen:
+                    self._stats["dropped"] += 1
+                self._pending.append((
+                    now, job_id, kind, recipient.lower(), status, attempt, relay, smtp_code, subject, error,
+                ))
+            full = len(self._pending) >= self.batch_size
+        if full and self._wakeup is not None:
+            self._wakeup.set()
+
+    def flush(self) -> int:
+        """Write every buffered row in one transaction; returns how many"""
+        with self._lock:
+            rows = list(self._pending)
+            self._pending.clear()
+        if not rows:
+            return 0
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(
+                "INSERT INTO deliveries (ts, job_id, kind, recipient, status, attempt, relay, smtp_code, subject, error)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+        except Exception:
+            conn.execute("ROLLBACK")
+            with self._lock:
+                # Put them back in front of anything buffered since
+                self._pending.extendleft(reversed(rows))
+            raise
+        conn.execute("COMMIT")
+        with self._lock:
+            self._stats["written"] += len(rows)
+            self._stats["flushes"] += 1
+        return len(rows)
+
+    def prune(self) -> int:
+        """Delete rows older than the retention period"""
+        if self.retention_days <= 0:
+            return 0
+        cutoff = time.time() - self.retention_days * 86400
+        return self._conn().execute("DELETE FROM deliveries WHERE ts < ?", (cutoff,)).rowcount
+
+    def start(self):
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run(), name="delivery-log-writer")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        self._wakeup = None
+        try:
+            self.flush()
+        except sqlite3.Error as e:
+            logger.error(f"Final delivery log flush failed: {str(e)}")
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await asyncio.to_thread(self.flush)
+                if time.monotonic() - self._last_prune > 3600:
+                    self._last_prune = time.monotonic()
+                    removed = await asyncio.to_thread(self.prune)
+                    if removed:
+                        logger.info(f"Pruned {removed} old delivery log rows")
+            except sqlite3.Error as e:
+                logger.error(f"Delivery log flush failed: {str(e)}")
+
+    def query(
+        self,
+        recipient: Optional[str] = None,
+        status: Optional[str] = None,
+        kind: Optional[str] = None,
+        job_id: Optional[str] = None,
+        since: Optional[float] = None,
+        until: Optional[float] = None,
+        before_id: Optional[int] = None,
+        limit: int = 50,
+    ) -> List[dict]:
+        """Newest-first page of rows matching every given filter.
+
+        Pages are keyed on ``before_id`` (the last id of the previous page)
+        rather than an offset, so deep pages cost the same as the first.
+        """
+        clauses, params = [], []
+        for column, value in (("recipient", recipient.lower() if recipient else None), ("status", status),
+                              ("kind", kind), ("job_id", job_id)):
+            if value is not None:
+                clauses.append(f"{column} = ?")
+                params.append(value)
+        if since is not None:
+            clauses.append("ts >= ?")
+            params.append(since)
+        if until is not None:
+            clauses.append("ts < ?")
+            params.append(until)
+        if before_id is not None:
+            clauses.append("id < ?")
+            params.append(before_id)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        rows = self._conn().execute(
+            f"SELECT {', '.join(COLUMNS)} FROM deliveries {where} ORDER BY id DESC LIMIT ?",
+            (*params, limit),
+        ).fetchall()
+        return [dict(zip(COLUMNS, row)) for row in rows]
+
+    def daily_counts(self, since: Optional[float] = None, until: Optional[float] = None) -> List[dict]:
+        """Row counts per local day, kind and status"""
+        clauses, params = [], []
+        if since is not None:
+            clauses.append("ts >= ?")
+            params.append(since)
+        if until is not None:
+            clauses.append("ts < ?")
+            params.append(until)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        rows = self._conn().execute(
+            f"SELECT date(ts, 'unixepoch', 'localtime') AS day, kind, status, COUNT(*) FROM deliveries {where}"
+            " GROUP BY day, kind, status ORDER BY day",
+            params,
+        ).fetchall()
+        return [{"day": day, "kind": kind, "status": status, "count": count} for day, kind, status, count in rows]
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {**self._stats, "pending": len(self._pending)}
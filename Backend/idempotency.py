@@ -0,0 +1,497 @@
+import asyncio
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+
+from metrics import Counter
+
+logger = logging.getLogger(__name__)
+
+# begin() outcomes
+IDEM_NEW = "new"
+IDEM_PENDING = "pending"
+IDEM_DONE = "done"
+IDEM_MISMATCH = "mismatch"
+
+# How IdempotencyMiddleware treats a route: buffer the body and allow a
+# content-hash key, buffer it but only honour the header, or leave a
+# streaming upload alone and key on the header alone
+ROUTE_CONTENT = "content"
+ROUTE_KEYED = "keyed"
+ROUTE_STREAM = "stream"
+
+IDEMPOTENCY_REQUESTS = Counter(
+    "idempotency_requests_total",
+    "Requests carrying an idempotency key, by outcome (new, replayed, pending, mismatch)",
+    ("outcome",),
+)
+
+
+@dataclass
+class StoredResponse:
+    status: int
+    content_type: str
+    body: bytes
+    # Hash of the request that produced it; streamed uploads are only
+    # hashed as they are read, so their key is claimed without one
+    fingerprint: str = ""
+
+    def to_json(self) -> str:
+        return json.dumps({
+            "status": self.status, "content_type": self.content_type, "body": self.body.decode("utf-8"),
+            "fingerprint": self.fingerprint,
+        })
+
+    @classmethod
+    def from_json(cls, raw: str) -> "StoredResponse":
+        data = json.loads(raw)
+        return cls(data["status"], data["content_type"], data["body"].encode("utf-8"), data.get("fingerprint", ""))
+
+
+class IdempotencyStore:
+    """Interface for remembering the response to each idempotency key.
+
+    ``begin`` atomically claims a key: the first caller gets IDEM_NEW and
+    must later call ``complete`` (or ``abort`` to let a retry through);
+    concurrent repeats see IDEM_PENDING, later ones IDEM_DONE with the
+    stored response. A key reused for a different request body gives
+    IDEM_MISMATCH; with ``fingerprint`` None that check is left to the
+    caller, against the fingerprint of the stored response. A pending
+    claim lapses after ``pending_ttl`` unless ``extend`` renews it.
+    """
+
+    def begin(
+        self, key: str, fingerprint: Optional[str], pending_ttl: float
+    ) -> Tuple[str, Optional[StoredResponse]]:
+        raise NotImplementedError
+
+    def extend(self, key: str, pending_ttl: float):
+        """Keep a pending claim alive while its request is still being processed"""
+        raise NotImplementedError
+
+    def complete(self, key: str, response: StoredResponse, ttl: float):
+        raise NotImplementedError
+
+    def abort(self, key: str):
+        raise NotImplementedError
+
+    def sweep(self) -> int:
+        """Delete expired entries and return how many were removed"""
+        raise NotImplementedError
+
+    def __len__(self) -> int:
+        raise NotImplementedError
+
+
+class MemoryIdempotencyStore(IdempotencyStore):
+    """Per-process LRU: an OrderedDict bounded at ``max_entries``, with expiry"""
+
+    def __init__(self, max_entries: int = 10000):
+        self.max_entries = max(1, max_entries)
+        # key -> (fingerprint, expires_at, response or None while pending)
+        self._entries: "OrderedDict[str, Tuple[str, float, Optional[StoredResponse]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def begin(
+        self, key: str, fingerprint: Optional[str], pending_ttl: float
+    ) -> Tuple[str, Optional[StoredResponse]]:
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > now:
+                self._entries.move_to_end(key)
+                stored_fingerprint, _, response = entry
+                if fingerprint is not None and stored_fingerprint != fingerprint:
+                    return IDEM_MISMATCH, None
+                if response is None:
+                    return IDEM_PENDING, None
+                return IDEM_DONE, response
+            self._entries[key] = (fingerprint or "", now + pending_ttl, None)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            return IDEM_NEW, None
+
+    def extend(self, key: str, pending_ttl: float):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] is None:
+                self._entries[key] = (entry[0], time.time() + pending_ttl, None)
+
+    def complete(self, key: str, response: StoredResponse, ttl: float):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries[key] = (response.fingerprint or entry[0], time.time() + ttl, response)
+
+    def abort(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def sweep(self) -> int:
+        now = time.time()
+        with self._lock:
+            expired = [key for key, entry in self._entries.items() if entry[1] <= now]
+            for key in expired:
+                del self._entries[key]
+        return len(expired)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+
+class SQLiteIdempotencyStore(IdempotencyStore):
+    """Store shared by every uvicorn worker on the host through one SQLite file.
+
+    Claiming a key is a single INSERT, so two workers racing on the same
+    key cannot both send. ``last_used`` drives LRU eviction once the table
+    grows past ``max_entries``; the bound is enforced every few inserts
+    rather than on each one to keep the hot path to one statement.
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS idempotency (
+        key TEXT PRIMARY KEY,
+        fingerprint TEXT NOT NULL,
+        response TEXT,
+        expires_at REAL NOT NULL,
+        last_used REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_idempotency_expiry ON idempotency (expires_at);
+    CREATE INDEX IF NOT EXISTS idx_idempotency_lru ON idempotency (last_used);
+    """
+
+    TRIM_EVERY = 64
+
+    def __init__(self, path: str, max_entries: int = 10000):
+        self.path = path
+        self.max_entries = max(1, max_entries)
+        self._local = threading.local()
+        self._inserts = 0
+        self._conn().executescript(self.SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, isolation_level=None, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def begin(
+        self, key: str, fingerprint: Optional[str], pending_ttl: float
+    ) -> Tuple[str, Optional[StoredResponse]]:
+        conn = self._conn()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT fingerprint, response, expires_at FROM idempotency WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and row[2] > now:
+                conn.execute("UPDATE idempotency SET last_used = ? WHERE key = ?", (now, key))
+                if fingerprint is not None and row[0] != fingerprint:
+                    outcome = (IDEM_MISMATCH, None)
+                elif row[1] is None:
+                    outcome = (IDEM_PENDING, None)
+                else:
+                    outcome = (IDEM_DONE, StoredResponse.from_json(row[1]))
+            else:
+                conn.execute(
+                    "INSERT OR REPLACE INTO idempotency (key, fingerprint, response, expires_at, last_used)"
+                    " VALUES (?, ?, NULL, ?, ?)",
+                    (key, fingerprint or "", now + pending_ttl, now),
+                )
+                outcome = (IDEM_NEW, None)
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        if outcome[0] == IDEM_NEW:
+            self._inserts += 1
+            if self._inserts % self.TRIM_EVERY == 0:
+                self._trim()
+        return outcome
+
+    def extend(self, key: str, pending_ttl: float):
+        now = time.time()
+        self._conn().execute(
+            "UPDATE idempotency SET expires_at = ?, last_used = ? WHERE key = ? AND response IS NULL",
+            (now + pending_ttl, now, key),
+        )
+
+    def complete(self, key: str, response: StoredResponse, ttl: float):
+        self._conn().execute(
+            "UPDATE idempotency SET response = ?, expires_at = ?,"
+            " fingerprint = CASE WHEN ? != '' THEN ? ELSE fingerprint END WHERE key = ?",
+            (response.to_json(), time.time() + ttl, response.fingerprint, response.fingerprint, key),
+        )
+
+    def abort(self, key: str):
+        self._conn().execute("DELETE FROM idempotency WHERE key = ? AND response IS NULL", (key,))
+
+    def _trim(self):
+        removed = self.sweep()
+        excess = len(self) - self.max_entries
+        if excess > 0:
+            removed += self._conn().execute(
+                "DELETE FROM idempotency WHERE key IN"
+                " (SELECT key FROM idempotency ORDER BY last_used LIMIT ?)",
+                (excess,),
+            ).rowcount
+        if removed:
+            logger.info(f"Trimmed {removed} idempotency entries")
+
+    def sweep(self) -> int:
+        return self._conn().execute(
+            "DELETE FROM idempotency WHERE expires_at <= ?", (time.time(),)
+        ).rowcount
+
+    def __len__(self) -> int:
+        return self._conn().execute("SELECT COUNT(*) FROM idempotency").fetchone()[0]
+
+
+def create_idempotency_store(backend: str, path: Optional[str] = None, max_entries: int = 10000) -> IdempotencyStore:
+    """Build the configured idempotency store ("memory" or "sqlite")"""
+    backend = backend.lower()
+    if backend == "memory":
+        return MemoryIdempotencyStore(max_entries)
+    if backend == "sqlite":
+        return SQLiteIdempotencyStore(path or "idempotency.db", max_entries)
+    raise ValueError(f"Unknown idempotency store backend: {backend}")
+
+
+class IdempotencyMiddleware:
+    """ASGI middleware that replays the stored response for repeated POSTs.
+
+    ``routes`` maps each protected path to a ROUTE_* mode. Small JSON/query
+    requests are buffered so a reused key can be checked against the
+    request and, for ROUTE_CONTENT with ``hash_content`` on, a missing key
+    derived from a hash of the request. Streaming and multipart uploads
+    are never buffered: they are hashed as the endpoint reads them, and a
+    retry with the same key is read and hashed before its response is
+    replayed, so a key reused for another upload is still rejected. Only
+    2xx responses are remembered; anything else releases the key so the
+    client's retry is processed normally. The claim on a key is renewed
+    every third of ``pending_ttl`` for as long as the request runs, so a
+    long upload is never processed twice.
+    """
+
+    def __init__(
+        self,
+        app,
+        store: IdempotencyStore,
+        routes: Dict[str, str],
+        ttl: float = 86400.0,
+        content_ttl: float = 600.0,
+        hash_content: bool = False,
+        pending_ttl: float = 60.0,
+    ):
+        self.app = app
+        self.store = store
+        self.routes = routes
+        self.ttl = ttl
+        self.content_ttl = content_ttl
+        self.hash_content = hash_content
+        self.pending_ttl = pending_ttl
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"] not in self.routes:
+            await self.app(scope, receive, send)
+            return
+
+        path = scope["path"]
+        header_key = None
+        content_type = boundary = b""
+        for name, value in scope["headers"]:
+            if name == b"idempotency-key":
+                header_key = value.decode("latin-1").strip()
+            elif name == b"content-type":
+                content_type = value.lower()
+                boundary = _multipart_boundary(value)
+
+        mode = self.routes[path]
+        # File uploads can be large: never buffer them, only honour a key
+        buffered = mode != ROUTE_STREAM and not content_type.startswith(b"multipart/")
+        if not buffered and not header_key:
+            await self.app(scope, receive, send)
+            return
+
+        hasher = _BodyHash(scope.get("query_string", b"") + b"\0", boundary)
+        if buffered:
+            chunks = []
+            more = True
+            while more:
+                message = await receive()
+                chunks.append(message.get("body", b""))
+                more = message.get("more_body", False)
+            body = b"".join(chunks)
+            hasher.update(body)
+            receive = _replay(body)
+        digest = hasher.hexdigest() if buffered else None
+        if header_key:
+            key, ttl = f"{path}:key:{header_key}", self.ttl
+        elif self.hash_content and mode == ROUTE_CONTENT:
+            # Identical request inside the window: treat it as a retry
+            key, ttl = f"{path}:sha256:{digest}", self.content_ttl
+        else:
+            await self.app(scope, receive, send)
+            return
+
+        # Store calls run in a thread: SQLite may wait on another worker's lock
+        outcome, stored = await asyncio.to_thread(self.store.begin, key, digest, self.pending_ttl)
+        if outcome == IDEM_DONE and not buffered and stored.fingerprint:
+            # Read the retried upload through to compare it with the original
+            if await _hash_body(receive, hasher) != stored.fingerprint:
+                outcome = IDEM_MISMATCH
+        if outcome == IDEM_DONE:
+            IDEMPOTENCY_REQUESTS.inc("replayed")
+            await _send_response(send, stored, replayed=True)
+            return
+        if outcome == IDEM_PENDING:
+            IDEMPOTENCY_REQUESTS.inc("pending")
+            await _send_response(send, _error(409, "A request with this idempotency key is still being processed"))
+            return
+        if outcome == IDEM_MISMATCH:
+            IDEMPOTENCY_REQUESTS.inc("mismatch")
+            await _send_response(send, _error(422, "Idempotency-Key was already used for a different request"))
+            return
+        IDEMPOTENCY_REQUESTS.inc("new")
+
+        if not buffered:
+            receive = _hashing(receive, hasher)
+        start = {}
+        body_parts = []
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                start.update(message)
+            elif message["type"] == "http.response.body":
+                body_parts.append(message.get("body", b""))
+            await send(message)
+
+        heartbeat = asyncio.create_task(self._keep_claimed(key))
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except asyncio.CancelledError:
+            # Cancelled with the request: release the key before the task goes
+            self.store.abort(key)
+            raise
+        except BaseException:
+            await asyncio.to_thread(self.store.abort, key)
+            raise
+        finally:
+            heartbeat.cancel()
+        status = start.get("status", 500)
+        if 200 <= status < 300:
+            content_type = "application/json"
+            for name, value in start.get("headers", []):
+                if name.lower() == b"content-type":
+                    content_type = value.decode("latin-1")
+            try:
+                response = StoredResponse(status, content_type, b"".join(body_parts), digest or hasher.hexdigest())
+                await asyncio.to_thread(self.store.complete, key, response, ttl)
+            except Exception as e:
+                logger.error(f"Failed to store idempotent response: {str(e)}")
+        else:
+            await asyncio.to_thread(self.store.abort, key)
+
+    async def _keep_claimed(self, key: str):
+        while True:
+            await asyncio.sleep(self.pending_ttl / 3)
+            try:
+                await asyncio.to_thread(self.store.extend, key, self.pending_ttl)
+            except Exception as e:
+                logger.error(f"Failed to renew idempotency claim: {str(e)}")
+
+
+def _multipart_boundary(content_type: bytes) -> bytes:
+    for param in content_type.split(b";")[1:]:
+        name, _, value = param.strip().partition(b"=")
+        if name.lower() == b"boundary":
+            return b"--" + value.strip(b'"')
+    return b""
+
+
+class _BodyHash:
+    """SHA-256 of a request body fed in chunks, leaving out the multipart
+    boundary: clients pick a new one for every retry of the same form."""
+
+    def __init__(self, prefix: bytes, boundary: bytes = b""):
+        self._hash = hashlib.sha256(prefix)
+        self._boundary = boundary
+        self._tail = b""
+
+    def update(self, chunk: bytes):
+        if not self._boundary:
+            self._hash.update(chunk)
+            return
+        # Hold back enough bytes to catch a boundary split across chunks
+        data = (self._tail + chunk).replace(self._boundary, b"")
+        keep = len(self._boundary) - 1
+        self._hash.update(data[:-keep])
+        self._tail = data[-keep:]
+
+    def hexdigest(self) -> str:
+        final = self._hash.copy()
+        final.update(self._tail)
+        return final.hexdigest()
+
+
+def _hashing(receive, hasher: _BodyHash):
+    """Wrap ``receive`` so every body chunk the app reads is also hashed"""
+    async def wrapped():
+        message = await receive()
+        if message["type"] == "http.request":
+            hasher.update(message.get("body", b""))
+        return message
+
+    return wrapped
+
+
+async def _hash_body(receive, hasher: _BodyHash) -> str:
+    """Read a request body to the end, hashing it without keeping it"""
+    more = True
+    while more:
+        message = await receive()
+        if message["type"] != "http.request":
+            break
+        hasher.update(message.get("body", b""))
+        more = message.get("more_body", False)
+    return hasher.hexdigest()
+
+
+def _replay(body: bytes):
+    sent = False
+
+    async def receive():
+        nonlocal sent
+        if not sent:
+            sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        return {"type": "http.disconnect"}
+
+    return receive
+
+
+def _error(status: int, detail: str) -> StoredResponse:
+    return StoredResponse(status, "application/json", json.dumps({"detail": detail}).encode("utf-8"))
+
+
+async def _send_response(send, response: StoredResponse, replayed: bool = False):
+    headers = [
+        (b"content-type", response.content_type.encode("latin-1")),
+        (b"content-length", str(len(response.body)).encode("ascii")),
+    ]
+    if replayed:
+        headers.append((b"idempotent-replayed", b"true"))
+    await send({"type": "http.response.start", "status": response.status, "headers": headers})
+    await send({"type": "http.response.body", "body": response.body})
@@ -0,0 +1,148 @@
+import asyncio
+import json
+import time
+import logging
+from typing import AsyncIterator, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class _JobWatcher:
+    """One poll loop for one job, broadcasting the latest snapshot.
+
+    Subscribers wait on a condition for the version to move past the one
+    they last saw, so a slow dashboard skips intermediate snapshots instead
+    of queueing them and every dashboard costs the same single poll.
+    """
+
+    def __init__(self, job_id: str):
+        self.job_id = job_id
+        self.latest: Optional[dict] = None
+        self.version = 0
+        self.done = False
+        self.subscribers = 0
+        self.condition = asyncio.Condition()
+        self.task: Optional[asyncio.Task] = None
+
+    async def publish(self, snapshot: Optional[dict], done: bool):
+        async with self.condition:
+            self.latest = snapshot
+            self.version += 1
+            self.done = done
+            self.condition.notify_all()
+
+
+class JobEventHub:
+    """Shares one progress poller per job between all of its SSE subscribers.
+
+    ``snapshot`` reads a job's current progress (or None if it does not
+    exist) and must include ``done`` once nothing is left in flight. The
+    hub polls it every ``interval`` seconds while anyone is watching, adds
+    throughput figures, and publishes only when the progress changed; the
+    poller stops when the job finishes or the last subscriber leaves.
+    """
+
+    def __init__(self, snapshot: Callable[[str], Optional[dict]], interval: float = 1.0):
+        self.snapshot = snapshot
+        self.interval = interval
+        self._watchers: Dict[str, _JobWatcher] = {}
+
+    async def subscribe(self, job_id: str) -> AsyncIterator[Optional[dict]]:
+        """Yield progress snapshots for ``job_id`` until it is done"""
+        watcher = self._watchers.get(job_id)
+        if watcher is None:
+            watcher = self._watchers[job_id] = _JobWatcher(job_id)
+            watcher.task = asyncio.create_task(self._poll(watcher), name=f"job-events-{job_id}")
+        watcher.subscribers += 1
+        seen = 0
+        try:
+            while True:
+                async with watcher.condition:
+                    await watcher.condition.wait_for(lambda: watcher.version != seen)
+                    seen = watcher.version
+                    snapshot, done = watcher.latest, watcher.done
+                yield snapshot
+                if done:
+                    return
+        finally:
+            watcher.subscribers -= 1
+            if watcher.subscribers == 0 and self._watchers.get(job_id) is watcher:
+                del self._watchers[job_id]
+                if watcher.task is not None:
+                    watcher.task.cancel()
+
+    async def _poll(self, watcher: _JobWatcher):
+        started = time.monotonic()
+        previous = None
+        last_finished, last_at = None, started
+        rate = 0.0
+        while True:
+            try:
+                snapshot = self.snapshot(watcher.job_id)
+            except Exception as e:
+                logger.error(f"Progress snapshot for job {watcher.job_id} failed: {str(e)}")
+                await asyncio.sleep(self.interval)
+                continue
+            if snapshot is None:
+                await watcher.publish(None, True)
+                return
+
+            now = time.monotonic()
+            counts = snapshot["counts"]
+            finished = counts.get("sent", 0) + counts.get("failed", 0)
+            if last_finished is not None and now > last_at:
+                # Smoothed over a few polls so one idle interval doesn't read as a stall
+                rate = 0.5 * rate + 0.5 * (finished - last_finished) / (now - last_at)
+            last_finished, last_at = finished, now
+            remaining = counts.get("queued", 0) + counts.get("sending", 0)
+
+            if snapshot != previous or snapshot["done"]:
+                previous = snapshot
+                await watcher.publish({
+                    **snapshot,
+                    "rate_per_second": round(rate, 2),
+                    "eta_seconds": round(remaining / rate, 1) if rate > 0 and remaining else None,
+                    "watching_for": round(now - started, 1),
+                }, snapshot["done"])
+            if snapshot["done"]:
+                return
+            await asyncio.sleep(self.interval)
+
+    def stats(self) -> dict:
+        return {
+            "jobs": len(self._watchers),
+            "subscribers": sum(watcher.subscribers for watcher in self._watchers.values()),
+        }
+
+
+async def sse_stream(events: AsyncIterator[Optional[dict]], heartbeat: float = 15.0) -> AsyncIterator[bytes]:
+    """Format hub snapshots as Server-Sent Events, with keep-alive comments.
+
+    Comments every ``heartbeat`` seconds keep proxies from closing a stream
+    whose job is quiet. The last event is ``done`` (or ``not_found``).
+    """
+    iterator = events.__aiter__()
+    next_event = asyncio.ensure_future(iterator.__anext__())
+    event_id = 0
+    try:
+        while True:
+            finished, _ = await asyncio.wait({next_event}, timeout=heartbeat)
+            if not finished:
+                yield b": keep-alive\n\n"
+                continue
+            try:
+                snapshot = next_event.result()
+            except StopAsyncIteration:
+                return
+            event_id += 1
+            if snapshot is None:
+                name = "not_found"
+            else:
+                name = "done" if snapshot["done"] else "progress"
+            yield f"id: {event_id}\nevent: {name}\ndata: {json.dumps(snapshot)}\n\n".encode("utf-8")
+            next_event = asyncio.ensure_future(iterator.__anext__())
+    finally:
+        # Cancelling the pending read runs the subscription's cleanup
+        next_event.cancel()
+        await asyncio.gather(next_event, return_exceptions=True)
+        await iterator.aclose()
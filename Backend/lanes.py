@@ -0,0 +1,73 @@
+import threading
+from collections import deque
+from typing import Dict, NamedTuple
+
+
+class Lane(NamedTuple):
+    name: str
+    priority: int  # lower is claimed first
+
+
+TRANSACTIONAL = Lane("transactional", 0)
+DEFAULT = Lane("default", 1)
+BULK = Lane("bulk", 2)
+
+LANES = {lane.name: lane for lane in (TRANSACTIONAL, DEFAULT, BULK)}
+
+# Which lane each kind of outbox job travels in. OTP and contact form mail
+# has a person waiting on it; single notifications go out like any other
+# email, while attendance blasts and other bulk sends can wait.
+KIND_LANES: Dict[str, Lane] = {
+    "otp": TRANSACTIONAL,
+    "contact": TRANSACTIONAL,
+    "email": DEFAULT,
+    "notification": DEFAULT,
+    "attendance_single": DEFAULT,
+    "fanout": BULK,
+    "attendance": BULK,
+    "attendance_digest": BULK,
+    "merge": BULK,
+    "certificate": BULK,
+}
+
+
+def lane_for(kind: str) -> Lane:
+    return KIND_LANES.get(kind, DEFAULT)
+
+
+def percentile(ordered: list, pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if not ordered:
+        return 0.0
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[rank]
+
+
+class LaneLatency:
+    """Sliding window of queue-to-delivery latencies per lane"""
+
+    def __init__(self, window: int = 2048):
+        self._samples = {name: deque(maxlen=window) for name in LANES}
+        self._counts = {name: 0 for name in LANES}
+        self._lock = threading.Lock()
+
+    def observe(self, lane: str, seconds: float):
+        with self._lock:
+            self._samples.setdefault(lane, deque(maxlen=2048)).append(seconds)
+            self._counts[lane] = self._counts.get(lane, 0) + 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            samples = {lane: sorted(values) for lane, values in self._samples.items()}
+            counts = dict(self._counts)
+        return {
+            lane: {
+                "delivered": counts.get(lane, 0),
+                "window": len(values),
+                "p50_ms": round(percentile(values, 50) * 1000, 2),
+                "p95_ms": round(percentile(values, 95) * 1000, 2),
+                "p99_ms": round(percentile(values, 99) * 1000, 2),
+                "max_ms": round(values[-1] * 1000, 2) if values else 0.0,
+            }
+            for lane, values in samples.items()
+        }
@@ -1,19 +1,54 @@
-from fastapi import FastAPI, HTTPException, Form
+from fastapi import Depends, FastAPI, File, HTTPException, Form, Query, Request, UploadFile
+from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, EmailStr
-from typing import Optional, List
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from email.mime.base import MIMEBase
-from email.message import EmailMessage
-from email import encoders
+from fastapi.responses import Response, StreamingResponse
+from pydantic import BaseModel, ConfigDict, ValidationError, model_validator
+from pydantic.json_schema import models_json_schema
+from typing import Optional, List, Dict, Literal, Tuple
+import asyncio
+import json
+import secrets
+from concurrent.futures import BrokenExecutor
+from contextlib import ExitStack
 import os
 import random
 import time
 from dotenv import load_dotenv
 import logging
 from datetime import datetime
+from smtp_pool import reply_code
+from message_builder import BodyCache, MessageBuilder
+from admission import AdmissionController
+from attachments import AttachmentMissing, AttachmentStore, AttachmentTooLarge, part_headers
+from bulk_render import attendance_message, certificate_message, payload_mime, render_attendance
+from certificates import CertificatePipeline
+from async_delivery import AsyncDelivery, RenderPool
+from delivery_log import DeliveryLog
+from outbox import BATCH_STATUS, BUFFERED_STATUS, RENDER_STATUS, SCHEDULED_STATUS, Job, Outbox, OutboxWorkers, Scheduler
+from job_events import JobEventHub, sse_stream
+from lanes import BULK, DEFAULT, TRANSACTIONAL, Lane, LaneLatency, lane_for
+import metrics
+from metrics import DELIVERIES, PHASE_SECONDS, SMTP_FAILURES, CallbackMetric, Histogram, MetricsMiddleware
+from retry import CircuitBreaker, RetryPolicy, SendDeferred, is_relay_failure
+from rate_limit import RateController, RateLimitedError, create_quota_ledger
+from relays import Relay, RelayDispatcher, load_relays
+from idempotency import (
+    ROUTE_CONTENT,
+    ROUTE_KEYED,
+    ROUTE_STREAM,
+    IdempotencyMiddleware,
+    create_idempotency_store,
+)
+from otp_store import OTP_EXPIRED, OTP_INVALID, OTP_MISSING, OTPSweeper, create_otp_store
+from recipients import RecipientValidator, dedupe_recipients
+from record_stream import RecordFormatError, aiter_records
+from templates import (
+    MergeTemplate,
+    get_attendance_digest_template,
+    get_contact_form_template,
+    get_notification_template,
+    get_otp_email_template,
+)
 
 # Load environment variables
 load_dotenv()
@@ -24,6 +59,47 @@ logger = logging.getLogger(__name__)
 
 app = FastAPI(title="Email Service API with OTP", version="1.0.0")
 
+# Duplicate suppression for the send endpoints. A client retrying after a
+# timeout sends the same Idempotency-Key and gets the original response
+# back instead of a second email. With IDEMPOTENCY_HASH_CONTENT on, an
+# identical request without a key inside IDEMPOTENCY_CONTENT_TTL counts as
+# a repeat too. "sqlite" is shared by every worker process on the host.
+IDEMPOTENCY_CONFIG = {
+    "backend": os.getenv("IDEMPOTENCY_STORE_BACKEND", "sqlite"),
+    "path": os.getenv("IDEMPOTENCY_STORE_PATH", "idempotency.db"),
+    "ttl": float(os.getenv("IDEMPOTENCY_TTL", 86400)),  # 24 hours
+    "content_ttl": float(os.getenv("IDEMPOTENCY_CONTENT_TTL", 600)),
+    "hash_content": os.getenv("IDEMPOTENCY_HASH_CONTENT", "false").lower() == "true",
+    "max_entries": int(os.getenv("IDEMPOTENCY_MAX_ENTRIES", 10000)),
+    # How long a claim outlives a worker that died mid-request; renewed while the request runs
+    "pending_ttl": float(os.getenv("IDEMPOTENCY_PENDING_TTL", 60)),
+}
+
+idempotency_store = create_idempotency_store(
+    IDEMPOTENCY_CONFIG["backend"], IDEMPOTENCY_CONFIG["path"], IDEMPOTENCY_CONFIG["max_entries"]
+)
+
+# Added before CORS so it runs inside it and replayed responses still get CORS headers
+app.add_middleware(
+    IdempotencyMiddleware,
+    store=idempotency_store,
+    routes={
+        "/send-email": ROUTE_CONTENT,
+        "/contact-form": ROUTE_CONTENT,
+        "/send-notification": ROUTE_CONTENT,
+        "/send-attendance-notification": ROUTE_CONTENT,
+        "/send-attendance-notifications/bulk": ROUTE_STREAM,
+        "/mail-merge": ROUTE_STREAM,
+        "/send-certificates": ROUTE_STREAM,
+        # A second OTP request is usually a deliberate resend
+        "/send-otp": ROUTE_KEYED,
+    },
+    ttl=IDEMPOTENCY_CONFIG["ttl"],
+    content_ttl=IDEMPOTENCY_CONFIG["content_ttl"],
+    hash_content=IDEMPOTENCY_CONFIG["hash_content"],
+    pending_ttl=IDEMPOTENCY_CONFIG["pending_ttl"],
+)
+
 # CORS middleware to allow React app to communicate
 app.add_middleware(
     CORSMiddleware,
@@ -37,32 +113,201 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# OTP Storage
-OTP_STORE = {}  # key: email, value: (otp, expiry_timestamp)
+# Request counts and latency per route for /metrics
+app.add_middleware(MetricsMiddleware)
+
+# OTP Storage: "sqlite" is shared by every worker process on the host,
+# "memory" is per-process and only suitable for a single worker
+OTP_CONFIG = {
+    "backend": os.getenv("OTP_STORE_BACKEND", "sqlite"),
+    "path": os.getenv("OTP_STORE_PATH", "otp_store.db"),
+    "ttl": float(os.getenv("OTP_TTL", 300)),  # 5 minutes
+    "sweep_interval": float(os.getenv("OTP_SWEEP_INTERVAL", 60)),
+}
+
+otp_store = create_otp_store(OTP_CONFIG["backend"], OTP_CONFIG["path"])
+otp_sweeper = OTPSweeper(otp_store, interval=OTP_CONFIG["sweep_interval"])
+
+# Recipient addresses are validated through a cache shared by every
+# request, so a roster sent again (or the same address in many rows) is
+# only checked once per process
+RECIPIENT_CONFIG = {
+    "cache_size": int(os.getenv("RECIPIENT_CACHE_SIZE", 100000)),
+}
+
+recipient_validator = RecipientValidator(max_entries=RECIPIENT_CONFIG["cache_size"])
+Recipient = recipient_validator.annotated()
 
 # Pydantic models for request/response
+class AttachmentRef(BaseModel):
+    # sha256 of the content; the encoded file lives in the attachment store
+    id: str
+    filename: str
+    content_type: str = "application/octet-stream"
+    size: int
+
 class EmailRequest(BaseModel):
-    to: List[EmailStr]
+    to: List[Recipient]
     subject: str
     body: str
     html_body: Optional[str] = None
-    cc: Optional[List[EmailStr]] = None
-    bcc: Optional[List[EmailStr]] = None
+    cc: Optional[List[Recipient]] = None
+    bcc: Optional[List[Recipient]] = None
+    # Split a large recipient list into batches: "bcc" sends one copy per
+    # batch with the recipients in Bcc, "personalized" one copy per recipient
+    fanout: Optional[Literal["bcc", "personalized"]] = None
+    batch_size: Optional[int] = None
+    # Deliver at this time instead of now; naive times are server-local
+    send_at: Optional[datetime] = None
+    # Filled in from multipart uploads to /send-email, never by clients
+    attachments: Optional[List[AttachmentRef]] = None
+
+    @model_validator(mode="after")
+    def drop_duplicate_recipients(self):
+        self.to, self.cc, self.bcc = dedupe_recipients(self.to, self.cc, self.bcc)
+        return self
 
 class EmailResponse(BaseModel):
     success: bool
     message: str
     email_id: Optional[str] = None
+    recipients: Optional[int] = None
+    batches: Optional[int] = None
+    scheduled_for: Optional[datetime] = None
 
 class ContactFormRequest(BaseModel):
     name: str
-    email: EmailStr
+    email: Recipient
     subject: str
     message: str
 
 class OTPResponse(BaseModel):
     message: str
     token: Optional[str] = None
+    job_id: Optional[str] = None
+
+class RecipientStatus(BaseModel):
+    email: str
+    status: str
+    job_id: str
+    error: Optional[str] = None
+
+class JobStatusResponse(BaseModel):
+    id: str
+    kind: str
+    status: str
+    attempts: int
+    error: Optional[str] = None
+    created_at: float
+    updated_at: float
+    sent_at: Optional[float] = None
+    parent_id: Optional[str] = None
+    counts: Optional[Dict[str, int]] = None
+    relay: Optional[str] = None
+    refused: Optional[Dict[str, str]] = None
+    recipients: Optional[List[RecipientStatus]] = None
+    recipient_counts: Optional[Dict[str, int]] = None
+
+class DeliveryRecord(BaseModel):
+    id: int
+    ts: float
+    job_id: str
+    kind: str
+    recipient: str
+    status: str
+    attempt: int
+    relay: Optional[str] = None
+    smtp_code: Optional[int] = None
+    subject: Optional[str] = None
+    error: Optional[str] = None
+
+class DeliveryPage(BaseModel):
+    items: List[DeliveryRecord]
+    # Pass as ``cursor`` to fetch the next (older) page
+    next_cursor: Optional[int] = None
+
+class AttendanceRecord(BaseModel):
+    student_email: Recipient
+    student_name: str
+    subject: str
+    date: str
+    period: str
+    status: str
+    send_at: Optional[datetime] = None
+
+class BulkAttendanceResult(BaseModel):
+    index: int
+    student_email: str
+    status: str
+    job_id: Optional[str] = None
+    error: Optional[str] = None
+
+class BulkAttendanceResponse(BaseModel):
+    success: bool
+    # None when no record was valid, so nothing was queued
+    batch_id: Optional[str] = None
+    total: int
+    queued: int
+    invalid: int
+    elapsed_ms: float
+    records_per_second: float
+    parse_error: Optional[str] = None
+    results: List[BulkAttendanceResult]
+
+class MailMergeError(BaseModel):
+    row: int
+    email: str
+    error: str
+
+class MailMergePreview(BaseModel):
+    to: str
+    subject: str
+    body: str
+    html_body: Optional[str] = None
+
+class MailMergeResponse(BaseModel):
+    success: bool
+    dry_run: bool
+    batch_id: Optional[str] = None
+    fields: List[str]
+    total: int
+    queued: int
+    invalid: int
+    elapsed_ms: float
+    records_per_second: float
+    # Time to deliver these rows behind the bulk backlog already queued: the
+    # longer of what the relays' rate limits allow and what the lane has
+    # been draining at; None when neither is known
+    queued_ahead: int = 0
+    estimated_send_seconds: Optional[float] = None
+    scheduled_for: Optional[datetime] = None
+    parse_error: Optional[str] = None
+    # The first MAIL_MERGE_MAX_ERRORS rejected rows
+    errors: List[MailMergeError]
+    preview: Optional[MailMergePreview] = None
+
+class CertificateParticipant(BaseModel):
+    # CSV cells and NDJSON numbers alike
+    model_config = ConfigDict(coerce_numbers_to_str=True)
+
+    name: str
+    email: Recipient
+    hours: Optional[str] = None
+    credential_id: Optional[str] = None
+
+class CertificateBatchResponse(BaseModel):
+    success: bool
+    # None when no participant was valid, so nothing was queued
+    batch_id: Optional[str] = None
+    template: str
+    total: int
+    queued: int
+    invalid: int
+    elapsed_ms: float
+    records_per_second: float
+    parse_error: Optional[str] = None
+    # The first MAIL_MERGE_MAX_ERRORS rejected rows
+    errors: List[MailMergeError]
 
 # Email configuration
 EMAIL_CONFIG = {
@@ -72,545 +317,1130 @@ EMAIL_CONFIG = {
     "password": os.getenv("EMAIL_PASSWORD") or os.getenv("EMAIL_PASS"),
 }
 
+# SMTP connection pool configuration
+POOL_CONFIG = {
+    "max_size": int(os.getenv("SMTP_POOL_SIZE", 4)),
+    "idle_timeout": float(os.getenv("SMTP_POOL_IDLE_TIMEOUT", 60)),
+    "probe_interval": float(os.getenv("SMTP_POOL_PROBE_INTERVAL", 10)),
+    "acquire_timeout": float(os.getenv("SMTP_POOL_ACQUIRE_TIMEOUT", 30)),
+    "timeout": float(os.getenv("SMTP_TIMEOUT", 30)),
+    # Connections only the transactional lane (OTP, contact form) may use
+    "reserved": int(os.getenv("SMTP_POOL_RESERVED", 1)),
+    # STARTTLS can only be turned off for local relays such as the benchmark sink
+    "use_tls": os.getenv("SMTP_USE_TLS", "true").lower() not in ("0", "false", "no"),
+}
+
+# Temporary failures are retried with backoff; a breaker sheds load while the relay is down
+RETRY_CONFIG = {
+    "max_attempts": int(os.getenv("RETRY_MAX_ATTEMPTS", 6)),
+    "base_delay": float(os.getenv("RETRY_BASE_DELAY", 30)),
+    "max_delay": float(os.getenv("RETRY_MAX_DELAY", 3600)),
+    "breaker_threshold": int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", 5)),
+    "breaker_reset": float(os.getenv("CIRCUIT_RESET_TIMEOUT", 30)),
+}
+
+retry_policy = RetryPolicy(
+    max_attempts=RETRY_CONFIG["max_attempts"],
+    base_delay=RETRY_CONFIG["base_delay"],
+    max_delay=RETRY_CONFIG["max_delay"],
+)
+
+# Sends are paced to the relay's quotas (Gmail: 500/day for a personal
+# account, 2000 for Workspace) instead of discovering them by failing.
+# A rate of 0 disables that bucket.
+RATE_LIMIT_CONFIG = {
+    "per_minute": float(os.getenv("SMTP_RATE_PER_MINUTE", 60)),
+    "burst": float(os.getenv("SMTP_RATE_BURST", 20)),
+    "per_day": float(os.getenv("SMTP_DAILY_QUOTA", 500)),
+    "sender_per_minute": float(os.getenv("SENDER_RATE_PER_MINUTE", 0)),
+    "sender_per_day": float(os.getenv("SENDER_DAILY_QUOTA", 0)),
+    # Share of every bucket only the transactional lane may spend
+    "headroom": float(os.getenv("SMTP_RATE_HEADROOM", 0.1)),
+    "throttle_pause": float(os.getenv("SMTP_THROTTLE_PAUSE", 60)),
+    "quota_pause": float(os.getenv("SMTP_QUOTA_PAUSE", 3600)),
+}
+
+# Daily quotas are counted in SQLite so every worker process on the host
+# draws on the same budget and a restart does not refill it; "memory"
+# counts per process and is only suitable for a single worker. Per-minute
+# pacing is always per process.
+RATE_LIMIT_STORE_CONFIG = {
+    "backend": os.getenv("RATE_LIMIT_STORE_BACKEND", "sqlite"),
+    "path": os.getenv("RATE_LIMIT_STORE_PATH", "rate_limits.db"),
+}
+
+rate_controller = RateController(
+    **RATE_LIMIT_CONFIG,
+    ledger=create_quota_ledger(RATE_LIMIT_STORE_CONFIG["backend"], RATE_LIMIT_STORE_CONFIG["path"]),
+)
+
+# Relays: SMTP_RELAYS is a JSON list of accounts/servers, e.g.
+# [{"name": "gmail-a", "host": "smtp.gmail.com", "port": 587, "username": "...",
+#   "password": "...", "weight": 2, "max_connections": 4, "per_day": 2000}].
+# Without it the single relay above is used. Each relay keeps its own pool
+# (so the TCP/TLS/AUTH handshake is paid once per connection), breaker and
+# sending budget.
+relays = RelayDispatcher(
+    load_relays(
+        os.getenv("SMTP_RELAYS"),
+        {
+            "host": EMAIL_CONFIG["smtp_server"],
+            "port": EMAIL_CONFIG["smtp_port"],
+            "username": EMAIL_CONFIG["email"],
+            "password": EMAIL_CONFIG["password"],
+        },
+        POOL_CONFIG,
+        RETRY_CONFIG,
+        rate_controller,
+    ),
+    rate_controller,
+)
+
+# Blocking smtplib calls run here so they never stall the event loop.
+# Transactional mail gets its own threads so bulk sends cannot starve it.
+delivery = AsyncDelivery(
+    max_workers=int(os.getenv(
+        "SEND_WORKERS", max(1, sum(relay.pool.max_size - relay.pool.reserved for relay in relays.relays))
+    )),
+    max_concurrency=int(os.getenv("SEND_MAX_CONCURRENCY", 500)),
+)
+priority_delivery = AsyncDelivery(max_workers=max(1, sum(relay.pool.reserved for relay in relays.relays)))
+
+# Durable outbox drained by background delivery workers
+OUTBOX_CONFIG = {
+    "path": os.getenv("OUTBOX_PATH", "outbox.db"),
+    "workers": int(os.getenv("OUTBOX_WORKERS", delivery.max_workers)),
+    # Extra workers that only ever take transactional-lane jobs
+    "reserved_workers": int(os.getenv("OUTBOX_RESERVED_WORKERS", priority_delivery.max_workers)),
+    "poll_interval": float(os.getenv("OUTBOX_POLL_INTERVAL", 1.0)),
+    "lease_seconds": float(os.getenv("OUTBOX_LEASE_SECONDS", 300)),
+}
+
+outbox = Outbox(OUTBOX_CONFIG["path"], lease_seconds=OUTBOX_CONFIG["lease_seconds"])
+
+# Per-recipient record of every delivery attempt for /deliveries, written
+# in batches off the send path
+DELIVERY_LOG_CONFIG = {
+    "path": os.getenv("DELIVERY_LOG_PATH", "deliveries.db"),
+    "flush_interval": float(os.getenv("DELIVERY_LOG_FLUSH_INTERVAL", 1.0)),
+    "batch_size": int(os.getenv("DELIVERY_LOG_BATCH_SIZE", 500)),
+    "max_pending": int(os.getenv("DELIVERY_LOG_MAX_PENDING", 100000)),
+    "retention_days": float(os.getenv("DELIVERY_LOG_RETENTION_DAYS", 90)),
+}
+
+delivery_log = DeliveryLog(
+    DELIVERY_LOG_CONFIG["path"],
+    flush_interval=DELIVERY_LOG_CONFIG["flush_interval"],
+    batch_size=DELIVERY_LOG_CONFIG["batch_size"],
+    max_pending=DELIVERY_LOG_CONFIG["max_pending"],
+    retention_days=DELIVERY_LOG_CONFIG["retention_days"],
+)
+
+# Queue-to-delivery latency per priority lane
+lane_latency = LaneLatency()
+QUEUE_LATENCY = Histogram(
+    "email_queue_latency_seconds",
+    "Time from a job becoming due to its delivery, per lane",
+    ("lane",),
+    buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0),
+)
+
+# Scrape-time gauges: nothing here runs on the send path
+CallbackMetric(
+    "outbox_depth", "Outbox jobs queued or in flight per lane", ("lane", "status"),
+    lambda: {
+        (lane, status): count
+        for lane, statuses in outbox.depth_by_lane().items()
+        for status, count in statuses.items()
+    },
+)
+CallbackMetric(
+    "smtp_pool_connections", "SMTP pool connections by relay and state", ("relay", "state"),
+    lambda: {
+        (relay.name, state): stats[state]
+        for relay in relays.relays
+        for stats in (relay.pool.stats(),)
+        for state in ("idle", "in_use", "max_size", "reserved")
+    },
+)
+CallbackMetric(
+    "smtp_pool_events_total", "SMTP pool hits, misses, reconnects and evictions", ("relay", "event"),
+    lambda: {
+        (relay.name, event): stats[event]
+        for relay in relays.relays
+        for stats in (relay.pool.stats(),)
+        for event in ("hits", "misses", "reconnects", "evictions", "probes", "probe_failures", "waits")
+    },
+    type="counter",
+)
+CallbackMetric(
+    "smtp_circuit_open", "1 while a relay's circuit breaker is open or half-open", ("relay",),
+    lambda: {(relay.name,): int(relay.breaker.state != CircuitBreaker.CLOSED) for relay in relays.relays},
+)
+CallbackMetric(
+    "smtp_relay_outstanding", "Sends in flight per relay", ("relay",),
+    lambda: {(relay.name,): relay.outstanding for relay in relays.relays},
+)
+CallbackMetric(
+    "smtp_rate_budget_remaining", "Tokens left in each sending rate bucket", ("scope", "window"),
+    lambda: {
+        (scope, window): bucket["remaining"]
+        for scope, budget in rate_controller.budget()["scopes"].items()
+        for window, bucket in budget["buckets"].items()
+    },
+)
+CallbackMetric(
+    "attendance_digest_sends_saved_total", "Attendance emails not sent because events went out in a digest", (),
+    lambda: {(): attendance_digest_stats()["sends_saved"]},
+    type="counter",
+)
+CallbackMetric(
+    "job_event_streams", "Jobs with a progress poller and the SSE clients watching them", ("kind",),
+    lambda: {(kind,): count for kind, count in job_event_hub.stats().items()},
+)
+CallbackMetric(
+    "delivery_log_rows", "Delivery log rows written, dropped under backlog, and waiting to be written", ("state",),
+    lambda: {
+        (state,): value for state, value in delivery_log.stats().items() if state in ("written", "dropped", "pending")
+    },
+)
+CallbackMetric(
+    "outbox_scheduled", "Jobs scheduled for later delivery, not yet released to the queue", (),
+    lambda: {(): outbox.scheduled_depth()},
+)
+CallbackMetric(
+    "outbox_scheduled_released_total", "Scheduled jobs this process released into the queue", (),
+    lambda: {(): scheduler.stats()["released"]},
+    type="counter",
+)
+CallbackMetric(
+    "admission_decisions_total", "Send requests admitted, or shed for a full queue or too many in flight", ("outcome",),
+    lambda: {(outcome,): count for outcome, count in admission.stats().items()},
+    type="counter",
+)
+CallbackMetric(
+    "recipient_validations_total", "Recipient address cache hits, fast-path accepts, full validations and rejections", ("result",),
+    lambda: {(result,): count for result, count in recipient_validator.stats().items() if result != "entries"},
+    type="counter",
+)
+CallbackMetric(
+    "attachment_uploads_total", "Attachment uploads encoded and stored, or matched to one already stored", ("result",),
+    lambda: {("encoded",): attachment_store.stats()["saved"], ("reused",): attachment_store.stats()["reused"]},
+    type="counter",
+)
+CallbackMetric(
+    "certificates_rendered_total", "Certificates rendered and queued for sending, or failed to render", ("result",),
+    lambda: {("rendered",): certificate_pipeline.stats()["rendered"], ("failed",): certificate_pipeline.stats()["failed"]},
+    type="counter",
+)
+CallbackMetric(
+    "idempotency_entries", "Remembered idempotency keys, including ones still in flight", (),
+    lambda: {(): len(idempotency_store)},
+)
+CallbackMetric(
+    "send_executor_in_flight", "Sends running or waiting on each executor", ("executor",),
+    lambda: {
+        ("shared",): delivery.stats()["in_flight"],
+        ("priority",): priority_delivery.stats()["in_flight"],
+    },
+)
+
+# Bulk endpoints persist the roster to the outbox in chunks of this size
+BULK_CONFIG = {
+    "chunk_size": int(os.getenv("BULK_CHUNK_SIZE", 500)),
+}
+
+# Mail-merge uploads are rendered row by row; only this many rejected rows
+# are echoed back, the rest are just counted
+MAIL_MERGE_CONFIG = {
+    "max_errors": int(os.getenv("MAIL_MERGE_MAX_ERRORS", 100)),
+    "email_field": os.getenv("MAIL_MERGE_EMAIL_FIELD", "email"),
+}
+
+# Progress of a job streamed over /jobs/{id}/events is polled once per
+# interval per job, however many clients watch it
+JOB_EVENTS_CONFIG = {
+    "poll_interval": float(os.getenv("JOB_EVENTS_POLL_INTERVAL", 1)),
+    "heartbeat": float(os.getenv("JOB_EVENTS_HEARTBEAT", 15)),
+}
+
+# Attendance events for a student are held for ``window`` seconds from the
+# first one of the day and sent as a single digest. Statuses listed in
+# ATTENDANCE_DIGEST_IMMEDIATE (absences by default) still go out straight
+# away. A window of 0 sends one email per period as before.
+ATTENDANCE_DIGEST_CONFIG = {
+    "window": float(os.getenv("ATTENDANCE_DIGEST_WINDOW", 28800)),  # 8 hours
+    "immediate_statuses": {
+        status.strip().lower()
+        for status in os.getenv("ATTENDANCE_DIGEST_IMMEDIATE", "absent").split(",")
+        if status.strip()
+    },
+}
+
+# Recipients per message when /send-email fans out; relays cap recipients
+# per message (Gmail at 100), so requests cannot ask for more than max
+FANOUT_CONFIG = {
+    "batch_size": int(os.getenv("FANOUT_BATCH_SIZE", 50)),
+    "max_batch_size": int(os.getenv("FANOUT_MAX_BATCH_SIZE", 100)),
+}
+
+# Encoded bodies are cached so a notification sent to many recipients is
+# only encoded once; each message then only builds its own headers
+message_builder = MessageBuilder(
+    EMAIL_CONFIG["email"] or "",
+    BodyCache(max_entries=int(os.getenv("MIME_CACHE_SIZE", 256)))
+)
+
+# Attachments uploaded to /send-email are stored once on disk in base64
+# form and shared by every message (and fan-out batch) that carries them
+ATTACHMENT_CONFIG = {
+    "directory": os.getenv("ATTACHMENT_DIR", "attachments"),
+    "max_bytes": int(os.getenv("ATTACHMENT_MAX_BYTES", 25 * 1024 * 1024)),
+    "max_files": int(os.getenv("ATTACHMENT_MAX_FILES", 10)),
+    # Long enough to cover retries; sends scheduled further out need re-uploading
+    "retention_days": float(os.getenv("ATTACHMENT_RETENTION_DAYS", 7)),
+}
+
+attachment_store = AttachmentStore(
+    ATTACHMENT_CONFIG["directory"],
+    max_bytes=ATTACHMENT_CONFIG["max_bytes"],
+    retention_days=ATTACHMENT_CONFIG["retention_days"],
+)
+
+# Certificates, and the templates and MIME encoding of bulk jobs, render in
+# this process pool so they never hold up the event loop
+RENDER_POOL_CONFIG = {
+    "workers": int(os.getenv("RENDER_WORKERS", 0)) or os.cpu_count() or 1,
+    # Messages per task: large enough that pickling and the round trip are
+    # small next to ~0.5 ms of encoding per message
+    "chunk_size": int(os.getenv("RENDER_CHUNK_SIZE", 100)),
+    # Smaller batches are composed in-process and encoded by the sender
+    "min_batch": int(os.getenv("RENDER_POOL_MIN_BATCH", 20)),
+}
+
+render_pool = RenderPool(max_workers=RENDER_POOL_CONFIG["workers"])
+
+# Certificates are claimed and rendered chunk_size at a time, with up to
+# max_in_flight chunks in the render pool; rendering pauses while
+# max_queued messages already wait for a relay
+CERTIFICATE_CONFIG = {
+    "chunk_size": int(os.getenv("CERTIFICATE_CHUNK_SIZE", 25)),
+    "max_in_flight": int(os.getenv("CERTIFICATE_MAX_IN_FLIGHT", 0)) or RENDER_POOL_CONFIG["workers"],
+    "max_queued": int(os.getenv("CERTIFICATE_MAX_QUEUED", 2000)),
+    # A chunk not rendered within this long is assumed lost and rendered again
+    "lease_seconds": float(os.getenv("CERTIFICATE_LEASE_SECONDS", 300)),
+    # Claims per certificate before it is failed, e.g. one that keeps crashing its worker
+    "max_attempts": int(os.getenv("CERTIFICATE_MAX_ATTEMPTS", 3)),
+}
+
 # Admin email for OTP
 ADMIN_EMAIL = os.getenv("ADMIN_EMAIL")
 
-# HTML Email Templates
-def get_base_template():
-    """Base HTML template for all emails"""
-    return """
-    <!DOCTYPE html>
-    <html lang="en">
-    <head>
-        <meta charset="UTF-8">
-        <meta name="viewport" content="width=device-width, initial-scale=1.0">
-        <title>{title}</title>
-        <style>
-            * {{
-                margin: 0;
-                padding: 0;
-                box-sizing: border-box;
-            }}
-            
-            body {{
-                font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
-                line-height: 1.6;
-                color: #333;
-                background-color: #f4f4f4;
-            }}
-            
-            .container {{
-                max-width: 600px;
-                margin: 0 auto;
-                background-color: #ffffff;
-                border-radius: 10px;
-                overflow: hidden;
-                box-shadow: 0 4px 6px rgba(0, 0, 0, 0.1);
-            }}
-            
-            .header {{
-                background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-                color: white;
-                padding: 30px;
-                text-align: center;
-            }}
-            
-            .header h1 {{
-                font-size: 28px;
-                margin-bottom: 10px;
-                font-weight: 300;
-            }}
-            
-            .header p {{
-                font-size: 16px;
-                opacity: 0.9;
-            }}
-            
-            .content {{
-                padding: 40px 30px;
-            }}
-            
-            .footer {{
-                background-color: #f8f9fa;
-                padding: 20px 30px;
-                text-align: center;
-                border-top: 1px solid #e9ecef;
-            }}
-            
-            .footer p {{
-                color: #6c757d;
-                font-size: 14px;
-                margin-bottom: 10px;
-            }}
-            
-            .btn {{
-                display: inline-block;
-                padding: 12px 30px;
-                background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-                color: white;
-                text-decoration: none;
-                border-radius: 25px;
-                font-weight: 500;
-                transition: all 0.3s ease;
-                margin: 15px 0;
-            }}
-            
-            .btn:hover {{
-                transform: translateY(-2px);
-                box-shadow: 0 6px 12px rgba(0, 0, 0, 0.2);
-            }}
-            
-            .otp-box {{
-                background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-                color: white;
-                padding: 20px;
-                border-radius: 10px;
-                text-align: center;
-                margin: 20px 0;
-            }}
-            
-            .otp-code {{
-                font-size: 32px;
-                font-weight: bold;
-                letter-spacing: 8px;
-                margin: 15px 0;
-                font-family: 'Courier New', monospace;
-            }}
-            
-            .warning-box {{
-                background-color: #fff3cd;
-                border: 1px solid #ffeaa7;
-                border-radius: 8px;
-                padding: 15px;
-                margin: 20px 0;
-                color: #856404;
-            }}
-            
-            .success-box {{
-                background-color: #d4edda;
-                border: 1px solid #c3e6cb;
-                border-radius: 8px;
-                padding: 15px;
-                margin: 20px 0;
-                color: #155724;
-            }}
-            
-            .info-box {{
-                background-color: #d1ecf1;
-                border: 1px solid #bee5eb;
-                border-radius: 8px;
-                padding: 15px;
-                margin: 20px 0;
-                color: #0c5460;
-            }}
-            
-            .attendance-card {{
-                background-color: #f8f9fa;
-                border-radius: 10px;
-                padding: 20px;
-                margin: 20px 0;
-                border-left: 4px solid #667eea;
-            }}
-            
-            .attendance-status {{
-                display: inline-block;
-                padding: 8px 16px;
-                border-radius: 20px;
-                font-weight: 500;
-                text-transform: uppercase;
-                font-size: 12px;
-                margin: 10px 0;
-            }}
-            
-            .status-present {{
-                background-color: #d4edda;
-                color: #155724;
-            }}
-            
-            .status-absent {{
-                background-color: #f8d7da;
-                color: #721c24;
-            }}
-            
-            .contact-info {{
-                background-color: #f8f9fa;
-                border-radius: 8px;
-                padding: 20px;
-                margin: 20px 0;
-            }}
-            
-            .contact-info h3 {{
-                color: #667eea;
-                margin-bottom: 15px;
-            }}
-            
-            .contact-info p {{
-                margin-bottom: 8px;
-            }}
-            
-            .divider {{
-                height: 1px;
-                background: linear-gradient(to right, transparent, #667eea, transparent);
-                margin: 30px 0;
-            }}
-            
-            @media (max-width: 600px) {{
-                .container {{
-                    margin: 0 10px;
-                }}
-                
-                .header {{
-                    padding: 20px;
-                }}
-                
-                .content {{
-                    padding: 20px;
-                }}
-                
-                .otp-code {{
-                    font-size: 24px;
-                    letter-spacing: 4px;
-                }}
-            }}
-        </style>
-    </head>
-    <body>
-        <div class="container">
-            {content}
-        </div>
-    </body>
-    </html>
+def send_email_smtp(
+    email_data: EmailRequest,
+    relay: Relay,
+    reserved: bool = False,
+    encoded: Optional[Tuple[bytes, bytes]] = None,
+) -> Dict[str, tuple]:
+    """Send email through one relay; raises on failure so the outbox can record why.
+
+    ``encoded`` is the body already encoded in the render pool. Returns the
+    recipients the relay refused when others were accepted.
     """
+    mime_started = time.perf_counter()
+    
+    # Prepare recipient list
+    recipients = email_data.to.copy()
+    if email_data.cc:
+        recipients.extend(email_data.cc)
+    if email_data.bcc:
+        recipients.extend(email_data.bcc)
+    
+    if email_data.attachments:
+        # Attachment bodies are sent straight from their memory-mapped
+        # encoded files; only the headers and text parts are built here
+        with ExitStack() as stack:
+            attachments = [
+                (part_headers(attachment.filename, attachment.content_type),
+                 stack.enter_context(attachment_store.encoded(attachment.id)))
+                for attachment in email_data.attachments
+            ]
+            parts = message_builder.build_parts(
+                email_data.to, email_data.subject, email_data.body, email_data.html_body, email_data.cc,
+                attachments, sender=relay.sender, encoded=encoded
+            )
+            PHASE_SECONDS.observe(time.perf_counter() - mime_started, "mime_build")
+            refused = relay.pool.sendmail_parts(relay.sender, recipients, parts, reserved=reserved)
+    else:
+        data = message_builder.build(
+            email_data.to, email_data.subject, email_data.body, email_data.html_body, email_data.cc,
+            sender=relay.sender, encoded=encoded
+        )
+        PHASE_SECONDS.observe(time.perf_counter() - mime_started, "mime_build")
+        refused = relay.pool.sendmail(relay.sender, recipients, data, reserved=reserved)
+    
+    logger.info(f"Email sent successfully to {email_data.to or f'{len(recipients)} Bcc recipients'}")
+    return refused
 
-def get_otp_email_template(otp: str, user_name: str = "User"):
-    """OTP email template"""
-    current_time = datetime.now().strftime("%B %d, %Y at %I:%M %p")
+def compose_otp_email(to_email: str, otp: str) -> EmailRequest:
+    """Compose OTP email with beautiful HTML template"""
+    html_content = get_otp_email_template(otp, "Admin")
     
-    content = f"""
-    <div class="header">
-        <h1>🔐 Admin Login Verification</h1>
-        <p>Your One-Time Password (OTP) for secure access</p>
-    </div>
+    # Add both text and HTML versions
+    text_content = f"""
+    Admin Login Verification
     
-    <div class="content">
-        <h2>Hello {user_name}! 👋</h2>
-        <p>We received a request to access your admin account. Please use the following OTP to complete your login:</p>
-        
-        <div class="otp-box">
-            <p style="margin: 0; font-size: 16px;">Your OTP Code is:</p>
-            <div class="otp-code">{otp}</div>
-            <p style="margin: 0; font-size: 14px; opacity: 0.9;">Valid for 5 minutes</p>
-        </div>
-        
-        <div class="warning-box">
-            <strong>⚠️ Security Notice:</strong>
-            <ul style="margin: 10px 0 0 20px;">
-                <li>This OTP is valid for only 5 minutes</li>
-                <li>Do not share this code with anyone</li>
-                <li>If you didn't request this, please ignore this email</li>
-            </ul>
-        </div>
-        
-        <div class="info-box">
-            <p><strong>📅 Request Time:</strong> {current_time}</p>
-            <p><strong>🔒 Security Level:</strong> High</p>
-        </div>
-        
-        <div class="divider"></div>
-        
-        <p>If you have any concerns about this login attempt, please contact our support team immediately.</p>
-    </div>
+    Hello Admin!
     
-    <div class="footer">
-        <p>This is an automated message. Please do not reply to this email.</p>
-        <p>&copy; 2025 Your Company Name. All rights reserved.</p>
-    </div>
-    """
+    Your OTP for secure access is: {otp}
     
-    return get_base_template().format(
-        title="Admin Login OTP",
-        content=content
-    )
-
-def get_contact_form_template(name: str, email: str, subject: str, message: str):
-    """Contact form submission template"""
-    current_time = datetime.now().strftime("%B %d, %Y at %I:%M %p")
+    This code is valid for 5 minutes only.
     
-    content = f"""
-    <div class="header">
-        <h1>📨 New Contact Form Submission</h1>
-        <p>Someone has reached out through your website</p>
-    </div>
+    Security Notice:
+    - Do not share this code with anyone
+    - If you didn't request this, please ignore this email
     
-    <div class="content">
-        <h2>New Message Received! 📬</h2>
-        <p>You have received a new message through your contact form:</p>
-        
-        <div class="contact-info">
-            <h3>👤 Contact Information</h3>
-            <p><strong>Name:</strong> {name}</p>
-            <p><strong>Email:</strong> <a href="mailto:{email}" style="color: #667eea; text-decoration: none;">{email}</a></p>
-            <p><strong>Subject:</strong> {subject}</p>
-            <p><strong>Submitted:</strong> {current_time}</p>
-        </div>
-        
-        <div class="divider"></div>
-        
-        <h3>💬 Message Content</h3>
-        <div style="background-color: #f8f9fa; padding: 20px; border-radius: 8px; border-left: 4px solid #667eea; margin: 15px 0;">
-            <p style="white-space: pre-wrap; margin: 0;">{message}</p>
-        </div>
-        
-        <div class="success-box">
-            <p><strong>✅ Next Steps:</strong> The sender expects a response. Please reply within 24-48 hours for best customer service.</p>
-        </div>
-        
-        <div style="text-align: center; margin: 30px 0;">
-            <a href="mailto:{email}" class="btn">Reply to {name}</a>
-        </div>
-    </div>
-    
-    <div class="footer">
-        <p>This message was sent through your website contact form.</p>
-        <p>&copy; 2025 Your Company Name. All rights reserved.</p>
-    </div>
+    This is an automated message.
     """
     
-    return get_base_template().format(
-        title="New Contact Form Submission",
-        content=content
+    return EmailRequest(
+        to=[to_email],
+        subject="🔐 Admin Login OTP - Secure Access Code",
+        body=text_content,
+        html_body=html_content
     )
 
-def get_attendance_email_template(student_name: str, subject: str, date: str, period: str, status: str):
-    """Attendance notification template"""
-    current_time = datetime.now().strftime("%B %d, %Y at %I:%M %p")
-    
-    status_class = "status-present" if status.lower() == "present" else "status-absent"
-    status_emoji = "✅" if status.lower() == "present" else "❌"
-    status_color = "#28a745" if status.lower() == "present" else "#dc3545"
+def compose_attendance_email(
+    student_email: str,
+    student_name: str,
+    subject: str,
+    date: str,
+    period: str,
+    status: str
+) -> EmailRequest:
+    """Compose attendance notification with beautiful HTML"""
+    email_subject, text_content, html_content = attendance_message(student_name, subject, date, period, status)
+    return EmailRequest(
+        to=[student_email],
+        subject=email_subject,
+        body=text_content,
+        html_body=html_content
+    )
+
+def compose_attendance_digest(job: Job) -> EmailRequest:
+    """Compose the digest for an attendance group job from its buffered events"""
+    entries = [event.payload for event in outbox.batch_jobs(job.id)]
+    html_content = get_attendance_digest_template(
+        job.payload["student_name"], job.payload["date"], entries
+    )
+    absent = sum(1 for entry in entries if entry["status"].lower() != "present")
+    rows = "\n".join(
+        f"    {entry['period']:<10} {entry['subject']:<24} {entry['status'].upper()}"
+        for entry in entries
+    )
+    text_content = f"""
+    Daily Attendance Summary for {job.payload['student_name']}
     
-    content = f"""
-    <div class="header">
-        <h1>📚 Attendance Update</h1>
-        <p>Your attendance has been recorded</p>
-    </div>
+    Date: {job.payload['date']}
     
-    <div class="content">
-        <h2>Hello, {student_name}! 👋</h2>
-        <p>Your attendance has been successfully recorded for today's class:</p>
-        
-        <div class="attendance-card">
-            <h3 style="color: #667eea; margin-bottom: 15px;">📋 Attendance Details</h3>
-            <p><strong>📖 Subject:</strong> {subject}</p>
-            <p><strong>📅 Date:</strong> {date}</p>
-            <p><strong>⏰ Period:</strong> {period}</p>
-            <p><strong>📝 Recorded:</strong> {current_time}</p>
-            
-            <div style="margin: 20px 0;">
-                <span class="attendance-status {status_class}">
-                    {status_emoji} {status.upper()}
-                </span>
-            </div>
-        </div>
-        
-        {"<div class='success-box'><p><strong>🎉 Great job!</strong> Keep up the excellent attendance record!</p></div>" if status.lower() == "present" else "<div class='warning-box'><p><strong>⚠️ Important Notice:</strong> Please ensure regular attendance for better academic performance.</p></div>"}
-        
-        <div class="info-box">
-            <p><strong>📊 Attendance Tips:</strong></p>
-            <ul style="margin: 10px 0 0 20px;">
-                <li>Regular attendance improves understanding</li>
-                <li>Aim for at least 75% attendance</li>
-                <li>Contact your instructor if you have concerns</li>
-            </ul>
-        </div>
-        
-        <div class="divider"></div>
-        
-        <p>If you have any questions about your attendance, please contact your instructor or the academic office.</p>
-    </div>
+{rows}
     
-    <div class="footer">
-        <p>This is an automated attendance notification.</p>
-        <p>&copy; 2025 Your Educational Institution. All rights reserved.</p>
-    </div>
+    Present: {len(entries) - absent}  Absent: {absent}  Total: {len(entries)}
     """
     
-    return get_base_template().format(
-        title="Attendance Update",
-        content=content
+    return EmailRequest(
+        to=[job.payload["student_email"]],
+        subject=f"📚 Attendance Summary - {job.payload['date']} ({len(entries)} classes)",
+        body=text_content,
+        html_body=html_content
     )
 
-def get_notification_template(subject: str, message: str, notification_type: str = "general"):
-    """Generic notification template"""
-    current_time = datetime.now().strftime("%B %d, %Y at %I:%M %p")
-    
-    type_config = {
-        "general": {"emoji": "📢", "color": "#667eea"},
-        "urgent": {"emoji": "🚨", "color": "#dc3545"},
-        "info": {"emoji": "ℹ️", "color": "#17a2b8"},
-        "success": {"emoji": "✅", "color": "#28a745"},
-        "warning": {"emoji": "⚠️", "color": "#ffc107"}
-    }
-    
-    config = type_config.get(notification_type.lower(), type_config["general"])
+def goes_to_digest(entry: AttendanceRecord) -> bool:
+    return (
+        ATTENDANCE_DIGEST_CONFIG["window"] > 0
+        and entry.status.lower() not in ATTENDANCE_DIGEST_CONFIG["immediate_statuses"]
+    )
+
+async def record_attendance(
+    entries: List[AttendanceRecord],
+    parent_id: Optional[str] = None,
+    payloads: Optional[List[Optional[dict]]] = None,
+    lane_kind: str = "attendance",
+) -> List[str]:
+    """Queue attendance events and return the job carrying each one.
+
+    Events are buffered into the student's open digest for the day; those
+    with an immediate status are composed and queued on their own, in the
+    lane of ``lane_kind``. Both count towards ``parent_id`` if given. ``payloads``
+    holds emails already rendered in the render pool, by entry.
+    """
+    job_ids: List[Optional[str]] = [None] * len(entries)
+    buffered = []
+    immediate = []
+    for index, entry in enumerate(entries):
+        (buffered if goes_to_digest(entry) else immediate).append(index)
     
-    content = f"""
-    <div class="header">
-        <h1>{config['emoji']} {notification_type.upper()} Notification</h1>
-        <p>Important message for you</p>
-    </div>
+    lane = lane_for(lane_kind)
+    # Records scheduled for different times can't share one enqueue_many call
+    by_due: Dict[Optional[float], List[int]] = {}
+    for i in immediate:
+        by_due.setdefault(due_time(entries[i].send_at), []).append(i)
+    for due, indexes in by_due.items():
+        ids = await asyncio.to_thread(
+            outbox.enqueue_many,
+            "attendance",
+            [
+                (payloads and payloads[i]) or compose_attendance_email(
+                    entries[i].student_email, entries[i].student_name, entries[i].subject,
+                    entries[i].date, entries[i].period, entries[i].status
+                ).model_dump(mode="json", exclude={"send_at"})
+                for i in indexes
+            ],
+            parent_id=parent_id,
+            available_at=due,
+            lane=lane.name,
+            priority=lane.priority
+        )
+        for index, job_id in zip(indexes, ids):
+            job_ids[index] = job_id
+        wake_for(due)
     
-    <div class="content">
-        <h2 style="color: {config['color']};">{subject}</h2>
-        
-        <div style="background-color: #f8f9fa; padding: 25px; border-radius: 10px; border-left: 4px solid {config['color']}; margin: 25px 0;">
-            <p style="white-space: pre-wrap; margin: 0; font-size: 16px; line-height: 1.6;">{message}</p>
-        </div>
-        
-        <div class="info-box">
-            <p><strong>📅 Sent:</strong> {current_time}</p>
-            <p><strong>🏷️ Type:</strong> {notification_type.title()}</p>
-        </div>
-        
-        <div class="divider"></div>
-        
-        <p>Thank you for your attention to this notification.</p>
-    </div>
+    if buffered:
+        lane = lane_for("attendance_digest")
+        window_end = time.time() + ATTENDANCE_DIGEST_CONFIG["window"]
+        items = [
+            (
+                f"attendance:{entries[i].student_email.lower()}:{entries[i].date}",
+                {"student_email": entries[i].student_email, "student_name": entries[i].student_name, "date": entries[i].date},
+                {"subject": entries[i].subject, "period": entries[i].period, "status": entries[i].status},
+                # A digest opened by a scheduled record waits for that time too
+                max(window_end, due_time(entries[i].send_at) or 0),
+            )
+            for i in buffered
+        ]
+        ids = await asyncio.to_thread(
+            outbox.buffer_many,
+            "attendance_digest",
+            "attendance_event",
+            items,
+            lane=lane.name,
+            priority=lane.priority,
+            batch_id=parent_id
+        )
+        for index, job_id in zip(buffered, ids):
+            job_ids[index] = job_id
+        scheduler.schedule(min(item[3] for item in items))
     
-    <div class="footer">
-        <p>This is an automated notification from our system.</p>
-        <p>&copy; 2025 Your Company Name. All rights reserved.</p>
-    </div>
+    return job_ids
+
+async def deliver_job(job: Job) -> Optional[dict]:
+    """Outbox handler: send one queued message through the least busy relay.
+
+    If a relay fails at the connection level or throttles us, the message
+    fails over to the next relay straight away; only when none is left is
+    the job handed back to the outbox for a later retry. The relay used and
+    any recipients it refused while accepting the rest are returned so they
+    are stored with the job for per-recipient reporting.
     """
-    
-    return get_base_template().format(
-        title=f"{notification_type.title()} Notification",
-        content=content
+    if job.kind == "attendance_digest":
+        email_data = await asyncio.to_thread(compose_attendance_digest, job)
+    else:
+        email_data = EmailRequest(**job.payload)
+    encoded = payload_mime(job.payload)
+    transactional = job.priority <= TRANSACTIONAL.priority
+    addresses = email_data.to + (email_data.cc or []) + (email_data.bcc or [])
+    recipients = len(addresses)
+    # A pruned attachment will not come back: fail the job here rather than
+    # let the missing file count against every relay it is tried on
+    missing = [
+        attachment.filename for attachment in email_data.attachments or []
+        if not attachment_store.exists(attachment.id)
+    ]
+    if missing:
+        error = f"Attachment no longer available: {', '.join(missing)}"
+        DELIVERIES.inc(job.lane, "failed")
+        delivery_log.record(job.id, job.kind, addresses, "failed", job.attempts, subject=email_data.subject, error=error)
+        raise AttachmentMissing(error)
+    tried: List[str] = []
+    while True:
+        try:
+            relay = await asyncio.to_thread(relays.acquire, recipients, transactional, exclude=tried)
+        except SendDeferred:
+            DELIVERIES.inc(job.lane, "deferred")
+            raise
+        try:
+            if transactional:
+                refused = await priority_delivery.run(send_email_smtp, email_data, relay, reserved=True, encoded=encoded)
+            else:
+                refused = await delivery.run(send_email_smtp, email_data, relay, encoded=encoded)
+        except Exception as e:
+            code = reply_code(e)
+            SMTP_FAILURES.inc(str(code) if code is not None else "none")
+            pause = await asyncio.to_thread(relays.release, relay, e)
+            if (pause is not None or is_relay_failure(e)) and len(tried) + 1 < len(relays.relays):
+                tried.append(relay.name)
+                DELIVERIES.inc(job.lane, "failover")
+                delivery_log.record(job.id, job.kind, addresses, "failover", job.attempts, relay.name, code, email_data.subject, str(e))
+                logger.warning(f"Relay {relay.name} failed for job {job.id}, trying another: {str(e)}")
+                continue
+            if pause is not None:
+                # The relay is up but wants us to slow down: requeue the job for
+                # after the pause without spending a retry or tripping the breaker
+                DELIVERIES.inc(job.lane, "throttled")
+                delivery_log.record(job.id, job.kind, addresses, "throttled", job.attempts, relay.name, code, email_data.subject, str(e))
+                raise RateLimitedError(relay.name, pause) from e
+            DELIVERIES.inc(job.lane, "failed")
+            # Same decision the outbox worker is about to make with this error
+            final = retry_policy.next_delay(job.attempts, e) is None
+            delivery_log.record(
+                job.id, job.kind, addresses, "failed" if final else "retrying", job.attempts,
+                relay.name, code, email_data.subject, str(e)
+            )
+            raise
+        relays.release(relay)
+        break
+    latency = time.time() - job.available_at
+    DELIVERIES.inc(job.lane, "sent")
+    QUEUE_LATENCY.observe(latency, job.lane)
+    lane_latency.observe(job.lane, latency)
+    result = {"relay": relay.name}
+    if job.kind == "attendance_digest":
+        await asyncio.to_thread(outbox.settle_children, job.id, "digested")
+    if refused:
+        result["refused"] = {addr: f"{code} {reply.decode(errors='replace')}" for addr, (code, reply) in refused.items()}
+        for addr, (code, reply) in refused.items():
+            delivery_log.record(job.id, job.kind, [addr], "refused", job.attempts, relay.name, code, email_data.subject, reply.decode(errors="replace"))
+    delivery_log.record(
+        job.id, job.kind, [addr for addr in addresses if addr not in (refused or {})], "sent",
+        job.attempts, relay.name, subject=email_data.subject
     )
+    return result
 
-def send_email_smtp(email_data: EmailRequest) -> bool:
-    """Send email using SMTP"""
-    try:
-        # Create message
-        msg = MIMEMultipart('alternative')
-        msg['From'] = EMAIL_CONFIG["email"]
-        msg['To'] = ", ".join(email_data.to)
-        msg['Subject'] = email_data.subject
-        
-        if email_data.cc:
-            msg['Cc'] = ", ".join(email_data.cc)
-        
-        # Add body
-        if email_data.html_body:
-            html_part = MIMEText(email_data.html_body, 'html')
-            msg.attach(html_part)
-        
-        text_part = MIMEText(email_data.body, 'plain')
-        msg.attach(text_part)
-        
-        # Connect to server and send email
-        server = smtplib.SMTP(EMAIL_CONFIG["smtp_server"], EMAIL_CONFIG["smtp_port"])
-        server.starttls()
-        server.login(EMAIL_CONFIG["email"], EMAIL_CONFIG["password"])
-        
-        # Prepare recipient list
-        recipients = email_data.to.copy()
-        if email_data.cc:
-            recipients.extend(email_data.cc)
-        if email_data.bcc:
-            recipients.extend(email_data.bcc)
-        
-        server.send_message(msg, to_addrs=recipients)
-        server.quit()
-        
-        logger.info(f"Email sent successfully to {email_data.to}")
-        return True
-        
-    except Exception as e:
-        logger.error(f"Failed to send email: {str(e)}")
-        return False
+def fanout_payloads(email_request: EmailRequest) -> List[dict]:
+    """Split a request's recipients into the messages of a fan-out send"""
+    # Already de-duplicated across to/cc/bcc when the request was validated
+    recipients = email_request.to + (email_request.cc or []) + (email_request.bcc or [])
+    base = email_request.model_dump(mode="json", exclude={"to", "cc", "bcc", "fanout", "batch_size", "send_at"})
+    if email_request.fanout == "personalized":
+        return [{**base, "to": [recipient]} for recipient in recipients]
+    size = min(email_request.batch_size or FANOUT_CONFIG["batch_size"], FANOUT_CONFIG["max_batch_size"])
+    return [
+        {**base, "to": [], "bcc": recipients[i:i + size]}
+        for i in range(0, len(recipients), size)
+    ]
+
+def recipient_report(batch_id: str) -> List[RecipientStatus]:
+    """Per-recipient outcome of a fan-out send, built from its messages"""
+    report = []
+    for job in outbox.batch_jobs(batch_id):
+        refused = (job.result or {}).get("refused", {})
+        for recipient in job.payload["to"] + (job.payload.get("cc") or []) + (job.payload.get("bcc") or []):
+            if recipient in refused:
+                report.append(RecipientStatus(email=recipient, status="refused", job_id=job.id, error=refused[recipient]))
+            else:
+                report.append(RecipientStatus(email=recipient, status=job.status, job_id=job.id, error=job.error))
+    return report
+
+def due_time(send_at: Optional[datetime]) -> Optional[float]:
+    """Epoch time for a requested send_at, or None to send now"""
+    if send_at is None:
+        return None
+    due = send_at.timestamp()
+    return due if due > time.time() else None
 
-def send_otp_email(to_email: str, otp: str) -> bool:
-    """Send OTP email with beautiful HTML template"""
+def wake_for(due: Optional[float]):
+    """Wake the workers now, or the scheduler for a job due later"""
+    if due is None:
+        outbox_workers.notify()
+    else:
+        scheduler.schedule(due)
+
+async def enqueue_email(kind: str, email_data: EmailRequest) -> str:
+    """Persist a composed email to the outbox and wake whoever picks it up"""
+    lane = lane_for(kind)
+    due = due_time(email_data.send_at)
+    # In a thread: the write may wait on another worker's lock
+    job_id = await asyncio.to_thread(
+        outbox.enqueue,
+        kind, email_data.model_dump(mode="json", exclude={"send_at"}),
+        available_at=due, lane=lane.name, priority=lane.priority
+    )
+    wake_for(due)
+    return job_id
+
+def delivery_gate(max_priority: Optional[int]) -> float:
+    """Seconds a worker should wait before claiming: every relay broken or out of budget"""
+    transactional = max_priority is not None and max_priority <= TRANSACTIONAL.priority
+    return relays.retry_after(transactional)
+
+outbox_workers = OutboxWorkers(
+    outbox,
+    deliver_job,
+    concurrency=OUTBOX_CONFIG["workers"],
+    poll_interval=OUTBOX_CONFIG["poll_interval"],
+    reserved={TRANSACTIONAL.priority: OUTBOX_CONFIG["reserved_workers"]},
+    retry_policy=retry_policy,
+    gate=delivery_gate,
+)
+
+# Messages sent with send_at wait in the outbox as "scheduled" and are
+# released into the queue in batches as they fall due
+SCHEDULER_CONFIG = {
+    "batch_size": int(os.getenv("SCHEDULE_RELEASE_BATCH", 500)),
+    "interval": float(os.getenv("SCHEDULE_RELEASE_INTERVAL", 1.0)),
+    "max_queued": int(os.getenv("SCHEDULE_MAX_QUEUED", 5000)),
+}
+
+scheduler = Scheduler(
+    outbox,
+    outbox_workers.notify,
+    batch_size=SCHEDULER_CONFIG["batch_size"],
+    interval=SCHEDULER_CONFIG["interval"],
+    max_queued=SCHEDULER_CONFIG["max_queued"],
+)
+
+certificate_pipeline = CertificatePipeline(
+    outbox,
+    attachment_store,
+    render_pool,
+    certificate_message,
+    outbox_workers.notify,
+    chunk_size=CERTIFICATE_CONFIG["chunk_size"],
+    max_in_flight=CERTIFICATE_CONFIG["max_in_flight"],
+    max_queued=CERTIFICATE_CONFIG["max_queued"],
+    lease_seconds=CERTIFICATE_CONFIG["lease_seconds"],
+    max_attempts=CERTIFICATE_CONFIG["max_attempts"],
+)
+
+async def render_in_pool(render, items: list) -> list:
+    """``render`` applied to ``items`` in render-pool chunks run side by side, results in order"""
+    started = time.perf_counter()
+    size = RENDER_POOL_CONFIG["chunk_size"]
+    chunks = await asyncio.gather(*(
+        render_pool.run(render, items[i:i + size])
+        for i in range(0, len(items), size)
+    ))
+    PHASE_SECONDS.observe(time.perf_counter() - started, "pool_render")
+    return [result for chunk in chunks for result in chunk]
+
+async def render_attendance_payloads(entries: List[AttendanceRecord]) -> Optional[List[Optional[dict]]]:
+    """Render and encode a bulk request's immediate attendance emails in the render pool.
+
+    Returns a payload per entry (None for those bound for a digest), or
+    None when there are too few for the pool to be worth it or a render
+    worker died; record_attendance then composes them in-process.
+    """
+    immediate = [index for index, entry in enumerate(entries) if not goes_to_digest(entry)]
+    if len(immediate) < RENDER_POOL_CONFIG["min_batch"]:
+        return None
     try:
-        html_content = get_otp_email_template(otp, "Admin")
-        
-        msg = MIMEMultipart('alternative')
-        msg['From'] = EMAIL_CONFIG["email"]
-        msg['To'] = to_email
-        msg['Subject'] = "🔐 Admin Login OTP - Secure Access Code"
-        
-        # Add both text and HTML versions
-        text_content = f"""
-        Admin Login Verification
-        
-        Hello Admin!
-        
-        Your OTP for secure access is: {otp}
-        
-        This code is valid for 5 minutes only.
-        
-        Security Notice:
-        - Do not share this code with anyone
-        - If you didn't request this, please ignore this email
-        
-        This is an automated message.
-        """
-        
-        text_part = MIMEText(text_content, 'plain')
-        html_part = MIMEText(html_content, 'html')
-        
-        msg.attach(text_part)
-        msg.attach(html_part)
-        
-        with smtplib.SMTP(EMAIL_CONFIG["smtp_server"], EMAIL_CONFIG["smtp_port"]) as server:
-            server.starttls()
-            server.login(EMAIL_CONFIG["email"], EMAIL_CONFIG["password"])
-            server.send_message(msg)
-        
-        logger.info(f"OTP sent successfully to {to_email}")
-        return True
-        
-    except Exception as e:
-        logger.error(f"Failed to send OTP email: {str(e)}")
-        return False
+        rendered = await render_in_pool(
+            render_attendance, [entries[index].model_dump(exclude={"send_at"}) for index in immediate]
+        )
+    except BrokenExecutor as e:
+        # The pool has replaced itself; this chunk is composed here instead
+        logger.warning(f"Render pool unavailable, composing {len(immediate)} attendance emails in-process: {str(e)}")
+        return None
+    payloads: List[Optional[dict]] = [None] * len(entries)
+    for index, payload in zip(immediate, rendered):
+        payloads[index] = payload
+    return payloads
+
+# Send endpoints shed load once a lane's backlog (queued + sending, across
+# all workers) or this process's concurrent requests hit these limits
+ADMISSION_CONFIG = {
+    "max_queued": {
+        TRANSACTIONAL.name: int(os.getenv("ADMISSION_MAX_QUEUED_TRANSACTIONAL", 1000)),
+        DEFAULT.name: int(os.getenv("ADMISSION_MAX_QUEUED_DEFAULT", 10000)),
+        BULK.name: int(os.getenv("ADMISSION_MAX_QUEUED_BULK", 50000)),
+    },
+    "max_inflight": {
+        TRANSACTIONAL.name: int(os.getenv("ADMISSION_MAX_INFLIGHT_TRANSACTIONAL", 200)),
+        DEFAULT.name: int(os.getenv("ADMISSION_MAX_INFLIGHT_DEFAULT", 200)),
+        # Each bulk request can carry a whole roster
+        BULK.name: int(os.getenv("ADMISSION_MAX_INFLIGHT_BULK", 20)),
+    },
+    "refresh": float(os.getenv("ADMISSION_REFRESH_INTERVAL", 0.25)),
+    "default_retry_after": int(os.getenv("ADMISSION_DEFAULT_RETRY_AFTER", 5)),
+    # /health reports "degraded" once any lane's backlog passes this share of its limit
+    "degraded_at": float(os.getenv("ADMISSION_DEGRADED_AT", 0.8)),
+}
+
+admission = AdmissionController(
+    ADMISSION_CONFIG["max_queued"],
+    ADMISSION_CONFIG["max_inflight"],
+    depth=lambda: {
+        lane: statuses["queued"] + statuses["sending"] for lane, statuses in outbox.depth_by_lane().items()
+    },
+    delivered=lambda: {lane: stats["delivered"] for lane, stats in lane_latency.snapshot().items()},
+    refresh=ADMISSION_CONFIG["refresh"],
+    default_retry_after=ADMISSION_CONFIG["default_retry_after"],
+)
+
+def admit(lane: Lane):
+    """Endpoint dependency that rejects the request before any work when ``lane`` is full"""
+    async def dependency():
+        rejection = admission.enter(lane.name)
+        if rejection is not None:
+            raise HTTPException(
+                status_code=rejection.status_code,
+                detail=rejection.reason,
+                headers={"Retry-After": str(rejection.retry_after)},
+            )
+        try:
+            yield
+        finally:
+            admission.leave(lane.name)
+    return Depends(dependency)
 
 @app.get("/")
 async def root():
     return {"message": "Email Service API with OTP is running"}
 
 @app.get("/health")
-async def health_check():
-    return {"status": "healthy", "service": "email-api-with-otp"}
+async def health_check(response: Response):
+    """Queue-aware health: 503 while any lane is shedding load"""
+    lanes = admission.snapshot()
+    relay_wait = relays.retry_after()
+    if any(lane["utilisation"] >= 1 for lane in lanes.values()):
+        status = "saturated"
+        response.status_code = 503
+    elif relay_wait > 0 or any(lane["utilisation"] >= ADMISSION_CONFIG["degraded_at"] for lane in lanes.values()):
+        status = "degraded"
+    else:
+        status = "healthy"
+    return {
+        "status": status,
+        "service": "email-api-with-otp",
+        "lanes": lanes,
+        "scheduled": outbox.scheduled_depth(),
+        "rendering": outbox.render_depth(),
+        "relays_available_in": round(relay_wait, 2),
+        "admission": admission.stats(),
+    }
+
+@app.get("/smtp-pool/stats")
+async def smtp_pool_stats():
+    """Per-relay pool hits, misses, reconnects, utilisation and health"""
+    return {
+        "relays": relays.stats(),
+        "delivery": delivery.stats(),
+        "priority_delivery": priority_delivery.stats(),
+        "mime_cache": message_builder.cache.stats(),
+    }
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Prometheus text exposition of request, phase, queue and pool metrics"""
+    return Response(content=metrics.REGISTRY.render(), media_type=metrics.CONTENT_TYPE)
+
+@app.get("/rate-limits")
+async def rate_limits():
+    """Remaining sending budget per relay and sender, and current backoff"""
+    return await asyncio.to_thread(rate_controller.budget)
+
+def attendance_digest_stats() -> dict:
+    groups = outbox.group_stats("attendance_digest")
+    sent = groups.get("sent", {"groups": 0, "children": 0})
+    return {
+        "window_seconds": ATTENDANCE_DIGEST_CONFIG["window"],
+        "immediate_statuses": sorted(ATTENDANCE_DIGEST_CONFIG["immediate_statuses"]),
+        "open_digests": groups.get(SCHEDULED_STATUS, {}).get("groups", 0),
+        "buffered_events": groups.get(SCHEDULED_STATUS, {}).get("children", 0),
+        "digests_sent": sent["groups"],
+        "events_digested": sent["children"],
+        # One email per event before digests
+        "sends_saved": sent["children"] - sent["groups"],
+        "by_status": groups,
+    }
+
+@app.get("/attendance-digest/stats")
+async def attendance_digest_stats_endpoint():
+    """Open digests, buffered events and how many sends digests have saved"""
+    return attendance_digest_stats()
+
+@app.get("/lanes/stats")
+async def lane_stats():
+    """Per-lane queue depth and queue-to-delivery latency percentiles"""
+    depths = outbox.depth_by_lane()
+    return {
+        lane: {**stats, **depths.get(lane, {"queued": 0, "sending": 0})}
+        for lane, stats in lane_latency.snapshot().items()
+    }
+
+@app.get("/jobs/{job_id}", response_model=JobStatusResponse)
+async def get_job(job_id: str):
+    """Delivery status of a queued message"""
+    job = outbox.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    recipients = None
+    recipient_counts = None
+    if job.kind == "email_fanout":
+        recipients = recipient_report(job.id)
+        recipient_counts = {}
+        for recipient in recipients:
+            recipient_counts[recipient.status] = recipient_counts.get(recipient.status, 0) + 1
+    return JobStatusResponse(
+        id=job.id,
+        kind=job.kind,
+        status=job.status,
+        attempts=job.attempts,
+        error=job.error,
+        created_at=job.created_at,
+        updated_at=job.updated_at,
+        sent_at=job.sent_at,
+        parent_id=job.parent_id,
+        counts=outbox.batch_counts(job.id) if job.status == BATCH_STATUS or job.kind == "attendance_digest" else None,
+        relay=(job.result or {}).get("relay"),
+        refused=(job.result or {}).get("refused"),
+        recipients=recipients,
+        recipient_counts=recipient_counts
+    )
 
-@app.post("/send-email", response_model=EmailResponse)
-async def send_email(email_request: EmailRequest):
-    """Send a generic email"""
+def job_progress(job_id: str) -> Optional[dict]:
+    """Message counts of a job for its event stream; a batch counts its children"""
+    job = outbox.get(job_id)
+    if job is None:
+        return None
+    if job.status == BATCH_STATUS:
+        counts = outbox.batch_counts(job.id)
+    else:
+        counts = {"queued": 0, "sending": 0, "sent": 0, "failed": 0, job.status: 1, "total": 1}
+    return {
+        "job_id": job.id,
+        "kind": job.kind,
+        "status": job.status,
+        "counts": counts,
+        "done": counts.get(RENDER_STATUS, 0) + counts.get(SCHEDULED_STATUS, 0) + counts["queued"] + counts["sending"] == 0,
+    }
+
+job_event_hub = JobEventHub(job_progress, interval=JOB_EVENTS_CONFIG["poll_interval"])
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str):
+    """Server-Sent Events stream of a job's sent, failed and queued counts.
+
+    Emits a ``progress`` event whenever the counts change and a final
+    ``done`` event once nothing is left queued or in flight. Every client
+    watching the same job shares one poller.
+    """
+    if outbox.get(job_id) is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return StreamingResponse(
+        sse_stream(job_event_hub.subscribe(job_id), heartbeat=JOB_EVENTS_CONFIG["heartbeat"]),
+        media_type="text/event-stream",
+        # Disable proxy buffering so events arrive as they are sent
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.get("/deliveries", response_model=DeliveryPage)
+async def list_deliveries(
+    recipient: Optional[str] = None,
+    status: Optional[str] = None,
+    kind: Optional[str] = None,
+    job_id: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    cursor: Optional[int] = None,
+    limit: int = Query(50, ge=1, le=500)
+):
+    """Delivery attempts, newest first, filtered by recipient, status, kind, job or time"""
+    items = delivery_log.query(
+        recipient=recipient,
+        status=status,
+        kind=kind,
+        job_id=job_id,
+        since=since.timestamp() if since else None,
+        until=until.timestamp() if until else None,
+        before_id=cursor,
+        limit=limit
+    )
+    return DeliveryPage(
+        items=items,
+        next_cursor=items[-1]["id"] if len(items) == limit else None
+    )
+
+@app.get("/deliveries/stats")
+async def delivery_stats(since: Optional[datetime] = None, until: Optional[datetime] = None):
+    """Delivery attempts per day and per kind, broken down by status"""
+    rows = delivery_log.daily_counts(
+        since=since.timestamp() if since else None,
+        until=until.timestamp() if until else None
+    )
+    days: Dict[str, Dict[str, int]] = {}
+    kinds: Dict[str, Dict[str, int]] = {}
+    for row in rows:
+        for bucket in (days.setdefault(row["day"], {}), kinds.setdefault(row["kind"], {})):
+            bucket[row["status"]] = bucket.get(row["status"], 0) + row["count"]
+    return {"per_day": days, "per_kind": kinds, "rows": rows, "log": delivery_log.stats()}
+
+@app.on_event("startup")
+async def start_outbox_workers():
+    outbox_workers.start()
+    scheduler.start()
+    otp_sweeper.start()
+    delivery_log.start()
+    attachment_store.start()
+    certificate_pipeline.start()
+
+@app.on_event("shutdown")
+async def stop_delivery():
+    await otp_sweeper.stop()
+    await scheduler.stop()
+    await outbox_workers.stop()
+    await delivery_log.stop()
+    await certificate_pipeline.stop()
+    await attachment_store.stop()
+    render_pool.shutdown()
+    delivery.shutdown()
+    priority_delivery.shutdown()
+    relays.close()
+
+async def read_email_request(request: Request) -> EmailRequest:
+    """Parse /send-email's body: an EmailRequest as JSON, or multipart form
+    data with that JSON in an ``email`` field and files in ``attachments``.
+
+    Uploads arrive spooled to disk by the form parser and are copied into
+    the attachment store in chunks, so a large file is never held in memory.
+    """
+    is_form = request.headers.get("content-type", "").startswith(
+        ("multipart/form-data", "application/x-www-form-urlencoded")
+    )
+    # Errors are reported the way FastAPI does for a declared body
+    if is_form:
+        form = await request.form(max_files=ATTACHMENT_CONFIG["max_files"])
+        raw, loc = str(form.get("email") or "{}"), ("body", "email")
+    else:
+        raw, loc = await request.body(), ("body",)
+    if not raw:
+        raise RequestValidationError([{"type": "missing", "loc": loc, "msg": "Field required", "input": None}])
+    try:
+        data = json.loads(raw)
+    except json.JSONDecodeError as e:
+        raise RequestValidationError(
+            [{"type": "json_invalid", "loc": (*loc, e.pos), "msg": "JSON decode error", "input": {}, "ctx": {"error": e.msg}}],
+            body=e.doc,
+        )
+    try:
+        email_request = EmailRequest.model_validate(data)
+    except ValidationError as e:
+        raise RequestValidationError([{**error, "loc": (*loc, *error["loc"])} for error in e.errors()], body=data)
+    if email_request.attachments:
+        raise HTTPException(status_code=422, detail="Attachments must be uploaded as multipart/form-data files")
+    if not is_form:
+        return email_request
+    
+    uploads = [upload for upload in form.getlist("attachments") if not isinstance(upload, str)]
+    try:
+        refs = [
+            await asyncio.to_thread(attachment_store.save, upload.file, upload.filename, upload.content_type)
+            for upload in uploads
+        ]
+    except AttachmentTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    finally:
+        await form.close()
+    email_request.attachments = [AttachmentRef(**ref) for ref in refs] or None
+    return email_request
+
+# /send-email reads its own body so it can take JSON or a multipart upload;
+# both encodings are documented here, with EmailRequest added to the
+# schema components below
+SEND_EMAIL_OPENAPI = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "application/json": {"schema": {"$ref": "#/components/schemas/EmailRequest"}},
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "properties": {
+                        "email": {"type": "string", "description": "The EmailRequest as JSON"},
+                        "attachments": {"type": "array", "items": {"type": "string", "format": "binary"}},
+                    },
+                    "required": ["email"],
+                }
+            },
+        },
+    },
+    "responses": {
+        "422": {
+            "description": "Validation Error",
+            "content": {"application/json": {"schema": {"$ref": "#/components/schemas/HTTPValidationError"}}},
+        }
+    },
+}
+
+def openapi_schema() -> dict:
+    """FastAPI's schema plus the models of bodies that endpoints parse themselves"""
+    if app.openapi_schema is None:
+        schema = FastAPI.openapi(app)
+        _, definitions = models_json_schema(
+            [(EmailRequest, "validation")], ref_template="#/components/schemas/{model}"
+        )
+        schema["components"]["schemas"].update(definitions["$defs"])
+    return app.openapi_schema
+
+app.openapi = openapi_schema
+
+@app.post(
+    "/send-email", response_model=EmailResponse, status_code=202, dependencies=[admit(lane_for("email"))],
+    openapi_extra=SEND_EMAIL_OPENAPI,
+)
+async def send_email(request: Request):
+    """Send a generic email, optionally with attachments (multipart upload)"""
+    
+    email_request = await read_email_request(request)
     
     # Validate email configuration
-    if not EMAIL_CONFIG["email"] or not EMAIL_CONFIG["password"]:
+    if not relays.configured:
         raise HTTPException(
             status_code=500, 
             detail="Email configuration is incomplete. Please check environment variables."
         )
     
+    if email_request.batch_size is not None and email_request.batch_size < 1:
+        raise HTTPException(status_code=422, detail="batch_size must be at least 1")
+    
     try:
-        success = send_email_smtp(email_request)
-        
-        if success:
+        if email_request.fanout:
+            # Each batch is its own outbox job, so batches go out in parallel
+            # over the shared pool and a refused batch does not sink the rest
+            payloads = fanout_payloads(email_request)
+            batch_id = await asyncio.to_thread(outbox.create_batch, "email_fanout")
+            lane = lane_for("fanout")
+            due = due_time(email_request.send_at)
+            await asyncio.to_thread(
+                outbox.enqueue_many,
+                "fanout", payloads, parent_id=batch_id, available_at=due, lane=lane.name, priority=lane.priority
+            )
+            wake_for(due)
+            
             return EmailResponse(
                 success=True,
-                message="Email sent successfully",
-                email_id=f"email_{hash(str(email_request.to))}"
+                message="Email scheduled for delivery in batches" if due else "Email queued for delivery in batches",
+                email_id=batch_id,
+                recipients=sum(len(payload["to"]) + len(payload.get("bcc") or []) for payload in payloads),
+                batches=len(payloads),
+                scheduled_for=email_request.send_at if due else None
             )
-        else:
-            raise HTTPException(status_code=500, detail="Failed to send email")
+        
+        job_id = await enqueue_email("email", email_request)
+        scheduled = due_time(email_request.send_at) is not None
+        
+        return EmailResponse(
+            success=True,
+            message="Email scheduled for delivery" if scheduled else "Email queued for delivery",
+            email_id=job_id,
+            scheduled_for=email_request.send_at if scheduled else None
+        )
             
     except Exception as e:
         logger.error(f"Error in send_email endpoint: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
-@app.post("/contact-form", response_model=EmailResponse)
+@app.post("/contact-form", response_model=EmailResponse, status_code=202, dependencies=[admit(lane_for("contact"))])
 async def contact_form(contact_request: ContactFormRequest):
     """Handle contact form submissions with beautiful HTML"""
     
@@ -651,29 +1481,27 @@ async def contact_form(contact_request: ContactFormRequest):
             html_body=html_body
         )
         
-        success = send_email_smtp(email_data)
+        job_id = await enqueue_email("contact", email_data)
         
-        if success:
-            return EmailResponse(
-                success=True,
-                message="Contact form submitted successfully",
-                email_id=f"contact_{hash(contact_request.email)}"
-            )
-        else:
-            raise HTTPException(status_code=500, detail="Failed to send contact form")
+        return EmailResponse(
+            success=True,
+            message="Contact form submitted successfully",
+            email_id=job_id
+        )
             
     except Exception as e:
         logger.error(f"Error in contact_form endpoint: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
-@app.post("/send-notification")
+@app.post("/send-notification", status_code=202, dependencies=[admit(lane_for("notification"))])
 async def send_notification(
-    recipient: EmailStr,
+    recipient: Recipient,
     subject: str,
     message: str,
-    notification_type: str = "general"
+    notification_type: str = "general",
+    send_at: Optional[datetime] = None
 ):
-    """Send notification emails with beautiful HTML"""
+    """Send notification emails with beautiful HTML, now or at ``send_at``"""
     
     try:
         html_content = get_notification_template(subject, message, notification_type)
@@ -693,75 +1521,400 @@ async def send_notification(
             to=[recipient],
             subject=f"[{notification_type.upper()}] {subject}",
             body=text_content,
-            html_body=html_content
+            html_body=html_content,
+            send_at=send_at
         )
         
-        success = send_email_smtp(email_data)
+        job_id = await enqueue_email("notification", email_data)
         
-        if success:
-            return {"success": True, "message": "Notification sent"}
-        else:
-            raise HTTPException(status_code=500, detail="Failed to send notification")
+        if due_time(send_at) is not None:
+            return {"success": True, "message": "Notification scheduled", "job_id": job_id, "scheduled_for": send_at}
+        return {"success": True, "message": "Notification queued", "job_id": job_id}
             
     except Exception as e:
         logger.error(f"Error in send_notification endpoint: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/send-attendance-notification")
+@app.post("/send-attendance-notification", status_code=202, dependencies=[admit(lane_for("attendance_single"))])
 async def send_attendance_notification(
-    student_email: EmailStr,
+    student_email: Recipient,
     student_name: str,
     subject: str,
     date: str,
     period: str,
-    status: str
+    status: str,
+    send_at: Optional[datetime] = None
 ):
-    """Send attendance notification with beautiful HTML"""
+    """Send attendance notification with beautiful HTML, now or at ``send_at``"""
     
     try:
-        html_content = get_attendance_email_template(
-            student_name, subject, date, period, status
-        )
-        
-        # Simple text fallback
-        text_content = f"""
-        Attendance Update for {student_name}
-        
-        Subject: {subject}
-        Date: {date}
-        Period: {period}
-        Status: {status.upper()}
-        
-        {"Great job! Keep up the excellent attendance record!" if status.lower() == "present" else "Please ensure regular attendance for better academic performance."}
-        
-        Recorded: {datetime.now().strftime('%B %d, %Y at %I:%M %p')}
-        """
-        
-        email_data = EmailRequest(
-            to=[student_email],
-            subject=f"📚 Attendance Update - {subject} ({status.title()})",
-            body=text_content,
-            html_body=html_content
+        entry = AttendanceRecord(
+            student_email=student_email, student_name=student_name,
+            subject=subject, date=date, period=period, status=status, send_at=send_at
         )
+        job_id = (await record_attendance([entry], lane_kind="attendance_single"))[0]
         
-        success = send_email_smtp(email_data)
-        
-        if success:
-            return {"success": True, "message": "Attendance notification sent"}
-        else:
-            raise HTTPException(status_code=500, detail="Failed to send attendance notification")
+        if goes_to_digest(entry):
+            return {"success": True, "message": "Attendance recorded for the daily digest", "job_id": job_id}
+        if due_time(send_at) is not None:
+            return {"success": True, "message": "Attendance notification scheduled", "job_id": job_id, "scheduled_for": send_at}
+        return {"success": True, "message": "Attendance notification queued", "job_id": job_id}
             
     except Exception as e:
         logger.error(f"Error in send_attendance_notification endpoint: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post(
+    "/send-attendance-notifications/bulk",
+    response_model=BulkAttendanceResponse,
+    status_code=202,
+    dependencies=[admit(lane_for("attendance"))],
+)
+async def send_attendance_notifications_bulk(request: Request):
+    """Queue attendance notifications for a whole roster in one call.
+
+    Accepts a JSON array of attendance records, or a CSV (with a header row)
+    or NDJSON roster that is parsed as it streams in. Records are persisted
+    to the outbox in chunks, each either buffered into the student's daily
+    digest or queued as its own message.
+    """
+    started = time.perf_counter()
+    
+    try:
+        records = aiter_records(request.headers.get("content-type", ""), request.stream())
+    except RecordFormatError as e:
+        raise HTTPException(status_code=415, detail=str(e))
+    
+    # Created with the first valid record, so a rejected upload leaves no empty batch
+    batch_id = None
+    results: List[BulkAttendanceResult] = []
+    pending = []  # (result, record) waiting to be written to the outbox
+    parse_error = None
+    
+    async def flush():
+        nonlocal batch_id
+        if batch_id is None:
+            batch_id = await asyncio.to_thread(outbox.create_batch, "attendance_bulk")
+        entries = [entry for _, entry in pending]
+        payloads = await render_attendance_payloads(entries)
+        job_ids = await record_attendance(entries, parent_id=batch_id, payloads=payloads)
+        for (result, _), job_id in zip(pending, job_ids):
+            result.job_id = job_id
+        pending.clear()
+    
+    index = 0
+    try:
+        async for record in records:
+            try:
+                entry = AttendanceRecord(**record)
+            except ValidationError as e:
+                error = e.errors()[0]
+                results.append(BulkAttendanceResult(
+                    index=index,
+                    student_email=str(record.get("student_email", "")),
+                    status="invalid",
+                    error=f"{'.'.join(str(loc) for loc in error['loc'])}: {error['msg']}"
+                ))
+            else:
+                # Digested records point at the digest that will carry them
+                if goes_to_digest(entry):
+                    status = BUFFERED_STATUS
+                elif due_time(entry.send_at) is not None:
+                    status = SCHEDULED_STATUS
+                else:
+                    status = "queued"
+                result = BulkAttendanceResult(
+                    index=index, student_email=entry.student_email, status=status
+                )
+                results.append(result)
+                pending.append((result, entry))
+                if len(pending) >= BULK_CONFIG["chunk_size"]:
+                    await flush()
+            index += 1
+    except RecordFormatError as e:
+        parse_error = str(e)
+    
+    if pending:
+        await flush()
+    
+    queued = sum(1 for result in results if result.status in ("queued", BUFFERED_STATUS, SCHEDULED_STATUS))
+    if parse_error and not queued:
+        raise HTTPException(status_code=400, detail=parse_error)
+    
+    elapsed = time.perf_counter() - started
+    logger.info(f"Bulk attendance batch {batch_id}: {queued}/{len(results)} queued in {elapsed:.3f}s")
+    
+    return BulkAttendanceResponse(
+        success=parse_error is None,
+        batch_id=batch_id,
+        total=len(results),
+        queued=queued,
+        invalid=len(results) - queued,
+        elapsed_ms=round(elapsed * 1000, 2),
+        records_per_second=round(len(results) / elapsed, 1) if elapsed > 0 else 0.0,
+        parse_error=parse_error,
+        results=results
+    )
+
+def upload_content_type(upload: UploadFile) -> str:
+    """Content type of an uploaded roster, falling back to its file extension"""
+    content_type = (upload.content_type or "").split(";")[0].strip().lower()
+    if content_type not in ("", "application/octet-stream", "text/plain"):
+        return content_type
+    name = (upload.filename or "").lower()
+    if name.endswith((".ndjson", ".jsonl")):
+        return "application/x-ndjson"
+    if name.endswith(".json"):
+        return "application/json"
+    return "text/csv"
+
+async def upload_chunks(upload: UploadFile, size: int = 64 * 1024):
+    while True:
+        chunk = await upload.read(size)
+        if not chunk:
+            return
+        yield chunk
+
+@app.post("/mail-merge", response_model=MailMergeResponse, status_code=202, dependencies=[admit(lane_for("merge"))])
+async def mail_merge(
+    file: UploadFile = File(...),
+    subject: str = Form(...),
+    body: str = Form(...),
+    html_body: Optional[str] = Form(None),
+    email_field: str = Form(MAIL_MERGE_CONFIG["email_field"]),
+    dry_run: bool = Form(False),
+    send_at: Optional[datetime] = Form(None),
+):
+    """Send one personalised email per row of an uploaded CSV or NDJSON file.
+
+    ``subject``, ``body`` and ``html_body`` are templates with ``{column}``
+    placeholders filled from each row; the recipient comes from the
+    ``email_field`` column. Rows are parsed, validated and rendered as the
+    file is read and written to the outbox in chunks, so memory stays
+    bounded however large the campaign. With ``dry_run`` nothing is queued:
+    the response reports how fast the file rendered, how long delivery
+    would take and a preview of the first message.
+    """
+    started = time.perf_counter()
+    
+    try:
+        template = MergeTemplate(subject, body, html_body)
+        records = aiter_records(upload_content_type(file), upload_chunks(file))
+    except (ValueError, RecordFormatError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid template or file: {str(e)}")
+    
+    lane = lane_for("merge")
+    due = due_time(send_at)
+    lane_state = admission.snapshot()[lane.name]
+    queued_ahead = lane_state["queued"]
+    # Created with the first queued row, so a rejected upload leaves no empty batch
+    batch_id = None
+    errors: List[MailMergeError] = []
+    preview = None
+    pending: List[dict] = []
+    total = queued = invalid = 0
+    parse_error = None
+    
+    async def flush():
+        nonlocal batch_id
+        if batch_id is None:
+            batch_id = await asyncio.to_thread(outbox.create_batch, "merge")
+        await asyncio.to_thread(
+            outbox.enqueue_many,
+            "merge", pending, parent_id=batch_id, available_at=due, lane=lane.name, priority=lane.priority
+        )
+        pending.clear()
+        wake_for(due)
+    
+    try:
+        async for row in records:
+            total += 1
+            email = str(row.get(email_field) or "")
+            missing = template.missing(row)
+            try:
+                if missing:
+                    raise ValueError(f"missing value for {', '.join(missing)}")
+                rendered_subject, rendered_body, rendered_html = template.render(row)
+                email_data = EmailRequest(
+                    to=[email], subject=rendered_subject, body=rendered_body, html_body=rendered_html
+                )
+            except (ValueError, ValidationError) as e:
+                invalid += 1
+                if len(errors) < MAIL_MERGE_CONFIG["max_errors"]:
+                    if isinstance(e, ValidationError):
+                        error = e.errors()[0]
+                        message = f"{'.'.join(str(loc) for loc in error['loc'])}: {error['msg']}"
+                    else:
+                        message = str(e)
+                    errors.append(MailMergeError(row=total, email=email, error=message))
+                continue
+            queued += 1
+            if dry_run:
+                if preview is None:
+                    preview = MailMergePreview(
+                        to=email, subject=rendered_subject, body=rendered_body, html_body=rendered_html
+                    )
+                continue
+            pending.append(email_data.model_dump(mode="json", exclude={"send_at"}))
+            if len(pending) >= BULK_CONFIG["chunk_size"]:
+                await flush()
+    except RecordFormatError as e:
+        parse_error = str(e)
+    
+    if pending:
+        await flush()
+    
+    if parse_error and not queued:
+        raise HTTPException(status_code=400, detail=parse_error)
+    
+    elapsed = time.perf_counter() - started
+    backlog = queued_ahead + queued
+    estimates = [relays.send_time(backlog)]
+    if lane_state["drain_per_second"] > 0:
+        estimates.append(backlog / lane_state["drain_per_second"])
+    known = [seconds for seconds in estimates if seconds is not None]
+    estimate = round(max(known), 1) if known else None
+    logger.info(
+        f"Mail merge {batch_id or '(dry run)'}: {queued}/{total} rows {'valid' if dry_run else 'queued'} in {elapsed:.3f}s"
+    )
+    
+    return MailMergeResponse(
+        success=parse_error is None,
+        dry_run=dry_run,
+        batch_id=batch_id,
+        fields=list(template.fields),
+        total=total,
+        queued=queued,
+        invalid=invalid,
+        elapsed_ms=round(elapsed * 1000, 2),
+        records_per_second=round(total / elapsed, 1) if elapsed > 0 else 0.0,
+        queued_ahead=queued_ahead,
+        estimated_send_seconds=estimate,
+        scheduled_for=send_at if due is not None else None,
+        parse_error=parse_error,
+        errors=errors,
+        preview=preview,
+    )
+
+def credential_id() -> str:
+    """``CERT-YYMMDD-XXXXXXXX``, the React generator's format with a longer random part"""
+    return f"CERT-{datetime.now():%y%m%d}-{secrets.token_hex(4).upper()}"
+
+@app.post("/send-certificates", response_model=CertificateBatchResponse, status_code=202,
+          dependencies=[admit(lane_for("certificate"))])
+async def send_certificates(
+    file: UploadFile = File(...),
+    event: str = Form(...),
+    date: str = Form(...),
+    template: Literal["classic", "modern", "elegant"] = Form("classic"),
+    signature: Optional[str] = Form(None),
+    instructor: Optional[str] = Form(None),
+    watermark: Optional[str] = Form(None),
+    hours: Optional[str] = Form(None),
+):
+    """Render and mail a certificate to every participant of an event.
+
+    ``file`` is a CSV or NDJSON roster with ``name`` and ``email`` columns
+    and optional ``hours`` (overriding the form's) and ``credential_id``
+    (generated when absent). Participants are stored in the outbox as they
+    are read; the certificate pipeline then renders them in the process
+    pool chunk by chunk and queues each email with its PDF attached, so the
+    first certificates are sent while the rest are still rendering. Follow
+    progress on ``/jobs/{batch_id}/events``.
+    """
+    started = time.perf_counter()
+    
+    try:
+        records = aiter_records(upload_content_type(file), upload_chunks(file))
+    except RecordFormatError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid file: {str(e)}")
+    
+    lane = lane_for("certificate")
+    spec = {
+        "style": template,
+        "event": event,
+        "date": date,
+        "signature": signature,
+        "instructor": instructor,
+        "watermark": watermark,
+    }
+    # Created with the first valid participant, so a rejected roster leaves no empty batch
+    batch_id = None
+    errors: List[MailMergeError] = []
+    pending: List[dict] = []
+    total = queued = invalid = 0
+    parse_error = None
+    
+    async def flush():
+        nonlocal batch_id
+        if batch_id is None:
+            batch_id = await asyncio.to_thread(outbox.create_batch, "certificate_batch")
+        await asyncio.to_thread(
+            outbox.enqueue_many,
+            "certificate", pending, parent_id=batch_id, lane=lane.name, priority=lane.priority, status=RENDER_STATUS
+        )
+        pending.clear()
+        certificate_pipeline.notify()
+    
+    try:
+        async for row in records:
+            total += 1
+            try:
+                participant = CertificateParticipant(**{key: value for key, value in row.items() if value not in ("", None)})
+            except ValidationError as e:
+                invalid += 1
+                if len(errors) < MAIL_MERGE_CONFIG["max_errors"]:
+                    error = e.errors()[0]
+                    errors.append(MailMergeError(
+                        row=total,
+                        email=str(row.get("email") or ""),
+                        error=f"{'.'.join(str(loc) for loc in error['loc'])}: {error['msg']}",
+                    ))
+                continue
+            queued += 1
+            pending.append({
+                "to": [participant.email],
+                "template": spec,
+                "certificate": {
+                    "name": participant.name,
+                    "credential_id": participant.credential_id or credential_id(),
+                    "hours": participant.hours or hours,
+                },
+            })
+            if len(pending) >= BULK_CONFIG["chunk_size"]:
+                await flush()
+    except RecordFormatError as e:
+        parse_error = str(e)
+    
+    if pending:
+        await flush()
+    
+    if parse_error and not queued:
+        raise HTTPException(status_code=400, detail=parse_error)
+    
+    elapsed = time.perf_counter() - started
+    logger.info(f"Certificate batch {batch_id}: {queued}/{total} participants queued for rendering in {elapsed:.3f}s")
+    
+    return CertificateBatchResponse(
+        success=parse_error is None,
+        batch_id=batch_id,
+        template=template,
+        total=total,
+        queued=queued,
+        invalid=invalid,
+        elapsed_ms=round(elapsed * 1000, 2),
+        records_per_second=round(total / elapsed, 1) if elapsed > 0 else 0.0,
+        parse_error=parse_error,
+        errors=errors,
+    )
+
 # OTP Endpoints
-@app.post("/send-otp", response_model=OTPResponse)
-async def send_otp(email: EmailStr = Form(...)):
+@app.post("/send-otp", response_model=OTPResponse, status_code=202, dependencies=[admit(lane_for("otp"))])
+async def send_otp(email: Recipient = Form(...)):
     """Send OTP for admin login with beautiful HTML"""
     
     # Validate email configuration
-    if not EMAIL_CONFIG["email"] or not EMAIL_CONFIG["password"]:
+    if not relays.configured:
         raise HTTPException(
             status_code=500,
             detail="Email configuration is incomplete"
@@ -777,23 +1930,19 @@ async def send_otp(email: EmailStr = Form(...)):
     try:
         # Generate OTP
         otp = random.randint(100000, 999999)
-        expiry = time.time() + 300  # 5 minutes
-        OTP_STORE[email] = (str(otp), expiry)
+        await asyncio.to_thread(otp_store.put, email, str(otp), OTP_CONFIG["ttl"])
         
         # Send OTP email with beautiful HTML
-        success = send_otp_email(email, str(otp))
+        job_id = await enqueue_email("otp", compose_otp_email(email, str(otp)))
         
-        if success:
-            return OTPResponse(message="OTP sent successfully")
-        else:
-            raise HTTPException(status_code=500, detail="Failed to send OTP")
+        return OTPResponse(message="OTP queued for delivery", job_id=job_id)
             
     except Exception as e:
         logger.error(f"Error in send_otp endpoint: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
 @app.post("/verify-otp", response_model=OTPResponse)
-async def verify_otp(email: EmailStr = Form(...), otp: str = Form(...)):
+async def verify_otp(email: Recipient = Form(...), otp: str = Form(...)):
     """Verify OTP for admin login"""
     
     # Check if it's admin email
@@ -803,23 +1952,18 @@ async def verify_otp(email: EmailStr = Form(...), otp: str = Form(...)):
     if email != ADMIN_EMAIL:
         raise HTTPException(status_code=403, detail="Unauthorized")
     
-    if email not in OTP_STORE:
-        raise HTTPException(status_code=400, detail="No OTP requested")
+    # Checks expiry and consumes the OTP atomically on success
+    outcome = await asyncio.to_thread(otp_store.verify, email, otp)
     
-    stored_otp, expiry = OTP_STORE[email]
+    if outcome == OTP_MISSING:
+        raise HTTPException(status_code=400, detail="No OTP requested")
     
-    # Check if OTP expired
-    if time.time() > expiry:
-        del OTP_STORE[email]
+    if outcome == OTP_EXPIRED:
         raise HTTPException(status_code=400, detail="OTP expired")
     
-    # Verify OTP
-    if otp != stored_otp:
+    if outcome == OTP_INVALID:
         raise HTTPException(status_code=400, detail="Invalid OTP")
     
-    # OTP is valid, clean up
-    del OTP_STORE[email]
-    
     return OTPResponse(
         message="OTP verified successfully", 
         token="admin-session-token"
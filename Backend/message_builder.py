@@ -0,0 +1,202 @@
+import threading
+import uuid
+from collections import OrderedDict
+from email import quoprimime
+from email.header import Header
+from email.utils import formatdate, make_msgid
+from typing import List, Optional, Tuple, Union
+
+CRLF = b"\r\n"
+
+# RFC 5322 hard limit on line length, excluding CRLF
+MAX_LINE_LENGTH = 998
+
+# Line width for quoted-printable pieces encoded on their own: one short of
+# RFC 2045's 76, leaving room for the soft break that joins two pieces
+QP_PIECE_WIDTH = 75
+
+
+def qp_encode(content: str, width: int = 76) -> bytes:
+    """UTF-8 quoted-printable encoding of ``content``, with CRLF line endings"""
+    return quoprimime.body_encode(content.encode("utf-8").decode("latin-1"), width, eol="\r\n").encode("ascii")
+
+
+def qp_join(pieces: List[bytes]) -> bytes:
+    """Run together quoted-printable pieces each encoded at QP_PIECE_WIDTH.
+
+    A soft line break between pieces decodes to nothing, so static text can
+    be encoded once and only the variable pieces per message.
+    """
+    return (b"=" + CRLF).join(piece for piece in pieces if piece)
+
+
+def qp_part(subtype: str, body: bytes) -> bytes:
+    """A text/* part (headers and body) around an already quoted-printable body"""
+    headers = f'Content-Type: text/{subtype}; charset="utf-8"\r\nContent-Transfer-Encoding: quoted-printable\r\n'
+    return headers.encode("ascii") + CRLF + body
+
+
+def _encode_part(content: str, subtype: str) -> bytes:
+    """Encode one text/* part (headers and body) as wire-ready bytes.
+
+    ASCII content with short lines goes out as 7bit; anything else as
+    UTF-8 quoted-printable, which keeps mostly-ASCII HTML close to its
+    original size (base64 would add a third).
+    """
+    lines = content.splitlines()
+    if content.isascii() and all(len(line) <= MAX_LINE_LENGTH for line in lines):
+        headers = f'Content-Type: text/{subtype}; charset="us-ascii"\r\nContent-Transfer-Encoding: 7bit\r\n'
+        return headers.encode("ascii") + CRLF + "\r\n".join(lines).encode("ascii")
+    return qp_part(subtype, qp_encode(content))
+
+
+def encode_body(text: str, html: Optional[str], html_part: Optional[bytes] = None) -> Tuple[bytes, bytes]:
+    """(Content-Type header line, body bytes) of a message's text and optional HTML parts.
+
+    ``html_part`` is the HTML already encoded as a MIME part, e.g. by
+    ``CompiledTemplate.render_mime``; ``html`` is then not needed.
+    """
+    text_part = _encode_part(text, "plain")
+    if html is None and html_part is None:
+        # Single part: the part's own headers become the message's
+        headers, _, body = text_part.partition(CRLF + CRLF)
+        return headers + CRLF, body
+    html_part = html_part or _encode_part(html, "html")
+    boundary = f"===============_{uuid.uuid4().hex}=="
+    delimiter = f"--{boundary}".encode("ascii")
+    # multipart/alternative lists the plainest part first and the
+    # preferred one last, so HTML-capable clients show the HTML
+    body = CRLF.join([
+        delimiter, text_part, delimiter, html_part, delimiter + b"--", b"",
+    ])
+    content_type = f'Content-Type: multipart/alternative; boundary="{boundary}"\r\n'.encode("ascii")
+    return content_type, body
+
+
+def encode_header(name: str, value: str) -> bytes:
+    """Fold and, for non-ASCII values, RFC 2047-encode a header line"""
+    # A header value must never carry its own line breaks
+    value = " ".join(value.splitlines())
+    charset = "us-ascii" if value.isascii() else "utf-8"
+    encoded = Header(value, charset, header_name=name).encode(linesep="\r\n")
+    return f"{name}: {encoded}".encode("ascii") + CRLF
+
+
+class BodyCache:
+    """LRU cache of encoded message bodies keyed by their text and HTML.
+
+    A notification sent to many recipients has the same ~9 KB HTML body for
+    each of them; encoding it once and reusing the bytes leaves only the
+    headers to build per message.
+    """
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max(1, max_entries)
+        self._entries: "OrderedDict[Tuple[str, Optional[str]], Tuple[bytes, bytes]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def get(self, text: str, html: Optional[str]) -> Tuple[bytes, bytes]:
+        """Return (Content-Type header line, body bytes) for this pair of parts"""
+        key = (text, html)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self._stats["hits"] += 1
+                return entry
+            self._stats["misses"] += 1
+
+        entry = encode_body(text, html)
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+        return entry
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return {
+                **self._stats,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hit_ratio": round(self._stats["hits"] / lookups, 4) if lookups else 0.0,
+            }
+
+
+class MessageBuilder:
+    """Assembles wire-format messages from cached bodies plus per-message headers"""
+
+    def __init__(self, sender: str, cache: Optional[BodyCache] = None):
+        self.sender = sender
+        self.cache = cache or BodyCache()
+
+    def build(
+        self,
+        to: List[str],
+        subject: str,
+        text: str,
+        html: Optional[str] = None,
+        cc: Optional[List[str]] = None,
+        sender: Optional[str] = None,
+        encoded: Optional[Tuple[bytes, bytes]] = None,
+    ) -> bytes:
+        """Serialise a message; Bcc recipients belong in the envelope only.
+
+        ``sender`` overrides the From address, e.g. for the account of the
+        relay the message goes out through. ``encoded`` is the body already
+        encoded by ``encode_body``, e.g. in the render pool.
+        """
+        content_type, body = encoded or self.cache.get(text, html)
+        return self._headers(to, subject, cc, sender) + content_type + CRLF + body
+
+    def build_parts(
+        self,
+        to: List[str],
+        subject: str,
+        text: str,
+        html: Optional[str],
+        cc: Optional[List[str]],
+        attachments: List[Tuple[bytes, memoryview]],
+        sender: Optional[str] = None,
+        encoded: Optional[Tuple[bytes, bytes]] = None,
+    ) -> List[Union[bytes, memoryview]]:
+        """Serialise a multipart/mixed message with attachments, as a list of buffers.
+
+        Each attachment is (part headers, base64 body already wrapped in
+        CRLF lines); the bodies are passed through untouched so a large
+        file is never copied into the message.
+        """
+        content_type, body = encoded or self.cache.get(text, html)
+        boundary = f"===============_{uuid.uuid4().hex}=="
+        delimiter = f"--{boundary}\r\n".encode("ascii")
+        parts: List[Union[bytes, memoryview]] = [b"".join([
+            self._headers(to, subject, cc, sender),
+            f'Content-Type: multipart/mixed; boundary="{boundary}"\r\n'.encode("ascii"),
+            CRLF,
+            delimiter, content_type, CRLF, body, CRLF,
+        ])]
+        for headers, encoded in attachments:
+            parts.append(delimiter + headers)
+            parts.append(encoded)
+        parts.append(f"--{boundary}--\r\n".encode("ascii"))
+        return parts
+
+    def _headers(self, to: List[str], subject: str, cc: Optional[List[str]], sender: Optional[str]) -> bytes:
+        sender = sender or self.sender
+        msgid_domain = sender.rpartition("@")[2] or "localhost"
+        headers = [
+            b"From: " + sender.encode("ascii") + CRLF,
+            # Bcc fan-out batches have no visible recipients
+            b"To: " + (", ".join(to) or "undisclosed-recipients:;").encode("utf-8") + CRLF,
+        ]
+        if cc:
+            headers.append(b"Cc: " + ", ".join(cc).encode("utf-8") + CRLF)
+        headers.append(encode_header("Subject", subject))
+        headers.append(f"Date: {formatdate(localtime=True)}\r\n".encode("ascii"))
+        headers.append(f"Message-ID: {make_msgid(domain=msgid_domain)}\r\n".encode("ascii"))
+        headers.append(b"MIME-Version: 1.0\r\n")
+        return b"".join(headers)
@@ -0,0 +1,189 @@
+import asyncio
+import heapq
+import sqlite3
+import threading
+import time
+import logging
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# verify() outcomes
+OTP_OK = "ok"
+OTP_MISSING = "missing"
+OTP_EXPIRED = "expired"
+OTP_INVALID = "invalid"
+
+
+class OTPStore:
+    """Interface for OTP storage with expiry"""
+
+    def put(self, key: str, otp: str, ttl: float):
+        raise NotImplementedError
+
+    def verify(self, key: str, otp: str) -> str:
+        """Check an OTP and consume it on success; returns one of the OTP_* outcomes"""
+        raise NotImplementedError
+
+    def sweep(self) -> int:
+        """Delete expired entries and return how many were removed"""
+        raise NotImplementedError
+
+    def __len__(self) -> int:
+        raise NotImplementedError
+
+
+class MemoryOTPStore(OTPStore):
+    """Per-process store: a dict plus a min-heap of expiry times.
+
+    The heap is the expiry index, so a sweep only touches entries that have
+    actually expired. Heap entries left behind by a re-issued OTP are
+    recognised by their stale expiry and skipped.
+    """
+
+    def __init__(self):
+        self._entries: Dict[str, Tuple[str, float]] = {}
+        self._expiry: List[Tuple[float, str]] = []
+        self._lock = threading.Lock()
+
+    def put(self, key: str, otp: str, ttl: float):
+        expiry = time.time() + ttl
+        with self._lock:
+            self._entries[key] = (otp, expiry)
+            heapq.heappush(self._expiry, (expiry, key))
+
+    def verify(self, key: str, otp: str) -> str:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return OTP_MISSING
+            stored_otp, expiry = entry
+            if time.time() > expiry:
+                del self._entries[key]
+                return OTP_EXPIRED
+            if otp != stored_otp:
+                return OTP_INVALID
+            del self._entries[key]
+            return OTP_OK
+
+    def sweep(self) -> int:
+        now = time.time()
+        removed = 0
+        with self._lock:
+            while self._expiry and self._expiry[0][0] <= now:
+                expiry, key = heapq.heappop(self._expiry)
+                entry = self._entries.get(key)
+                if entry is not None and entry[1] == expiry:
+                    del self._entries[key]
+                    removed += 1
+        return removed
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+
+class SQLiteOTPStore(OTPStore):
+    """Store shared by every uvicorn worker on the host through one SQLite file.
+
+    An index on ``expires_at`` keeps sweeps cheap, and verification runs in a
+    write transaction so an OTP can only be consumed once even when two
+    workers receive the same request.
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS otps (
+        key TEXT PRIMARY KEY,
+        otp TEXT NOT NULL,
+        expires_at REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_otps_expiry ON otps (expires_at);
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._conn().executescript(self.SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, isolation_level=None, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def put(self, key: str, otp: str, ttl: float):
+        self._conn().execute(
+            "INSERT OR REPLACE INTO otps (key, otp, expires_at) VALUES (?, ?, ?)",
+            (key, otp, time.time() + ttl),
+        )
+
+    def verify(self, key: str, otp: str) -> str:
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT otp, expires_at FROM otps WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                outcome = OTP_MISSING
+            elif time.time() > row[1]:
+                conn.execute("DELETE FROM otps WHERE key = ?", (key,))
+                outcome = OTP_EXPIRED
+            elif otp != row[0]:
+                outcome = OTP_INVALID
+            else:
+                conn.execute("DELETE FROM otps WHERE key = ?", (key,))
+                outcome = OTP_OK
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        return outcome
+
+    def sweep(self) -> int:
+        return self._conn().execute(
+            "DELETE FROM otps WHERE expires_at <= ?", (time.time(),)
+        ).rowcount
+
+    def __len__(self) -> int:
+        return self._conn().execute("SELECT COUNT(*) FROM otps").fetchone()[0]
+
+
+def create_otp_store(backend: str, path: Optional[str] = None) -> OTPStore:
+    """Build the configured OTP store ("memory" or "sqlite")"""
+    backend = backend.lower()
+    if backend == "memory":
+        return MemoryOTPStore()
+    if backend == "sqlite":
+        return SQLiteOTPStore(path or "otp_store.db")
+    raise ValueError(f"Unknown OTP store backend: {backend}")
+
+
+class OTPSweeper:
+    """Background task that purges expired OTPs on a fixed interval"""
+
+    def __init__(self, store: OTPStore, interval: float = 60.0):
+        self.store = store
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run(), name="otp-sweeper")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                removed = await asyncio.to_thread(self.store.sweep)
+            except Exception as e:
+                logger.error(f"OTP sweep failed: {str(e)}")
+                continue
+            if removed:
+                logger.info(f"Swept {removed} expired OTPs")
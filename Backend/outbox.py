@@ -0,0 +1,774 @@
+import asyncio
+import heapq
+import json
+import sqlite3
+import threading
+import time
+import uuid
+import logging
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    status TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    available_at REAL NOT NULL,
+    sent_at REAL,
+    parent_id TEXT,
+    lane TEXT NOT NULL DEFAULT 'default',
+    priority INTEGER NOT NULL DEFAULT 1,
+    result TEXT,
+    group_key TEXT,
+    batch_id TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_due ON jobs (status, available_at);
+"""
+
+# Columns added after the first release, applied to existing outbox files
+MIGRATIONS = {
+    "parent_id": "ALTER TABLE jobs ADD COLUMN parent_id TEXT",
+    "lane": "ALTER TABLE jobs ADD COLUMN lane TEXT NOT NULL DEFAULT 'default'",
+    "priority": "ALTER TABLE jobs ADD COLUMN priority INTEGER NOT NULL DEFAULT 1",
+    "result": "ALTER TABLE jobs ADD COLUMN result TEXT",
+    "group_key": "ALTER TABLE jobs ADD COLUMN group_key TEXT",
+    "batch_id": "ALTER TABLE jobs ADD COLUMN batch_id TEXT",
+}
+
+INDEXES = """
+CREATE INDEX IF NOT EXISTS idx_jobs_parent ON jobs (parent_id, status);
+CREATE INDEX IF NOT EXISTS idx_jobs_claim ON jobs (status, priority, available_at);
+CREATE INDEX IF NOT EXISTS idx_jobs_group ON jobs (group_key, status);
+CREATE INDEX IF NOT EXISTS idx_jobs_batch ON jobs (batch_id);
+"""
+
+JOB_COLUMNS = (
+    "id, kind, status, payload, attempts, error, created_at, updated_at,"
+    " available_at, sent_at, parent_id, lane, priority, result"
+)
+
+# Parent rows group the messages of one bulk request and are never claimed
+BATCH_STATUS = "batch"
+
+# Children of a group job: held until the group is delivered, never claimed
+BUFFERED_STATUS = "buffered"
+
+# Jobs due in the future wait here, outside the queue, until the Scheduler
+# releases them; a large scheduled send then neither inflates queue depth
+# nor lands on the workers all at once
+SCHEDULED_STATUS = "scheduled"
+
+# Jobs whose attachment is still to be produced (e.g. a certificate to
+# render). A renderer claims them under a lease by pushing available_at
+# forward, and queues them once their payload is complete; after a crash
+# the lease runs out and they are claimed again.
+RENDER_STATUS = "rendering"
+
+# Tries a worker gives a write (mark_sent, defer, ...) before leaving the
+# job to its lease
+WRITE_ATTEMPTS = 3
+
+
+@dataclass
+class Job:
+    id: str
+    kind: str
+    status: str
+    payload: dict
+    attempts: int
+    error: Optional[str]
+    created_at: float
+    updated_at: float
+    available_at: float
+    sent_at: Optional[float]
+    parent_id: Optional[str] = None
+    lane: str = "default"
+    priority: int = 1
+    # Delivery details returned by the handler, e.g. recipients the relay refused
+    result: Optional[dict] = None
+
+    @classmethod
+    def from_row(cls, row) -> "Job":
+        return cls(
+            id=row[0],
+            kind=row[1],
+            status=row[2],
+            payload=json.loads(row[3]),
+            attempts=row[4],
+            error=row[5],
+            created_at=row[6],
+            updated_at=row[7],
+            available_at=row[8],
+            sent_at=row[9],
+            parent_id=row[10],
+            lane=row[11],
+            priority=row[12],
+            result=json.loads(row[13]) if row[13] else None,
+        )
+
+
+class Outbox:
+    """Durable SQLite (WAL) queue of composed messages waiting for delivery.
+
+    Every uvicorn worker process can open the same file: claiming a job is a
+    single UPDATE ... RETURNING statement, so two workers never deliver the
+    same message. Jobs left in ``sending`` by a crashed process are handed
+    back to the queue once their lease expires. Writes may wait up to the
+    busy timeout for another process's lock, so async code calls them
+    through ``asyncio.to_thread``; reads never wait under WAL.
+    """
+
+    def __init__(self, path: str, lease_seconds: float = 300.0):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self._local = threading.local()
+        conn = self._conn()
+        conn.executescript(SCHEMA)
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(jobs)")}
+        for column, ddl in MIGRATIONS.items():
+            if column not in columns:
+                conn.execute(ddl)
+        conn.executescript(INDEXES)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, isolation_level=None, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def enqueue(
+        self,
+        kind: str,
+        payload: dict,
+        available_at: Optional[float] = None,
+        lane: str = "default",
+        priority: int = 1,
+    ) -> str:
+        """Persist a composed message and return its job id.
+
+        A future ``available_at`` schedules the message instead of queueing it.
+        """
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        self._conn().execute(
+            "INSERT INTO jobs (id, kind, status, payload, created_at, updated_at, available_at, lane, priority)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (job_id, kind, _initial_status(available_at, now), json.dumps(payload), now, now,
+             available_at or now, lane, priority),
+        )
+        return job_id
+
+    def create_batch(self, kind: str) -> str:
+        """Create a parent job that groups the messages of one bulk request"""
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        self._conn().execute(
+            "INSERT INTO jobs (id, kind, status, payload, created_at, updated_at, available_at)"
+            " VALUES (?, ?, ?, '{}', ?, ?, ?)",
+            (job_id, kind, BATCH_STATUS, now, now, now),
+        )
+        return job_id
+
+    def enqueue_many(
+        self,
+        kind: str,
+        payloads: List[dict],
+        parent_id: Optional[str] = None,
+        available_at: Optional[float] = None,
+        lane: str = "default",
+        priority: int = 1,
+        status: Optional[str] = None,
+    ) -> List[str]:
+        """Persist several composed messages in a single transaction"""
+        now = time.time()
+        status = status or _initial_status(available_at, now)
+        rows = [
+            (uuid.uuid4().hex, kind, status, json.dumps(payload), now, now, available_at or now, parent_id, lane, priority)
+            for payload in payloads
+        ]
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(
+                "INSERT INTO jobs (id, kind, status, payload, created_at, updated_at, available_at, parent_id, lane, priority)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        return [row[0] for row in rows]
+
+    def buffer_many(
+        self,
+        group_kind: str,
+        kind: str,
+        items: List[Tuple[str, dict, dict, float]],
+        lane: str = "default",
+        priority: int = 1,
+        batch_id: Optional[str] = None,
+    ) -> List[str]:
+        """Add buffered children to open group jobs, opening groups as needed.
+
+        Each item is (group key, group payload, child payload, due time).
+        Children with the same key join the scheduled group job for that key;
+        a group opened by an item falls due at that item's due time, and once
+        it has been released to the queue later children start the next one.
+        ``batch_id`` ties the children to the bulk request they came from.
+        Returns the group job id for each item.
+        """
+        now = time.time()
+        group_ids: List[str] = []
+        opened: Dict[str, str] = {}
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for group_key, group_payload, payload, due in items:
+                group_id = opened.get(group_key)
+                if group_id is None:
+                    row = conn.execute(
+                        "SELECT id FROM jobs WHERE group_key = ? AND status = ? LIMIT 1", (group_key, SCHEDULED_STATUS)
+                    ).fetchone()
+                    if row is None:
+                        group_id = uuid.uuid4().hex
+                        conn.execute(
+                            "INSERT INTO jobs (id, kind, status, payload, created_at, updated_at, available_at, lane, priority, group_key)"
+                            " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                            (group_id, group_kind, SCHEDULED_STATUS, json.dumps(group_payload), now, now,
+                             due, lane, priority, group_key),
+                        )
+                    else:
+                        group_id = row[0]
+                    opened[group_key] = group_id
+                conn.execute(
+                    "INSERT INTO jobs (id, kind, status, payload, created_at, updated_at, available_at, parent_id, batch_id)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (uuid.uuid4().hex, kind, BUFFERED_STATUS, json.dumps(payload), now, now, now, group_id, batch_id),
+                )
+                group_ids.append(group_id)
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        return group_ids
+
+    def settle_children(self, parent_id: str, status: str) -> int:
+        """Mark a delivered group's buffered children with ``status``"""
+        return self._conn().execute(
+            "UPDATE jobs SET status = ?, updated_at = ? WHERE parent_id = ? AND status = ?",
+            (status, time.time(), parent_id, BUFFERED_STATUS),
+        ).rowcount
+
+    def group_stats(self, group_kind: str) -> Dict[str, dict]:
+        """Group jobs of one kind and the children they hold, per group status"""
+        stats = {}
+        for status, groups, children in self._conn().execute(
+            "SELECT g.status, COUNT(DISTINCT g.id), COUNT(c.id) FROM jobs g"
+            " LEFT JOIN jobs c ON c.parent_id = g.id WHERE g.kind = ? GROUP BY g.status",
+            (group_kind,),
+        ):
+            stats[status] = {"groups": groups, "children": children}
+        return stats
+
+    def batch_counts(self, parent_id: str) -> dict:
+        """Per-status message counts for a bulk request.
+
+        Records the request buffered into group jobs count with the status
+        of the group carrying them.
+        """
+        counts = {RENDER_STATUS: 0, SCHEDULED_STATUS: 0, "queued": 0, "sending": 0, "sent": 0, "failed": 0}
+        conn = self._conn()
+        for status, count in conn.execute(
+            "SELECT status, COUNT(*) FROM jobs WHERE parent_id = ? GROUP BY status", (parent_id,)
+        ):
+            counts[status] = count
+        for status, count in conn.execute(
+            "SELECT g.status, COUNT(*) FROM jobs c JOIN jobs g ON g.id = c.parent_id"
+            " WHERE c.batch_id = ? GROUP BY g.status",
+            (parent_id,),
+        ):
+            counts[status] = counts.get(status, 0) + count
+        counts["total"] = sum(counts.values())
+        return counts
+
+    def batch_jobs(self, parent_id: str) -> List[Job]:
+        """Every message of a bulk request, in the order it was queued"""
+        rows = self._conn().execute(
+            f"SELECT {JOB_COLUMNS} FROM jobs WHERE parent_id = ? ORDER BY created_at, rowid", (parent_id,)
+        ).fetchall()
+        return [Job.from_row(row) for row in rows]
+
+    def claim(self, max_priority: Optional[int] = None) -> Optional[Job]:
+        """Atomically take the most urgent due job and mark it as sending.
+
+        Jobs are taken in priority order, oldest first within a priority.
+        ``max_priority`` restricts a worker to the more urgent lanes.
+        """
+        now = time.time()
+        if max_priority is None:
+            max_priority = 1 << 30
+        row = self._conn().execute(
+            f"""
+            UPDATE jobs SET status = 'sending', attempts = attempts + 1, updated_at = ?
+            WHERE id = (
+                SELECT id FROM jobs
+                WHERE status = 'queued' AND priority <= ? AND available_at <= ?
+                ORDER BY priority, available_at
+                LIMIT 1
+            )
+            RETURNING {JOB_COLUMNS}
+            """,
+            (now, max_priority, now),
+        ).fetchone()
+        return Job.from_row(row) if row else None
+
+    def claim_render(
+        self, kind: str, limit: int, lease: Optional[float] = None, max_attempts: Optional[int] = None
+    ) -> List[Job]:
+        """Take up to ``limit`` jobs waiting to be rendered, oldest first, under a lease.
+
+        Due jobs already claimed ``max_attempts`` times are failed instead,
+        so one that keeps crashing its renderer cannot be retried forever.
+        """
+        now = time.time()
+        if max_attempts is not None:
+            cur = self._conn().execute(
+                "UPDATE jobs SET status = 'failed', error = ?, updated_at = ?"
+                " WHERE status = ? AND kind = ? AND available_at <= ? AND attempts >= ?",
+                (f"Rendering did not complete after {max_attempts} attempt(s)", now, RENDER_STATUS, kind, now, max_attempts),
+            )
+            if cur.rowcount:
+                logger.error(f"Failed {cur.rowcount} {kind} jobs that could not be rendered")
+        rows = self._conn().execute(
+            f"""
+            UPDATE jobs SET available_at = ?, attempts = attempts + 1, updated_at = ?
+            WHERE id IN (
+                SELECT id FROM jobs
+                WHERE status = ? AND kind = ? AND available_at <= ?
+                ORDER BY created_at, rowid
+                LIMIT ?
+            )
+            RETURNING {JOB_COLUMNS}
+            """,
+            (now + (lease or self.lease_seconds), now, RENDER_STATUS, kind, now, limit),
+        ).fetchall()
+        return sorted((Job.from_row(row) for row in rows), key=lambda job: job.created_at)
+
+    def release_render(self, job_ids: List[str]):
+        """End the lease on claimed jobs so they can be rendered again straight away"""
+        now = time.time()
+        self._conn().executemany(
+            "UPDATE jobs SET available_at = ?, updated_at = ? WHERE id = ? AND status = ?",
+            [(now, now, job_id, RENDER_STATUS) for job_id in job_ids],
+        )
+
+    def mark_rendered(self, items: List[tuple]):
+        """Queue rendered jobs with their completed payloads, in one transaction"""
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(
+                "UPDATE jobs SET status = 'queued', payload = ?, available_at = ?, updated_at = ?,"
+                " attempts = 0 WHERE id = ? AND status = ?",
+                [(json.dumps(payload), now, now, job_id, RENDER_STATUS) for job_id, payload in items],
+            )
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def render_depth(self) -> int:
+        """Number of jobs still waiting to be rendered"""
+        return self._conn().execute(
+            "SELECT COUNT(*) FROM jobs WHERE status = ?", (RENDER_STATUS,)
+        ).fetchone()[0]
+
+    def mark_sent(self, job_id: str, result: Optional[dict] = None):
+        now = time.time()
+        self._conn().execute(
+            "UPDATE jobs SET status = 'sent', error = NULL, updated_at = ?, sent_at = ?, result = ? WHERE id = ?",
+            (now, now, json.dumps(result) if result else None, job_id),
+        )
+
+    def mark_failed(self, job_id: str, error: str):
+        self._conn().execute(
+            "UPDATE jobs SET status = 'failed', error = ?, updated_at = ? WHERE id = ?",
+            (error, time.time(), job_id),
+        )
+
+    def defer(self, job_id: str, available_at: float, error: str, count_attempt: bool = True):
+        """Put a job back in the queue to be retried at ``available_at``"""
+        self._conn().execute(
+            "UPDATE jobs SET status = 'queued', error = ?, available_at = ?, updated_at = ?,"
+            " attempts = attempts - ? WHERE id = ?",
+            (error, available_at, time.time(), 0 if count_attempt else 1, job_id),
+        )
+
+    def next_due(self) -> Optional[float]:
+        """Earliest available_at among queued jobs"""
+        return self._conn().execute(
+            "SELECT MIN(available_at) FROM jobs WHERE status = 'queued'"
+        ).fetchone()[0]
+
+    def release_due(self, limit: int) -> int:
+        """Move up to ``limit`` scheduled jobs that have fallen due into the queue"""
+        now = time.time()
+        return self._conn().execute(
+            "UPDATE jobs SET status = 'queued', updated_at = ? WHERE id IN ("
+            " SELECT id FROM jobs WHERE status = ? AND available_at <= ? ORDER BY available_at LIMIT ?)",
+            (now, SCHEDULED_STATUS, now, limit),
+        ).rowcount
+
+    def next_scheduled(self) -> Optional[float]:
+        """Earliest available_at among scheduled jobs"""
+        return self._conn().execute(
+            "SELECT MIN(available_at) FROM jobs WHERE status = ?", (SCHEDULED_STATUS,)
+        ).fetchone()[0]
+
+    def scheduled_depth(self) -> int:
+        return self._conn().execute(
+            "SELECT COUNT(*) FROM jobs WHERE status = ?", (SCHEDULED_STATUS,)
+        ).fetchone()[0]
+
+    def release(self, job_id: str):
+        """Hand an unfinished job back to the queue, e.g. on shutdown"""
+        self._conn().execute(
+            "UPDATE jobs SET status = 'queued', updated_at = ? WHERE id = ? AND status = 'sending'",
+            (time.time(), job_id),
+        )
+
+    def requeue_stale(self) -> int:
+        """Return jobs whose sender died mid-delivery to the queue"""
+        cutoff = time.time() - self.lease_seconds
+        cur = self._conn().execute(
+            "UPDATE jobs SET status = 'queued', updated_at = ? WHERE status = 'sending' AND updated_at < ?",
+            (time.time(), cutoff),
+        )
+        if cur.rowcount:
+            logger.warning(f"Requeued {cur.rowcount} stale outbox jobs")
+        return cur.rowcount
+
+    def get(self, job_id: str) -> Optional[Job]:
+        row = self._conn().execute(
+            f"SELECT {JOB_COLUMNS} FROM jobs WHERE id = ?", (job_id,)
+        ).fetchone()
+        return Job.from_row(row) if row else None
+
+    def depth(self) -> int:
+        """Number of jobs queued or being sent"""
+        return self._conn().execute(
+            "SELECT COUNT(*) FROM jobs WHERE status IN ('queued', 'sending')"
+        ).fetchone()[0]
+
+    def depth_by_lane(self) -> dict:
+        """Queued and in-flight job counts per lane"""
+        depths = {}
+        for lane, status, count in self._conn().execute(
+            "SELECT lane, status, COUNT(*) FROM jobs"
+            " WHERE status IN ('queued', 'sending') GROUP BY lane, status"
+        ):
+            depths.setdefault(lane, {"queued": 0, "sending": 0})[status] = count
+        return depths
+
+
+def _initial_status(available_at: Optional[float], now: float) -> str:
+    return SCHEDULED_STATUS if available_at is not None and available_at > now else "queued"
+
+
+class Scheduler:
+    """Releases scheduled jobs into the queue as they fall due.
+
+    The schedule itself is the outbox's (status, available_at) index, so
+    adding a job is one B-tree insert, finding the next due time one index
+    seek, and hundreds of thousands of pending messages survive a restart
+    with nothing held in memory. Due jobs are moved to the queue at most
+    ``batch_size`` per ``interval`` and only while fewer than
+    ``max_queued`` jobs are already waiting, so a large send scheduled for
+    9:00 trickles in behind the rate limiter instead of flooding the queue
+    ahead of transactional mail. ``on_release`` wakes the workers.
+    """
+
+    def __init__(
+        self,
+        outbox: Outbox,
+        on_release: Callable[[], None],
+        batch_size: int = 500,
+        interval: float = 1.0,
+        max_queued: int = 5000,
+        max_sleep: float = 60.0,
+    ):
+        self.outbox = outbox
+        self.on_release = on_release
+        self.batch_size = max(1, batch_size)
+        self.interval = interval
+        self.max_queued = max_queued
+        self.max_sleep = max_sleep
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._sleeping_until = 0.0
+        self._released = 0
+
+    def start(self):
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run(), name="outbox-scheduler")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def schedule(self, due: float):
+        """Note a newly scheduled job so the scheduler wakes in time for it"""
+        if self._wakeup is not None and due < self._sleeping_until:
+            self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            released = 0
+            next_due = None
+            try:
+                released, next_due = await asyncio.to_thread(self._release)
+            except sqlite3.Error as e:
+                logger.error(f"Releasing scheduled jobs failed: {str(e)}")
+            if released:
+                self._released += released
+                self.on_release()
+
+            now = time.time()
+            if next_due is None:
+                delay = self.max_sleep
+            elif next_due <= now:
+                # Backlog of due jobs (or a full queue): next batch after the interval
+                delay = self.interval
+            else:
+                delay = min(self.max_sleep, next_due - now)
+            self._sleeping_until = now + delay
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+    def _release(self) -> Tuple[int, Optional[float]]:
+        room = self.max_queued - self.outbox.depth()
+        released = self.outbox.release_due(min(room, self.batch_size)) if room > 0 else 0
+        return released, self.outbox.next_scheduled()
+
+    def stats(self) -> dict:
+        return {"released": self._released, "next_wakeup_in": round(max(0.0, self._sleeping_until - time.time()), 1)}
+
+
+class DueTimer:
+    """Heap of future wake-up times driving a single event-loop timer.
+
+    Deferred jobs only need the workers woken when they fall due. Instead of
+    a sleeping task per job, due times go into a heap and one TimerHandle is
+    kept armed for the earliest of them; times that are already covered by
+    an earlier wake-up collapse into it.
+    """
+
+    def __init__(self, callback: Callable[[], None], resolution: float = 0.05):
+        self.callback = callback
+        self.resolution = resolution
+        self._heap: List[float] = []
+        self._handle: Optional[asyncio.TimerHandle] = None
+        self._armed_for: Optional[float] = None
+
+    def schedule(self, due: float):
+        heapq.heappush(self._heap, due)
+        if self._armed_for is None or due < self._armed_for - self.resolution:
+            self._arm()
+
+    def _arm(self):
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+            self._armed_for = None
+        if not self._heap:
+            return
+        due = self._heap[0]
+        loop = asyncio.get_running_loop()
+        self._armed_for = due
+        self._handle = loop.call_later(max(0.0, due - time.time()), self._fire)
+
+    def _fire(self):
+        self._handle = None
+        self._armed_for = None
+        now = time.time() + self.resolution
+        while self._heap and self._heap[0] <= now:
+            heapq.heappop(self._heap)
+        self.callback()
+        self._arm()
+
+    def pending(self) -> int:
+        return len(self._heap)
+
+    def cancel(self):
+        if self._handle is not None:
+            self._handle.cancel()
+        self._handle = None
+        self._armed_for = None
+        self._heap.clear()
+
+
+class OutboxWorkers:
+    """Background asyncio tasks that drain the outbox through ``handler``.
+
+    Whatever the handler returns is stored as the job's ``result``.
+
+    ``concurrency`` workers take any job in priority order. ``reserved`` maps
+    a priority to a number of extra workers that only ever take jobs at that
+    priority or more urgent, so transactional mail always has capacity even
+    while a bulk send keeps the shared workers busy.
+
+    Outbox calls run in worker threads: SQLite may wait up to its busy
+    timeout for another process's write lock, and that must not stall the
+    event loop.
+
+    Failed jobs are handed to ``retry_policy``: temporary failures go back
+    in the queue with a later ``available_at`` and a DueTimer wakes the
+    workers when they fall due, permanent ones are marked failed. ``gate``
+    is called with a worker's priority limit and returns how many seconds
+    that worker should hold off claiming (for example while every relay's
+    circuit breaker is open, or the bulk sending budget is spent).
+    """
+
+    def __init__(
+        self,
+        outbox: Outbox,
+        handler: Callable[[Job], Awaitable[Optional[dict]]],
+        concurrency: int = 4,
+        poll_interval: float = 1.0,
+        reserved: Optional[Dict[int, int]] = None,
+        retry_policy=None,
+        gate: Optional[Callable[[Optional[int]], float]] = None,
+    ):
+        self.outbox = outbox
+        self.handler = handler
+        self.concurrency = max(1, concurrency)
+        self.poll_interval = poll_interval
+        self.reserved = reserved or {}
+        self.retry_policy = retry_policy
+        self.gate = gate
+        self._timer: Optional[DueTimer] = None
+        self._tasks: List[asyncio.Task] = []
+        self._wakeups: List[asyncio.Event] = []
+        self._stopping = False
+
+    def start(self):
+        self.outbox.requeue_stale()
+        self._stopping = False
+        self._timer = DueTimer(self.notify)
+        next_due = self.outbox.next_due()
+        if next_due is not None:
+            self._timer.schedule(next_due)
+        limits = [None] * self.concurrency
+        for priority, count in sorted(self.reserved.items()):
+            limits.extend([priority] * count)
+        for i, max_priority in enumerate(limits):
+            wakeup = asyncio.Event()
+            self._wakeups.append(wakeup)
+            self._tasks.append(asyncio.create_task(
+                self._run(wakeup, max_priority), name=f"outbox-worker-{i}"
+            ))
+
+    async def stop(self):
+        self._stopping = True
+        self.notify()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+        self._wakeups.clear()
+        if self._timer is not None:
+            self._timer.cancel()
+
+    def schedule_wakeup(self, due: float):
+        """Wake the workers at ``due``, e.g. for a deferred or scheduled job"""
+        if self._timer is not None:
+            self._timer.schedule(due)
+
+    def notify(self):
+        """Wake idle workers after an enqueue instead of waiting for the next poll"""
+        for wakeup in self._wakeups:
+            wakeup.set()
+
+    async def _run(self, wakeup: asyncio.Event, max_priority: Optional[int]):
+        last_recovery = time.monotonic()
+        while not self._stopping:
+            wakeup.clear()
+            hold_off = self.gate(max_priority) if self.gate else 0.0
+            if hold_off > 0:
+                try:
+                    await asyncio.wait_for(wakeup.wait(), min(hold_off, self.poll_interval * 5))
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            try:
+                job = await asyncio.to_thread(self.outbox.claim, max_priority)
+            except sqlite3.Error as e:
+                logger.error(f"Outbox claim failed: {str(e)}")
+                job = None
+
+            if job is None:
+                if time.monotonic() - last_recovery > self.outbox.lease_seconds:
+                    if await self._write("Requeueing stale jobs", self.outbox.requeue_stale):
+                        last_recovery = time.monotonic()
+                try:
+                    await asyncio.wait_for(wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            try:
+                result = await self.handler(job)
+            except asyncio.CancelledError:
+                # Cancelled on shutdown: finish the release before the loop goes
+                self.outbox.release(job.id)
+                raise
+            except Exception as e:
+                await self._handle_failure(job, e)
+            else:
+                await self._write(f"Marking job {job.id} sent", self.outbox.mark_sent, job.id, result)
+
+    async def _write(self, action: str, func: Callable, *args) -> bool:
+        """Run an outbox write, retrying with backoff while SQLite is locked or failing.
+
+        A worker must outlive a busy database: if the write still fails the
+        job keeps its ``sending`` lease and is requeued once that expires.
+        """
+        for attempt in range(1, WRITE_ATTEMPTS + 1):
+            try:
+                await asyncio.to_thread(func, *args)
+                return True
+            except sqlite3.Error as e:
+                logger.error(f"{action} failed (attempt {attempt}/{WRITE_ATTEMPTS}): {str(e)}")
+                await asyncio.sleep(self.poll_interval * attempt)
+        return False
+
+    async def _handle_failure(self, job: Job, exc: Exception):
+        delay = self.retry_policy.next_delay(job.attempts, exc) if self.retry_policy else None
+        if delay is None:
+            logger.error(f"Failed to deliver job {job.id} after {job.attempts} attempt(s): {str(exc)}")
+            await self._write(f"Marking job {job.id} failed", self.outbox.mark_failed, job.id, str(exc))
+            return
+        due = time.time() + delay
+        count_attempt = getattr(exc, "counts_as_attempt", True)
+        if count_attempt:
+            logger.warning(f"Job {job.id} failed temporarily, retrying in {delay:.1f}s: {str(exc)}")
+        if await self._write(f"Deferring job {job.id}", self.outbox.defer, job.id, due, str(exc), count_attempt):
+            self.schedule_wakeup(due)
@@ -0,0 +1,353 @@
+import sqlite3
+import threading
+import time
+import logging
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+from retry import SendDeferred, is_throttle, smtp_replies
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimitedError(SendDeferred):
+    """Raised instead of sending while a relay or sender is out of budget"""
+
+    def __init__(self, scope: str, retry_after: float):
+        super().__init__(f"Sending rate limit reached for {scope}; retrying in {retry_after:.1f}s", retry_after)
+        self.scope = scope
+
+
+class TokenBucket:
+    """Classic token bucket: ``capacity`` tokens, refilled at ``rate`` per second.
+
+    Not thread-safe on its own; RateController serialises access so a send
+    can take tokens from several buckets atomically.
+    """
+
+    def __init__(self, name: str, rate: float, capacity: float):
+        self.name = name
+        self.configured_rate = rate
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self._updated = time.monotonic()
+
+    def restore(self, tokens: float, now: float):
+        """Replace the balance with one counted elsewhere, as of ``now``"""
+        self.tokens = min(self.capacity, tokens)
+        self._updated = now
+
+    def refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_for(self, amount: float) -> float:
+        """Seconds until ``amount`` tokens are available (after refill)"""
+        if self.tokens >= amount:
+            return 0.0
+        if self.rate <= 0:
+            return float("inf")
+        return (amount - self.tokens) / self.rate
+
+
+class QuotaLedger:
+    """Daily bucket balances shared by every uvicorn worker through one SQLite file.
+
+    Each row holds a scope's remaining daily tokens and the wall-clock time
+    they were counted at, so a restart picks up the spent budget instead of
+    refilling it, and workers charge sends inside a write transaction so
+    two of them cannot spend the same tokens.
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS daily_quota (
+        scope TEXT PRIMARY KEY,
+        tokens REAL NOT NULL,
+        updated_at REAL NOT NULL
+    );
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._conn().executescript(self.SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, isolation_level=None, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def begin(self, write: bool = True) -> sqlite3.Connection:
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE" if write else "BEGIN")
+        return conn
+
+    def load(self, conn: sqlite3.Connection, scopes: List[str]) -> Dict[str, Tuple[float, float]]:
+        """Stored (tokens, updated_at) per scope; scopes never charged are absent"""
+        placeholders = ", ".join("?" * len(scopes))
+        rows = conn.execute(
+            f"SELECT scope, tokens, updated_at FROM daily_quota WHERE scope IN ({placeholders})", scopes
+        ).fetchall()
+        return {scope: (tokens, updated_at) for scope, tokens, updated_at in rows}
+
+    def commit(self, conn: sqlite3.Connection, balances: Dict[str, Tuple[float, float]]):
+        conn.executemany(
+            "INSERT OR REPLACE INTO daily_quota (scope, tokens, updated_at) VALUES (?, ?, ?)",
+            [(scope, tokens, updated_at) for scope, (tokens, updated_at) in balances.items()],
+        )
+        conn.execute("COMMIT")
+
+    def rollback(self, conn: sqlite3.Connection):
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+
+
+def create_quota_ledger(backend: str, path: Optional[str] = None) -> Optional[QuotaLedger]:
+    """Build the configured daily quota store: "sqlite", or "memory" for none"""
+    backend = backend.lower()
+    if backend == "memory":
+        return None
+    if backend == "sqlite":
+        return QuotaLedger(path or "rate_limits.db")
+    raise ValueError(f"Unknown rate limit store backend: {backend}")
+
+
+class RateController:
+    """Paces SMTP sends to the relay's limits with per-relay and per-sender buckets.
+
+    Each scope ("relay:<host>" or "sender:<address>") has a short-term
+    bucket (per minute, with a burst allowance) and optionally a daily
+    bucket. A send costs one token per envelope recipient, which is how
+    Gmail counts against its quotas, and is only let through if every
+    bucket it touches can pay.
+
+    Throttle replies (421, 454, quota 4xx/5xx) halve the short-term rate of
+    the scopes involved and pause them; each success afterwards adds back a
+    slice of the configured rate (AIMD), so bulk sends settle at the highest
+    rate the relay will actually accept. ``headroom`` is the fraction of
+    every bucket kept back for the transactional lane, so pacing a bulk
+    send never delays an OTP.
+
+    With a ``ledger`` the daily buckets are counted in SQLite, shared by
+    every worker process and kept across restarts; the short-term buckets
+    and throttle state stay per-process. ``wait_time`` and ``sendable``
+    read this process's last view of the daily balance, which is never
+    lower than the shared one, so ``acquire`` has the final say.
+    """
+
+    def __init__(
+        self,
+        per_minute: float = 60,
+        burst: float = 20,
+        per_day: float = 0,
+        sender_per_minute: float = 0,
+        sender_per_day: float = 0,
+        headroom: float = 0.1,
+        throttle_pause: float = 60.0,
+        quota_pause: float = 3600.0,
+        min_rate_fraction: float = 0.1,
+        recovery_fraction: float = 0.02,
+        ledger: Optional[QuotaLedger] = None,
+    ):
+        self.per_minute = per_minute
+        self.burst = max(1.0, burst)
+        self.per_day = per_day
+        self.sender_per_minute = sender_per_minute
+        self.sender_per_day = sender_per_day
+        self.headroom = min(max(headroom, 0.0), 0.9)
+        self.throttle_pause = throttle_pause
+        self.quota_pause = quota_pause
+        self.min_rate_fraction = min_rate_fraction
+        self.recovery_fraction = recovery_fraction
+        self.ledger = ledger
+        self._buckets: Dict[str, List[TokenBucket]] = {}
+        self._paused_until: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._stats = {"granted": 0, "deferred": 0, "throttled": 0}
+
+    def _scope_buckets(self, scope: str) -> List[TokenBucket]:
+        buckets = self._buckets.get(scope)
+        if buckets is None:
+            is_sender = scope.startswith("sender:")
+            per_minute = self.sender_per_minute if is_sender else self.per_minute
+            per_day = self.sender_per_day if is_sender else self.per_day
+            buckets = self._buckets[scope] = self._make_buckets(per_minute, per_day)
+        return buckets
+
+    def _make_buckets(self, per_minute: float, per_day: float) -> List[TokenBucket]:
+        buckets = []
+        if per_minute > 0:
+            buckets.append(TokenBucket("minute", per_minute / 60, self.burst))
+        if per_day > 0:
+            buckets.append(TokenBucket("day", per_day / 86400, per_day))
+        return buckets
+
+    def set_limits(self, scope: str, per_minute: Optional[float] = None, per_day: Optional[float] = None):
+        """Give one scope its own limits instead of the defaults for its kind"""
+        is_sender = scope.startswith("sender:")
+        if per_minute is None:
+            per_minute = self.sender_per_minute if is_sender else self.per_minute
+        if per_day is None:
+            per_day = self.sender_per_day if is_sender else self.per_day
+        with self._lock:
+            self._buckets[scope] = self._make_buckets(float(per_minute), float(per_day))
+
+    @contextmanager
+    def _shared(self, scopes: List[str], write: bool = True):
+        """Load the daily buckets of ``scopes`` from the ledger, and save them afterwards if ``write``.
+
+        Called with ``_lock`` held. If the ledger cannot be reached the
+        per-process counts are used rather than holding up every send.
+        """
+        buckets = {
+            scope: bucket for scope in scopes for bucket in self._scope_buckets(scope) if bucket.name == "day"
+        }
+        if self.ledger is None or not buckets:
+            yield
+            return
+        try:
+            conn = self.ledger.begin(write)
+            stored = self.ledger.load(conn, list(buckets))
+        except sqlite3.Error as e:
+            logger.warning(f"Daily quota ledger unavailable, using this process's counts: {str(e)}")
+            yield
+            return
+        wall, now = time.time(), time.monotonic()
+        for scope, (tokens, updated_at) in stored.items():
+            bucket = buckets[scope]
+            bucket.restore(tokens + max(0.0, wall - updated_at) * bucket.rate, now)
+        try:
+            yield
+        except BaseException:
+            self.ledger.rollback(conn)
+            raise
+        try:
+            if write:
+                self.ledger.commit(conn, {scope: (bucket.tokens, wall) for scope, bucket in buckets.items()})
+            else:
+                self.ledger.rollback(conn)
+        except sqlite3.Error as e:
+            self.ledger.rollback(conn)
+            logger.warning(f"Could not save daily quota balances: {str(e)}")
+
+    def _wait_locked(self, scopes: List[str], cost: float, transactional: bool, now: float) -> Tuple[float, str]:
+        wait, limiting = 0.0, ""
+        for scope in scopes:
+            paused = self._paused_until.get(scope, 0.0) - now
+            if paused > wait:
+                wait, limiting = paused, scope
+            for bucket in self._scope_buckets(scope):
+                bucket.refill(now)
+                reserve = 0.0 if transactional else bucket.capacity * self.headroom
+                needed = bucket.wait_for(min(cost, bucket.capacity - reserve) + reserve)
+                if needed > wait:
+                    wait, limiting = needed, f"{scope} ({bucket.name})"
+        return wait, limiting
+
+    def wait_time(self, scopes: List[str], transactional: bool = False) -> float:
+        """Seconds until a one-recipient send could go out; used to gate workers"""
+        with self._lock:
+            return self._wait_locked(scopes, 1, transactional, time.monotonic())[0]
+
+    def sendable(self, scope: str, seconds: float) -> float:
+        """Recipients ``scope`` could send within ``seconds`` at its current rates; inf if unlimited"""
+        now = time.monotonic()
+        with self._lock:
+            seconds -= max(0.0, self._paused_until.get(scope, 0.0) - now)
+            if seconds < 0:
+                return 0.0
+            limit = float("inf")
+            for bucket in self._scope_buckets(scope):
+                bucket.refill(now)
+                limit = min(limit, max(bucket.tokens, 0.0) + bucket.rate * seconds)
+            return limit
+
+    def acquire(self, scopes: List[str], cost: int = 1, transactional: bool = False):
+        """Take ``cost`` tokens from every scope or raise RateLimitedError"""
+        with self._lock, self._shared(scopes):
+            now = time.monotonic()
+            wait, limiting = self._wait_locked(scopes, cost, transactional, now)
+            if wait > 0:
+                self._stats["deferred"] += 1
+            else:
+                for scope in scopes:
+                    for bucket in self._scope_buckets(scope):
+                        # A message with more recipients than the bucket holds
+                        # may drive it negative; later sends then wait it off
+                        bucket.tokens -= cost
+                self._stats["granted"] += 1
+                return
+        raise RateLimitedError(limiting, wait)
+
+    def refund(self, scopes: List[str], cost: int = 1):
+        """Give back tokens taken by ``acquire`` for a send that never went out"""
+        with self._lock, self._shared(scopes):
+            now = time.monotonic()
+            for scope in scopes:
+                for bucket in self._scope_buckets(scope):
+                    bucket.refill(now)
+                    bucket.tokens = min(bucket.capacity, bucket.tokens + cost)
+            self._stats["granted"] -= 1
+
+    def record_success(self, scopes: List[str]):
+        """Additive increase back towards the configured rate"""
+        with self._lock:
+            for scope in scopes:
+                for bucket in self._buckets.get(scope, ()):
+                    if bucket.rate < bucket.configured_rate:
+                        bucket.rate = min(
+                            bucket.configured_rate,
+                            bucket.rate + bucket.configured_rate * self.recovery_fraction,
+                        )
+
+    def record_failure(self, scopes: List[str], exc: BaseException) -> Optional[float]:
+        """Back off if ``exc`` is a throttle reply; returns the pause in seconds"""
+        if not is_throttle(exc):
+            return None
+        quota = any(code >= 500 for code, _ in smtp_replies(exc))
+        pause = self.quota_pause if quota else self.throttle_pause
+        with self._lock, self._shared(scopes if quota else []):
+            now = time.monotonic()
+            self._stats["throttled"] += 1
+            for scope in scopes:
+                # Sends already in flight when the first throttle arrived
+                # fail too; they belong to the same episode, so halve once
+                already_paused = self._paused_until.get(scope, 0.0) > now
+                self._paused_until[scope] = max(self._paused_until.get(scope, 0.0), now + pause)
+                for bucket in self._scope_buckets(scope):
+                    if bucket.name == "minute":
+                        if not already_paused:
+                            bucket.rate = max(bucket.configured_rate * self.min_rate_fraction, bucket.rate / 2)
+                    elif quota:
+                        # The relay knows better than our count: the day is spent
+                        bucket.tokens = min(bucket.tokens, 0.0)
+        logger.warning(f"Relay throttled sends for {', '.join(scopes)}; pausing {pause:.0f}s: {str(exc)}")
+        return pause
+
+    def budget(self) -> dict:
+        """Remaining tokens, current and configured rate, and pause per scope"""
+        report = {}
+        with self._lock, self._shared(list(self._buckets), write=False):
+            now = time.monotonic()
+            for scope, buckets in self._buckets.items():
+                for bucket in buckets:
+                    bucket.refill(now)
+                report[scope] = {
+                    "paused_for": round(max(0.0, self._paused_until.get(scope, 0.0) - now), 1),
+                    "buckets": {
+                        bucket.name: {
+                            "remaining": round(max(bucket.tokens, 0.0), 2),
+                            "capacity": bucket.capacity,
+                            "rate_per_minute": round(bucket.rate * 60, 3),
+                            "configured_per_minute": round(bucket.configured_rate * 60, 3),
+                        }
+                        for bucket in buckets
+                    },
+                }
+            return {"scopes": report, **self._stats}
+
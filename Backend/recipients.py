@@ -0,0 +1,116 @@
+import re
+import threading
+from collections import OrderedDict
+from typing import Annotated, Dict, List, Optional, Set
+
+from email_validator import SPECIAL_USE_DOMAIN_NAMES
+from pydantic import AfterValidator, WithJsonSchema
+from pydantic.networks import validate_email
+from pydantic_core import PydanticCustomError
+
+# Plain ASCII addresses: a dot-atom local part and a hostname whose last
+# label is letters only. Anything else (quoted local parts, IDNA, display
+# names, "xn--" labels) goes through email_validator.
+_ATEXT = r"[A-Za-z0-9!#$%&'*+/=?^_`{|}~-]+"
+_LABEL = r"[A-Za-z0-9](?:[A-Za-z0-9-]{0,61}[A-Za-z0-9])?"
+FAST_ADDRESS = re.compile(rf"({_ATEXT}(?:\.{_ATEXT})*)@((?:{_LABEL}\.)+[A-Za-z]{{2,63}})")
+
+_SPECIAL_USE = tuple(SPECIAL_USE_DOMAIN_NAMES)
+
+
+def _fast_normalize(address: str) -> Optional[str]:
+    """Normalised form of a plain address email_validator is certain to accept, else None"""
+    match = FAST_ADDRESS.fullmatch(address)
+    if match is None or len(address) > 254:
+        return None
+    local, domain = match.groups()
+    domain = domain.lower()
+    if len(local) > 64 or "--" in domain:
+        return None
+    if any(domain == name or domain.endswith("." + name) for name in _SPECIAL_USE):
+        return None
+    return f"{local}@{domain}"
+
+
+class RecipientValidator:
+    """Email address validation with a shared LRU cache of verdicts.
+
+    Addresses that match a strict ASCII pattern are accepted without
+    calling email_validator at all; the rest take the same path as
+    pydantic's EmailStr, and the verdict (normalised address, or the
+    rejection reason) is cached either way, so a roster that repeats the
+    same addresses across requests validates each of them once.
+    """
+
+    def __init__(self, max_entries: int = 100000):
+        self.max_entries = max(1, max_entries)
+        self._cache: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "fast_path": 0, "full": 0, "invalid": 0}
+
+    def validate(self, value: str) -> str:
+        """Normalised address, or PydanticCustomError exactly as EmailStr raises it"""
+        with self._lock:
+            verdict = self._cache.get(value)
+            if verdict is not None:
+                self._cache.move_to_end(value)
+                self._stats["hits"] += 1
+        if verdict is None:
+            normalized = _fast_normalize(value.strip())
+            if normalized is not None:
+                verdict = (normalized, None)
+                outcome = "fast_path"
+            else:
+                try:
+                    verdict = (validate_email(value)[1], None)
+                except PydanticCustomError as e:
+                    verdict = (None, e.context["reason"])
+                outcome = "full"
+            with self._lock:
+                self._stats[outcome] += 1
+                self._cache[value] = verdict
+                if len(self._cache) > self.max_entries:
+                    self._cache.popitem(last=False)
+        normalized, reason = verdict
+        if reason is not None:
+            with self._lock:
+                self._stats["invalid"] += 1
+            raise PydanticCustomError(
+                "value_error", "value is not a valid email address: {reason}", {"reason": reason}
+            )
+        return normalized
+
+    def annotated(self):
+        """A ``str`` type for pydantic models and FastAPI parameters validated through this cache"""
+        return Annotated[
+            str,
+            AfterValidator(self.validate),
+            WithJsonSchema({"type": "string", "format": "email"}),
+        ]
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {**self._stats, "entries": len(self._cache)}
+
+
+def dedupe_recipients(*lists: Optional[List[str]]) -> List[Optional[List[str]]]:
+    """Drop repeated addresses within and across to/cc/bcc, case-insensitively.
+
+    An address keeps its first, most visible position (To before Cc before
+    Bcc); lists that were None stay None.
+    """
+    seen: Set[str] = set()
+    result: List[Optional[List[str]]] = []
+    for addresses in lists:
+        if addresses is None:
+            result.append(None)
+            continue
+        kept = []
+        for address in addresses:
+            key = address.lower()
+            if key not in seen:
+                seen.add(key)
+                kept.append(address)
+        result.append(kept)
+    return result
+
@@ -0,0 +1,155 @@
+import codecs
+import csv
+import json
+from typing import AsyncIterable, AsyncIterator, Dict, List, Optional
+
+
+# Uploads are parsed as they stream in; these bound what one line, one
+# CSV record (quoted fields may span lines) or a whole JSON array body may
+# hold in memory, in characters and bytes respectively
+MAX_LINE_LENGTH = 1024 * 1024
+MAX_RECORD_LENGTH = 1024 * 1024
+MAX_JSON_BYTES = 16 * 1024 * 1024
+
+
+class RecordFormatError(ValueError):
+    """Raised when an uploaded roster cannot be parsed at all"""
+
+
+async def aiter_lines(chunks: AsyncIterable[bytes], max_length: int = MAX_LINE_LENGTH) -> AsyncIterator[str]:
+    """Decode a byte stream incrementally and yield it line by line"""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    pending: List[str] = []  # pieces of the current, unfinished line
+    pending_length = 0
+    line_no = 1
+    finished = False
+    async for chunk in chunks:
+        try:
+            text = decoder.decode(chunk)
+        except UnicodeDecodeError:
+            raise RecordFormatError(f"Upload is not valid UTF-8 text (near line {line_no})")
+        # Only the newly decoded text is split; the unfinished line is kept in pieces
+        *lines, tail = text.split("\n")
+        for line in lines:
+            if pending:
+                line = "".join(pending) + line
+                pending.clear()
+                pending_length = 0
+            if len(line) > max_length:
+                raise RecordFormatError(f"Line {line_no} is longer than {max_length} characters")
+            line_no += 1
+            yield line + "\n"
+        if tail:
+            pending.append(tail)
+            pending_length += len(tail)
+            if pending_length > max_length:
+                raise RecordFormatError(f"Line {line_no} is longer than {max_length} characters")
+    try:
+        pending.append(decoder.decode(b"", final=True))
+    except UnicodeDecodeError:
+        raise RecordFormatError(f"Upload is not valid UTF-8 text (near line {line_no})")
+    last = "".join(pending)
+    if last:
+        yield last
+
+
+async def aiter_csv_records(
+    lines: AsyncIterable[str], max_length: int = MAX_RECORD_LENGTH
+) -> AsyncIterator[Dict[str, str]]:
+    """Yield CSV rows as dicts keyed by the header row.
+
+    Quoted fields may span lines, so lines are buffered while a quote is
+    open (CSV escapes a quote by doubling it, which leaves the parity
+    unchanged) and only then handed to the csv module. A record longer
+    than ``max_length`` characters, typically a stray quote swallowing the
+    rest of the file, is rejected rather than buffered.
+    """
+    header: Optional[List[str]] = None
+    buffered: List[str] = []
+    buffered_length = 0
+    in_quotes = False
+    line_no = 0
+    async for line in lines:
+        line_no += 1
+        buffered.append(line)
+        buffered_length += len(line)
+        if line.count('"') % 2:
+            in_quotes = not in_quotes
+        if in_quotes:
+            if buffered_length > max_length:
+                raise RecordFormatError(
+                    f"CSV record ending on line {line_no} is longer than {max_length} characters; "
+                    "is a quote left open?"
+                )
+            continue
+        row = next(csv.reader(["".join(buffered)]), [])
+        buffered.clear()
+        buffered_length = 0
+        if not any(field.strip() for field in row):
+            continue
+        if header is None:
+            header = [field.strip() for field in row]
+            continue
+        yield dict(zip(header, (field.strip() for field in row)))
+    if in_quotes:
+        raise RecordFormatError("Unterminated quoted field at end of CSV")
+
+
+async def aiter_ndjson_records(lines: AsyncIterable[str]) -> AsyncIterator[dict]:
+    """Yield one JSON object per non-empty line"""
+    line_no = 0
+    async for line in lines:
+        line_no += 1
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError as e:
+            raise RecordFormatError(f"Invalid JSON on line {line_no}: {e.msg}")
+        if not isinstance(record, dict):
+            raise RecordFormatError(f"Line {line_no} is not a JSON object")
+        yield record
+
+
+async def aiter_json_records(
+    chunks: AsyncIterable[bytes], key: str = "records", max_bytes: int = MAX_JSON_BYTES
+) -> AsyncIterator[dict]:
+    """Yield objects from a JSON array body (or an object wrapping one under ``key``).
+
+    Unlike CSV and NDJSON, a JSON body is not streamed: it is read whole
+    (up to ``max_bytes``) and parsed at once.
+    """
+    parts: List[bytes] = []
+    size = 0
+    async for chunk in chunks:
+        size += len(chunk)
+        if size > max_bytes:
+            raise RecordFormatError(
+                f"JSON body exceeds {max_bytes} bytes; send large rosters as CSV or NDJSON"
+            )
+        parts.append(chunk)
+    body = b"".join(parts)
+    try:
+        data = json.loads(body or b"[]")
+    except json.JSONDecodeError as e:
+        raise RecordFormatError(f"Invalid JSON body: {e.msg}")
+    if isinstance(data, dict):
+        data = data.get(key)
+    if not isinstance(data, list):
+        raise RecordFormatError(f"Expected a JSON array or an object with a '{key}' array")
+    for record in data:
+        if not isinstance(record, dict):
+            raise RecordFormatError("Every array element must be a JSON object")
+        yield record
+
+
+def aiter_records(content_type: str, chunks: AsyncIterable[bytes]) -> AsyncIterator[dict]:
+    """Pick a parser for the request body based on its Content-Type"""
+    media_type = (content_type or "").split(";")[0].strip().lower()
+    if media_type in ("text/csv", "application/csv"):
+        return aiter_csv_records(aiter_lines(chunks))
+    if media_type in ("application/x-ndjson", "application/ndjson", "application/jsonl"):
+        return aiter_ndjson_records(aiter_lines(chunks))
+    if media_type in ("application/json", ""):
+        return aiter_json_records(chunks)
+    raise RecordFormatError(f"Unsupported content type: {media_type}")
@@ -0,0 +1,219 @@
+import json
+import threading
+import logging
+from typing import Dict, Iterable, List, Optional
+
+from smtp_pool import SMTPConnectionPool
+from retry import CircuitBreaker, SendDeferred, is_relay_failure
+from rate_limit import RateController, RateLimitedError
+
+logger = logging.getLogger(__name__)
+
+
+class NoRelayAvailable(SendDeferred):
+    """Raised when every relay is broken, paused or out of budget"""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"No SMTP relay available; retrying in {retry_after:.1f}s", retry_after)
+
+
+class Relay:
+    """One SMTP account on one server, with its own pool and health state"""
+
+    def __init__(self, name: str, pool: SMTPConnectionPool, breaker: CircuitBreaker, sender: str, weight: float = 1.0):
+        self.name = name
+        self.pool = pool
+        self.breaker = breaker
+        self.sender = sender
+        self.weight = max(weight, 0.001)
+        self.outstanding = 0
+        self.sent = 0
+        self.failed = 0
+        # Rate-controller scopes: the relay itself and the account sending through it
+        self.scopes = [f"relay:{name}", f"sender:{sender}"]
+
+    @property
+    def configured(self) -> bool:
+        return bool(self.pool.username and self.pool.password)
+
+
+class RelayDispatcher:
+    """Spreads sends over several relays by weighted least-outstanding-requests.
+
+    A relay is skipped while its circuit breaker is open or while the rate
+    controller has no budget left for it (paused after a throttle reply, or
+    its daily quota spent), so failing and exhausted relays drop out on their
+    own and rejoin once they recover. Among the rest, the one with the fewest
+    sends in flight relative to its weight wins; ties rotate so idle relays
+    share the load.
+    """
+
+    def __init__(self, relays: List[Relay], rate_controller: RateController):
+        if not relays:
+            raise ValueError("At least one SMTP relay must be configured")
+        self.relays = relays
+        self.rate_controller = rate_controller
+        self._lock = threading.Lock()
+        self._rotation = 0
+
+    @property
+    def configured(self) -> bool:
+        return all(relay.configured for relay in self.relays)
+
+    def _ranked(self, exclude: Iterable[str]) -> List[Relay]:
+        with self._lock:
+            self._rotation = (self._rotation + 1) % len(self.relays)
+            rotated = self.relays[self._rotation:] + self.relays[:self._rotation]
+            candidates = [relay for relay in rotated if relay.name not in exclude]
+            # Stable sort keeps the rotation order among equally loaded relays
+            return sorted(candidates, key=lambda relay: (relay.outstanding + 1) / relay.weight)
+
+    def acquire(self, cost: int = 1, transactional: bool = False, exclude: Iterable[str] = ()) -> Relay:
+        """Pick a relay for a send of ``cost`` recipients and charge its budget"""
+        wait = None
+        for relay in self._ranked(exclude):
+            hold_off = relay.breaker.retry_after()
+            if hold_off > 0:
+                wait = hold_off if wait is None else min(wait, hold_off)
+                continue
+            try:
+                self.rate_controller.acquire(relay.scopes, cost, transactional)
+            except RateLimitedError as e:
+                wait = e.retry_after if wait is None else min(wait, e.retry_after)
+                continue
+            try:
+                relay.breaker.before_send()
+            except SendDeferred as e:
+                # Lost the half-open probe slot to another send; nothing
+                # goes out, so the budget it was charged goes back
+                self.rate_controller.refund(relay.scopes, cost)
+                wait = e.retry_after if wait is None else min(wait, e.retry_after)
+                continue
+            with self._lock:
+                relay.outstanding += 1
+            return relay
+        raise NoRelayAvailable(wait if wait is not None else 1.0)
+
+    def release(self, relay: Relay, exc: Optional[BaseException] = None) -> Optional[float]:
+        """Record a send's outcome; returns the pause if the relay throttled us"""
+        with self._lock:
+            relay.outstanding -= 1
+            if exc is None:
+                relay.sent += 1
+            else:
+                relay.failed += 1
+        if exc is None:
+            relay.breaker.record_success()
+            self.rate_controller.record_success(relay.scopes)
+            return None
+        pause = self.rate_controller.record_failure(relay.scopes, exc)
+        if pause is not None:
+            # Up but over its limits: the rate controller benches it instead
+            relay.breaker.record_unrelated()
+        elif is_relay_failure(exc):
+            relay.breaker.record_failure()
+        else:
+            relay.breaker.record_unrelated()
+        return pause
+
+    def retry_after(self, transactional: bool = False) -> float:
+        """Seconds until at least one relay could take a send"""
+        return min(
+            max(relay.breaker.retry_after(), self.rate_controller.wait_time(relay.scopes, transactional))
+            for relay in self.relays
+        )
+
+    def sendable(self, seconds: float) -> float:
+        """Recipients all relays could send within ``seconds``, each sender capped by its own limit"""
+        per_sender: Dict[str, float] = {}
+        for relay in self.relays:
+            sender_scope = relay.scopes[1]
+            per_sender[sender_scope] = per_sender.get(sender_scope, 0.0) + self.rate_controller.sendable(relay.scopes[0], seconds)
+        return sum(min(total, self.rate_controller.sendable(scope, seconds)) for scope, total in per_sender.items())
+
+    def send_time(self, recipients: int, horizon: float = 30 * 86400) -> Optional[float]:
+        """Seconds the rate limits need to let ``recipients`` out, or None beyond ``horizon``"""
+        if self.sendable(0) >= recipients:
+            return 0.0
+        if self.sendable(horizon) < recipients:
+            return None
+        low, high = 0.0, horizon
+        while high - low > 0.5:
+            middle = (low + high) / 2
+            if self.sendable(middle) >= recipients:
+                high = middle
+            else:
+                low = middle
+        return high
+
+    def close(self):
+        for relay in self.relays:
+            relay.pool.close()
+
+    def stats(self) -> Dict[str, dict]:
+        return {
+            relay.name: {
+                "host": relay.pool.host,
+                "port": relay.pool.port,
+                "sender": relay.sender,
+                "weight": relay.weight,
+                "outstanding": relay.outstanding,
+                "sent": relay.sent,
+                "failed": relay.failed,
+                "pool": relay.pool.stats(),
+                "circuit_breaker": relay.breaker.stats(),
+            }
+            for relay in self.relays
+        }
+
+
+def load_relays(
+    raw: Optional[str],
+    default: dict,
+    pool_defaults: dict,
+    breaker_defaults: dict,
+    rate_controller: RateController,
+) -> List[Relay]:
+    """Build relays from the SMTP_RELAYS JSON list, or the single default relay.
+
+    Each entry takes ``host``, ``port``, ``username``, ``password`` and
+    optionally ``name``, ``sender`` (From address, defaults to the username),
+    ``weight``, ``max_connections``, ``reserved``, ``use_tls``,
+    ``per_minute`` and ``per_day``; anything left out falls back to the
+    single-relay settings.
+    """
+    entries = json.loads(raw) if raw else [default]
+    if not isinstance(entries, list) or not entries:
+        raise ValueError("SMTP_RELAYS must be a non-empty JSON list")
+
+    relays = []
+    for entry in entries:
+        entry = {**default, **entry}
+        name = entry.get("name") or f"{entry['host']}:{entry['port']}"
+        pool = SMTPConnectionPool(
+            entry["host"],
+            int(entry["port"]),
+            entry.get("username"),
+            entry.get("password"),
+            max_size=int(entry.get("max_connections", pool_defaults["max_size"])),
+            idle_timeout=pool_defaults["idle_timeout"],
+            probe_interval=pool_defaults["probe_interval"],
+            acquire_timeout=pool_defaults["acquire_timeout"],
+            timeout=pool_defaults["timeout"],
+            reserved=int(entry.get("reserved", pool_defaults["reserved"])),
+            use_tls=bool(entry.get("use_tls", pool_defaults["use_tls"])),
+        )
+        breaker = CircuitBreaker(
+            name,
+            failure_threshold=breaker_defaults["breaker_threshold"],
+            reset_timeout=breaker_defaults["breaker_reset"],
+        )
+        relay = Relay(name, pool, breaker, entry.get("sender") or entry.get("username") or "", float(entry.get("weight", 1)))
+        if "per_minute" in entry or "per_day" in entry:
+            rate_controller.set_limits(relay.scopes[0], entry.get("per_minute"), entry.get("per_day"))
+        relays.append(relay)
+
+    names = [relay.name for relay in relays]
+    if len(set(names)) != len(names):
+        raise ValueError("SMTP relay names must be unique")
+    return relays
@@ -0,0 +1,218 @@
+import errno
+import random
+import re
+import smtplib
+import socket
+import ssl
+import threading
+import time
+from typing import Optional
+
+from smtp_pool import PoolTimeout, reply_code
+
+# Reply codes that mean the relay itself is unavailable or refusing this
+# account, as opposed to a problem with one message or recipient
+RELAY_FAILURE_CODES = {421, 454, 530, 534, 535}
+
+# Replies that mean "you are sending too fast / too much": 421 and 454 always,
+# other 4xx/5xx codes only when the text says so (Gmail answers an exhausted
+# daily quota with "550 5.4.5 Daily user sending quota exceeded")
+THROTTLE_CODES = {421, 454}
+THROTTLE_TEXT = re.compile(rb"quota|rate limit|too many|sending limit|5\.4\.5|4\.7\.28|5\.7\.28", re.I)
+
+
+# OSErrors from connect() that mean the relay cannot be reached at all
+UNREACHABLE_ERRNOS = {errno.ENETUNREACH, errno.ENETDOWN, errno.EHOSTUNREACH, errno.EHOSTDOWN}
+
+
+def is_connection_failure(exc: BaseException) -> bool:
+    """True for SMTP, socket and TLS errors talking to the relay.
+
+    Other OSErrors (a missing attachment file, a full disk) are about the
+    message or this host, not the relay.
+    """
+    if isinstance(exc, (smtplib.SMTPException, PoolTimeout, ConnectionError, TimeoutError, socket.gaierror, ssl.SSLError)):
+        return True
+    return isinstance(exc, OSError) and exc.errno in UNREACHABLE_ERRNOS
+
+
+def smtp_replies(exc: BaseException) -> list:
+    """(code, text) for every reply carried by a send failure"""
+    if isinstance(exc, smtplib.SMTPRecipientsRefused):
+        return list(exc.recipients.values())
+    if isinstance(exc, smtplib.SMTPResponseException):
+        return [(exc.smtp_code, exc.smtp_error)]
+    return []
+
+
+def is_throttle(exc: BaseException) -> bool:
+    """True if the relay refused a send because of a rate or quota limit"""
+    for code, text in smtp_replies(exc):
+        if code in THROTTLE_CODES:
+            return True
+        if code >= 400 and THROTTLE_TEXT.search(text if isinstance(text, bytes) else str(text).encode()):
+            return True
+    return False
+
+
+def is_temporary(exc: BaseException) -> bool:
+    """True if a send failure is worth retrying later.
+
+    4xx replies (greylisting, rate limits, mailbox busy) and connection-level
+    failures are temporary; 5xx replies are permanent. When every recipient
+    was refused, the message is only retried if all refusals were 4xx.
+    """
+    if isinstance(exc, SendDeferred):
+        return True
+    if isinstance(exc, smtplib.SMTPRecipientsRefused):
+        codes = [code for code, _ in exc.recipients.values()]
+        return bool(codes) and all(400 <= code < 500 for code in codes)
+    code = reply_code(exc)
+    if code is not None:
+        return 400 <= code < 500
+    return is_connection_failure(exc)
+
+
+def is_relay_failure(exc: BaseException) -> bool:
+    """True if a failure says the relay is down rather than one message being bad"""
+    if isinstance(exc, (smtplib.SMTPRecipientsRefused, SendDeferred)):
+        return False
+    code = reply_code(exc)
+    if code is not None:
+        return code in RELAY_FAILURE_CODES
+    return is_connection_failure(exc)
+
+
+class RetryPolicy:
+    """Jittered exponential backoff for temporary send failures"""
+
+    def __init__(self, max_attempts: int = 6, base_delay: float = 30.0, max_delay: float = 3600.0):
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def next_delay(self, attempts: int, exc: BaseException) -> Optional[float]:
+        """Seconds to wait before the next attempt, or None to give up"""
+        if isinstance(exc, SendDeferred):
+            return exc.retry_after
+        if not is_temporary(exc) or attempts >= self.max_attempts:
+            return None
+        ceiling = min(self.max_delay, self.base_delay * (2 ** (attempts - 1)))
+        return random.uniform(self.base_delay / 2, max(ceiling, self.base_delay / 2))
+
+
+class SendDeferred(Exception):
+    """A send was held back on our side and should simply run again later"""
+
+    # The job never reached the relay, so it should not use up a retry
+    counts_as_attempt = False
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CircuitOpenError(SendDeferred):
+    """Raised instead of sending while a relay's circuit breaker is open"""
+
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"Circuit open for relay {name}; retrying in {retry_after:.1f}s", retry_after)
+
+
+class CircuitBreaker:
+    """Per-relay breaker: closed -> open after repeated failures -> half-open probe.
+
+    While open, sends are refused immediately so the outbox sheds load instead
+    of piling connection attempts onto a dead relay. After ``reset_timeout``
+    one probe send is let through; success closes the circuit, failure
+    re-opens it for another timeout.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.name = name
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+        self._stats = {"opened": 0, "rejected": 0, "probes": 0}
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self) -> str:
+        if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+            self._state = self.HALF_OPEN
+            self._probe_in_flight = False
+        return self._state
+
+    def retry_after(self) -> float:
+        """Seconds until the breaker will next let a request through"""
+        with self._lock:
+            state = self._current_state()
+            if state == self.CLOSED:
+                return 0.0
+            if state == self.HALF_OPEN:
+                return 0.0 if not self._probe_in_flight else 1.0
+            return max(0.0, self.reset_timeout - (time.monotonic() - self._opened_at))
+
+    def before_send(self):
+        """Raise CircuitOpenError unless this send may go to the relay"""
+        with self._lock:
+            state = self._current_state()
+            if state == self.CLOSED:
+                return
+            if state == self.HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                self._stats["probes"] += 1
+                return
+            self._stats["rejected"] += 1
+            wait = (
+                1.0 if state == self.HALF_OPEN
+                else max(0.0, self.reset_timeout - (time.monotonic() - self._opened_at))
+            )
+        raise CircuitOpenError(self.name, wait)
+
+    def record_success(self):
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            state = self._current_state()
+            self._failures += 1
+            # Sends already in flight when it opened fail too; they must not
+            # push the reset further out
+            if state != self.OPEN and (state == self.HALF_OPEN or self._failures >= self.failure_threshold):
+                self._stats["opened"] += 1
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+                self._probe_in_flight = False
+
+    def record_unrelated(self):
+        """A send finished with a non-relay error; free the half-open probe slot"""
+        with self._lock:
+            if self._state == self.HALF_OPEN:
+                # The relay answered, which is good enough evidence it is back
+                self._state = self.CLOSED
+                self._failures = 0
+            self._probe_in_flight = False
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "name": self.name,
+                "state": self._current_state(),
+                "consecutive_failures": self._failures,
+                **self._stats,
+            }
@@ -0,0 +1,368 @@
+import re
+import smtplib
+import threading
+import time
+import logging
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, List, Optional, Union
+
+from metrics import PHASE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+class PoolTimeout(Exception):
+    """Raised when no SMTP connection became available in time"""
+
+
+def reply_code(exc: BaseException) -> Optional[int]:
+    """SMTP reply code carried by a send failure, if the relay sent one"""
+    if isinstance(exc, smtplib.SMTPResponseException):
+        return exc.smtp_code
+    if isinstance(exc, smtplib.SMTPRecipientsRefused) and exc.recipients:
+        return min(code for code, _ in exc.recipients.values())
+    return None
+
+
+def sendmail_parts(
+    server: smtplib.SMTP,
+    from_addr: str,
+    to_addrs: List[str],
+    parts: List[Union[bytes, memoryview]],
+    on_data: Optional[Callable[[], None]] = None,
+):
+    """smtplib's sendmail, but writing the message from a list of buffers.
+
+    Every part must start on a line boundary and the last must end with
+    CRLF. ``bytes`` parts are dot-stuffed like smtplib does; memoryview
+    parts (memory-mapped base64 attachments, which never contain a '.')
+    go to the socket as they are, without being copied into one message.
+    ``on_data`` is called just before the DATA command goes out.
+    """
+    server.ehlo_or_helo_if_needed()
+    code, resp = server.mail(from_addr)
+    if code != 250:
+        if code == 421:
+            server.close()
+        else:
+            server._rset()
+        raise smtplib.SMTPSenderRefused(code, resp, from_addr)
+    refused = {}
+    for addr in to_addrs:
+        code, resp = server.rcpt(addr)
+        if code not in (250, 251):
+            refused[addr] = (code, resp)
+        if code == 421:
+            server.close()
+            raise smtplib.SMTPRecipientsRefused(refused)
+    if len(refused) == len(to_addrs):
+        server._rset()
+        raise smtplib.SMTPRecipientsRefused(refused)
+    if on_data is not None:
+        on_data()
+    server.putcmd("data")
+    code, resp = server.getreply()
+    if code != 354:
+        server._rset()
+        raise smtplib.SMTPDataError(code, resp)
+    for part in parts:
+        server.send(part if isinstance(part, memoryview) else re.sub(rb"(?m)^\.", b"..", part))
+    server.send(b".\r\n")
+    code, resp = server.getreply()
+    if code != 250:
+        if code == 421:
+            server.close()
+        else:
+            server._rset()
+        raise smtplib.SMTPDataError(code, resp)
+    return refused
+
+
+class _PooledConnection:
+    """An authenticated SMTP session plus the bookkeeping the pool needs"""
+
+    def __init__(self, smtp: smtplib.SMTP):
+        self.smtp = smtp
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+        self.shared = True
+
+    def close(self):
+        try:
+            self.smtp.quit()
+        except Exception:
+            try:
+                self.smtp.close()
+            except Exception:
+                pass
+
+
+class SMTPConnectionPool:
+    """Bounded pool of keep-alive SMTP connections shared by every send path.
+
+    Connections are handed out LIFO so the most recently used (and therefore
+    most likely still alive) session is reused first. Sessions idle longer
+    than ``idle_timeout`` are evicted, sessions idle longer than
+    ``probe_interval`` are checked with NOOP before reuse, and a send that
+    fails because the relay dropped the connection is retried once on a
+    fresh session.
+
+    ``reserved`` connections can only be checked out with ``reserved=True``,
+    which keeps headroom for urgent mail while bulk sends hold the rest.
+    """
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        username: Optional[str],
+        password: Optional[str],
+        max_size: int = 4,
+        idle_timeout: float = 60.0,
+        probe_interval: float = 10.0,
+        acquire_timeout: float = 30.0,
+        timeout: float = 30.0,
+        reserved: int = 0,
+        use_tls: bool = True,
+    ):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.max_size = max(1, max_size)
+        self.reserved = min(max(0, reserved), self.max_size - 1)
+        self.idle_timeout = idle_timeout
+        self.probe_interval = probe_interval
+        self.acquire_timeout = acquire_timeout
+        self.timeout = timeout
+        self.use_tls = use_tls
+
+        self._idle = deque()
+        self._size = 0  # live connections, idle + checked out
+        self._shared_in_use = 0  # checked out without reserved=True
+        self._lock = threading.Lock()
+        self._available = threading.Condition(self._lock)
+        self._closed = False
+
+        self._stats = {
+            "hits": 0,
+            "misses": 0,
+            "reconnects": 0,
+            "evictions": 0,
+            "probes": 0,
+            "probe_failures": 0,
+            "waits": 0,
+        }
+
+    # Connection lifecycle
+
+    def _connect(self) -> _PooledConnection:
+        """Open, secure and authenticate a new SMTP session"""
+        with PHASE_SECONDS.time("smtp_connect"):
+            server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            if self.use_tls:
+                with PHASE_SECONDS.time("smtp_tls"):
+                    server.starttls()
+            if self.username and self.password:
+                with PHASE_SECONDS.time("smtp_auth"):
+                    server.login(self.username, self.password)
+        except Exception:
+            server.close()
+            raise
+        return _PooledConnection(server)
+
+    def _is_alive(self, conn: _PooledConnection) -> bool:
+        """NOOP health probe for a connection that has been idle a while"""
+        with self._lock:
+            self._stats["probes"] += 1
+        try:
+            code, _ = conn.smtp.noop()
+            if code == 250:
+                return True
+        except Exception:
+            pass
+        with self._lock:
+            self._stats["probe_failures"] += 1
+        return False
+
+    def _evict_expired_locked(self, now: float) -> list:
+        """Pop idle connections past idle_timeout; caller closes them unlocked"""
+        expired = []
+        # The oldest idle connections sit at the left end of the deque
+        while self._idle and now - self._idle[0].last_used > self.idle_timeout:
+            expired.append(self._idle.popleft())
+            self._size -= 1
+            self._stats["evictions"] += 1
+        return expired
+
+    def acquire(self, reserved: bool = False) -> _PooledConnection:
+        """Check out a healthy connection, reusing an idle one when possible"""
+        deadline = time.monotonic() + self.acquire_timeout
+        while True:
+            reuse = None
+            expired = []
+            with self._lock:
+                if self._closed:
+                    raise RuntimeError("SMTP connection pool is closed")
+                now = time.monotonic()
+                expired = self._evict_expired_locked(now)
+                # Reserved checkouts may use any slot; shared ones are capped
+                # so that the reserved slots stay free for urgent mail
+                allowed = reserved or self._shared_in_use < self.max_size - self.reserved
+                if allowed and self._idle:
+                    reuse = self._idle.pop()
+                elif allowed and self._size < self.max_size:
+                    self._size += 1
+                    self._stats["misses"] += 1
+                else:
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        raise PoolTimeout(
+                            f"No SMTP connection available after {self.acquire_timeout}s"
+                        )
+                    self._stats["waits"] += 1
+                    self._available.wait(remaining)
+                    continue
+                if not reserved:
+                    self._shared_in_use += 1
+
+            for conn in expired:
+                conn.close()
+
+            if reuse is not None:
+                if time.monotonic() - reuse.last_used < self.probe_interval or self._is_alive(reuse):
+                    with self._lock:
+                        self._stats["hits"] += 1
+                    reuse.shared = not reserved
+                    return reuse
+                # Relay dropped the idle session; replace it in the same slot
+                reuse.close()
+                with self._lock:
+                    self._stats["reconnects"] += 1
+
+            try:
+                conn = self._connect()
+            except Exception:
+                self._discard_slot(shared=not reserved)
+                raise
+            conn.shared = not reserved
+            return conn
+
+    def release(self, conn: _PooledConnection, discard: bool = False):
+        """Return a connection to the pool, or drop it if it is broken"""
+        if discard or self._closed:
+            conn.close()
+            self._discard_slot(conn.shared)
+            return
+        conn.last_used = time.monotonic()
+        with self._lock:
+            if conn.shared:
+                self._shared_in_use -= 1
+            self._idle.append(conn)
+            # Wake everyone: a reserved waiter may be queued behind bulk ones
+            self._available.notify_all()
+
+    def _discard_slot(self, shared: bool):
+        with self._lock:
+            self._size -= 1
+            if shared:
+                self._shared_in_use -= 1
+            self._available.notify_all()
+
+    @contextmanager
+    def connection(self, reserved: bool = False):
+        """Context manager yielding a pooled ``smtplib.SMTP`` session"""
+        conn = self.acquire(reserved)
+        try:
+            yield conn.smtp
+        except (smtplib.SMTPResponseException, smtplib.SMTPRecipientsRefused):
+            # The relay answered, so the session is still usable; reset any
+            # half-finished transaction. (SMTPException subclasses OSError,
+            # so this clause has to come before the disconnect one.)
+            try:
+                conn.smtp.rset()
+                reusable = True
+            except Exception:
+                # smtplib closes the session itself after a 421; either way
+                # the relay's reply is the error worth reporting
+                reusable = False
+            self.release(conn, discard=not reusable)
+            raise
+        except (smtplib.SMTPServerDisconnected, OSError):
+            self.release(conn, discard=True)
+            raise
+        except BaseException:
+            self.release(conn, discard=True)
+            raise
+        else:
+            self.release(conn)
+
+    # Sending
+
+    def _send(self, send: Callable, reserved: bool):
+        """Run ``send(server, on_data)`` on a pooled session, reconnecting once if it died before DATA.
+
+        After DATA the relay may already have taken the message even though
+        the reply was lost, so a retry could deliver it twice; that failure
+        is left to the caller, whose own retry policy decides.
+        """
+        data_sent = []
+        try:
+            with self.connection(reserved) as server, PHASE_SECONDS.time("smtp_data"):
+                return send(server, lambda: data_sent.append(True))
+        except (smtplib.SMTPServerDisconnected, ConnectionError):
+            if data_sent:
+                raise
+            with self._lock:
+                self._stats["reconnects"] += 1
+            logger.warning("SMTP connection lost before the message was sent, retrying on a fresh connection")
+            with self.connection(reserved) as server, PHASE_SECONDS.time("smtp_data"):
+                return send(server, None)
+
+    def sendmail(self, from_addr: str, to_addrs, data: bytes, reserved: bool = False):
+        """Send an already serialised message with CRLF line endings"""
+        # Like smtplib, end the last line so the terminating dot stands alone
+        parts = [data] if data.endswith(b"\r\n") else [data, b"\r\n"]
+        return self.sendmail_parts(from_addr, to_addrs, parts, reserved)
+
+    def sendmail_parts(self, from_addr: str, to_addrs, parts: List[Union[bytes, memoryview]], reserved: bool = False):
+        """Send a message given as buffers (see ``sendmail_parts``)"""
+        return self._send(lambda server, on_data: sendmail_parts(server, from_addr, to_addrs, parts, on_data), reserved)
+
+    # Maintenance and introspection
+
+    def prune(self):
+        """Evict idle connections that have outlived idle_timeout"""
+        with self._lock:
+            expired = self._evict_expired_locked(time.monotonic())
+            if expired:
+                self._available.notify_all()
+        for conn in expired:
+            conn.close()
+
+    def close(self):
+        """Close every idle connection and refuse further checkouts"""
+        with self._lock:
+            self._closed = True
+            idle = list(self._idle)
+            self._idle.clear()
+            self._size -= len(idle)
+            self._available.notify_all()
+        for conn in idle:
+            conn.close()
+
+    def stats(self) -> dict:
+        with self._lock:
+            idle = len(self._idle)
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return {
+                **self._stats,
+                "size": self._size,
+                "idle": idle,
+                "in_use": self._size - idle,
+                "max_size": self.max_size,
+                "reserved": self.reserved,
+                "hit_ratio": round(self._stats["hits"] / lookups, 4) if lookups else 0.0,
+            }
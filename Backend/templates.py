@@ -0,0 +1,640 @@
+import html
+import time
+from datetime import datetime
+from string import Formatter
+from typing import Dict, List, Optional, Tuple
+
+from message_builder import QP_PIECE_WIDTH, qp_encode, qp_join, qp_part
+from metrics import PHASE_SECONDS
+
+# Layout sources. BASE_TEMPLATE wraps every email; the *_CONTENT layouts are
+# spliced into its {content} slot and compiled once at import time below.
+
+BASE_TEMPLATE = """
+    <!DOCTYPE html>
+    <html lang="en">
+    <head>
+        <meta charset="UTF-8">
+        <meta name="viewport" content="width=device-width, initial-scale=1.0">
+        <title>{title}</title>
+        <style>
+            * {{
+                margin: 0;
+                padding: 0;
+                box-sizing: border-box;
+            }}
+            
+            body {{
+                font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
+                line-height: 1.6;
+                color: #333;
+                background-color: #f4f4f4;
+            }}
+            
+            .container {{
+                max-width: 600px;
+                margin: 0 auto;
+                background-color: #ffffff;
+                border-radius: 10px;
+                overflow: hidden;
+                box-shadow: 0 4px 6px rgba(0, 0, 0, 0.1);
+            }}
+            
+            .header {{
+                background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
+                color: white;
+                padding: 30px;
+                text-align: center;
+            }}
+            
+            .header h1 {{
+                font-size: 28px;
+                margin-bottom: 10px;
+                font-weight: 300;
+            }}
+            
+            .header p {{
+                font-size: 16px;
+                opacity: 0.9;
+            }}
+            
+            .content {{
+                padding: 40px 30px;
+            }}
+            
+            .footer {{
+                background-color: #f8f9fa;
+                padding: 20px 30px;
+                text-align: center;
+                border-top: 1px solid #e9ecef;
+            }}
+            
+            .footer p {{
+                color: #6c757d;
+                font-size: 14px;
+                margin-bottom: 10px;
+            }}
+            
+            .btn {{
+                display: inline-block;
+                padding: 12px 30px;
+                background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
+                color: white;
+                text-decoration: none;
+                border-radius: 25px;
+                font-weight: 500;
+                transition: all 0.3s ease;
+                margin: 15px 0;
+            }}
+            
+            .btn:hover {{
+                transform: translateY(-2px);
+                box-shadow: 0 6px 12px rgba(0, 0, 0, 0.2);
+            }}
+            
+            .otp-box {{
+                background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
+                color: white;
+                padding: 20px;
+                border-radius: 10px;
+                text-align: center;
+                margin: 20px 0;
+            }}
+            
+            .otp-code {{
+                font-size: 32px;
+                font-weight: bold;
+                letter-spacing: 8px;
+                margin: 15px 0;
+                font-family: 'Courier New', monospace;
+            }}
+            
+            .warning-box {{
+                background-color: #fff3cd;
+                border: 1px solid #ffeaa7;
+                border-radius: 8px;
+                padding: 15px;
+                margin: 20px 0;
+                color: #856404;
+            }}
+            
+            .success-box {{
+                background-color: #d4edda;
+                border: 1px solid #c3e6cb;
+                border-radius: 8px;
+                padding: 15px;
+                margin: 20px 0;
+                color: #155724;
+            }}
+            
+            .info-box {{
+                background-color: #d1ecf1;
+                border: 1px solid #bee5eb;
+                border-radius: 8px;
+                padding: 15px;
+                margin: 20px 0;
+                color: #0c5460;
+            }}
+            
+            .attendance-card {{
+                background-color: #f8f9fa;
+                border-radius: 10px;
+                padding: 20px;
+                margin: 20px 0;
+                border-left: 4px solid #667eea;
+            }}
+            
+            .attendance-status {{
+                display: inline-block;
+                padding: 8px 16px;
+                border-radius: 20px;
+                font-weight: 500;
+                text-transform: uppercase;
+                font-size: 12px;
+                margin: 10px 0;
+            }}
+            
+            .status-present {{
+                background-color: #d4edda;
+                color: #155724;
+            }}
+            
+            .status-absent {{
+                background-color: #f8d7da;
+                color: #721c24;
+            }}
+            
+            .contact-info {{
+                background-color: #f8f9fa;
+                border-radius: 8px;
+                padding: 20px;
+                margin: 20px 0;
+            }}
+            
+            .contact-info h3 {{
+                color: #667eea;
+                margin-bottom: 15px;
+            }}
+            
+            .contact-info p {{
+                margin-bottom: 8px;
+            }}
+            
+            .divider {{
+                height: 1px;
+                background: linear-gradient(to right, transparent, #667eea, transparent);
+                margin: 30px 0;
+            }}
+            
+            @media (max-width: 600px) {{
+                .container {{
+                    margin: 0 10px;
+                }}
+                
+                .header {{
+                    padding: 20px;
+                }}
+                
+                .content {{
+                    padding: 20px;
+                }}
+                
+                .otp-code {{
+                    font-size: 24px;
+                    letter-spacing: 4px;
+                }}
+            }}
+        </style>
+    </head>
+    <body>
+        <div class="container">
+            {content}
+        </div>
+    </body>
+    </html>
+    """
+
+OTP_CONTENT = """
+    <div class="header">
+        <h1>🔐 Admin Login Verification</h1>
+        <p>Your One-Time Password (OTP) for secure access</p>
+    </div>
+    
+    <div class="content">
+        <h2>Hello {user_name}! 👋</h2>
+        <p>We received a request to access your admin account. Please use the following OTP to complete your login:</p>
+        
+        <div class="otp-box">
+            <p style="margin: 0; font-size: 16px;">Your OTP Code is:</p>
+            <div class="otp-code">{otp}</div>
+            <p style="margin: 0; font-size: 14px; opacity: 0.9;">Valid for 5 minutes</p>
+        </div>
+        
+        <div class="warning-box">
+            <strong>⚠️ Security Notice:</strong>
+            <ul style="margin: 10px 0 0 20px;">
+                <li>This OTP is valid for only 5 minutes</li>
+                <li>Do not share this code with anyone</li>
+                <li>If you didn't request this, please ignore this email</li>
+            </ul>
+        </div>
+        
+        <div class="info-box">
+            <p><strong>📅 Request Time:</strong> {current_time}</p>
+            <p><strong>🔒 Security Level:</strong> High</p>
+        </div>
+        
+        <div class="divider"></div>
+        
+        <p>If you have any concerns about this login attempt, please contact our support team immediately.</p>
+    </div>
+    
+    <div class="footer">
+        <p>This is an automated message. Please do not reply to this email.</p>
+        <p>&copy; 2025 Your Company Name. All rights reserved.</p>
+    </div>
+    """
+
+CONTACT_FORM_CONTENT = """
+    <div class="header">
+        <h1>📨 New Contact Form Submission</h1>
+        <p>Someone has reached out through your website</p>
+    </div>
+    
+    <div class="content">
+        <h2>New Message Received! 📬</h2>
+        <p>You have received a new message through your contact form:</p>
+        
+        <div class="contact-info">
+            <h3>👤 Contact Information</h3>
+            <p><strong>Name:</strong> {name}</p>
+            <p><strong>Email:</strong> <a href="mailto:{email}" style="color: #667eea; text-decoration: none;">{email}</a></p>
+            <p><strong>Subject:</strong> {subject}</p>
+            <p><strong>Submitted:</strong> {current_time}</p>
+        </div>
+        
+        <div class="divider"></div>
+        
+        <h3>💬 Message Content</h3>
+        <div style="background-color: #f8f9fa; padding: 20px; border-radius: 8px; border-left: 4px solid #667eea; margin: 15px 0;">
+            <p style="white-space: pre-wrap; margin: 0;">{message}</p>
+        </div>
+        
+        <div class="success-box">
+            <p><strong>✅ Next Steps:</strong> The sender expects a response. Please reply within 24-48 hours for best customer service.</p>
+        </div>
+        
+        <div style="text-align: center; margin: 30px 0;">
+            <a href="mailto:{email}" class="btn">Reply to {name}</a>
+        </div>
+    </div>
+    
+    <div class="footer">
+        <p>This message was sent through your website contact form.</p>
+        <p>&copy; 2025 Your Company Name. All rights reserved.</p>
+    </div>
+    """
+
+ATTENDANCE_CONTENT = """
+    <div class="header">
+        <h1>📚 Attendance Update</h1>
+        <p>Your attendance has been recorded</p>
+    </div>
+    
+    <div class="content">
+        <h2>Hello, {student_name}! 👋</h2>
+        <p>Your attendance has been successfully recorded for today's class:</p>
+        
+        <div class="attendance-card">
+            <h3 style="color: #667eea; margin-bottom: 15px;">📋 Attendance Details</h3>
+            <p><strong>📖 Subject:</strong> {subject}</p>
+            <p><strong>📅 Date:</strong> {date}</p>
+            <p><strong>⏰ Period:</strong> {period}</p>
+            <p><strong>📝 Recorded:</strong> {current_time}</p>
+            
+            <div style="margin: 20px 0;">
+                <span class="attendance-status {status_class}">
+                    {status_emoji} {status_label}
+                </span>
+            </div>
+        </div>
+        
+        {status_box}
+        
+        <div class="info-box">
+            <p><strong>📊 Attendance Tips:</strong></p>
+            <ul style="margin: 10px 0 0 20px;">
+                <li>Regular attendance improves understanding</li>
+                <li>Aim for at least 75% attendance</li>
+                <li>Contact your instructor if you have concerns</li>
+            </ul>
+        </div>
+        
+        <div class="divider"></div>
+        
+        <p>If you have any questions about your attendance, please contact your instructor or the academic office.</p>
+    </div>
+    
+    <div class="footer">
+        <p>This is an automated attendance notification.</p>
+        <p>&copy; 2025 Your Educational Institution. All rights reserved.</p>
+    </div>
+    """
+
+ATTENDANCE_DIGEST_CONTENT = """
+    <div class="header">
+        <h1>📚 Daily Attendance Summary</h1>
+        <p>Your attendance for {date}</p>
+    </div>
+    
+    <div class="content">
+        <h2>Hello, {student_name}! 👋</h2>
+        <p>Here is your attendance for every class recorded on {date}:</p>
+        
+        <div class="attendance-card">
+            <h3 style="color: #667eea; margin-bottom: 15px;">📋 Attendance Details</h3>
+            <table style="width: 100%; border-collapse: collapse; font-size: 14px;">
+                <thead>
+                    <tr style="text-align: left; border-bottom: 2px solid #e9ecef;">
+                        <th style="padding: 8px 4px;">⏰ Period</th>
+                        <th style="padding: 8px 4px;">📖 Subject</th>
+                        <th style="padding: 8px 4px;">📝 Status</th>
+                    </tr>
+                </thead>
+                <tbody>
+                    {rows}
+                </tbody>
+            </table>
+            <p style="margin-top: 15px;"><strong>✅ Present:</strong> {present_count} &nbsp; <strong>❌ Absent:</strong> {absent_count} &nbsp; <strong>📊 Total:</strong> {total_count}</p>
+            <p><strong>📝 Summary sent:</strong> {current_time}</p>
+        </div>
+        
+        {status_box}
+        
+        <div class="divider"></div>
+        
+        <p>If you have any questions about your attendance, please contact your instructor or the academic office.</p>
+    </div>
+    
+    <div class="footer">
+        <p>This is an automated attendance summary.</p>
+        <p>&copy; 2025 Your Educational Institution. All rights reserved.</p>
+    </div>
+    """
+
+NOTIFICATION_CONTENT = """
+    <div class="header">
+        <h1>{emoji} {type_label} Notification</h1>
+        <p>Important message for you</p>
+    </div>
+    
+    <div class="content">
+        <h2 style="color: {color};">{subject}</h2>
+        
+        <div style="background-color: #f8f9fa; padding: 25px; border-radius: 10px; border-left: 4px solid {color}; margin: 25px 0;">
+            <p style="white-space: pre-wrap; margin: 0; font-size: 16px; line-height: 1.6;">{message}</p>
+        </div>
+        
+        <div class="info-box">
+            <p><strong>📅 Sent:</strong> {current_time}</p>
+            <p><strong>🏷️ Type:</strong> {type_title}</p>
+        </div>
+        
+        <div class="divider"></div>
+        
+        <p>Thank you for your attention to this notification.</p>
+    </div>
+    
+    <div class="footer">
+        <p>This is an automated notification from our system.</p>
+        <p>&copy; 2025 Your Company Name. All rights reserved.</p>
+    </div>
+    """
+
+
+class Markup(str):
+    """A string that is already safe HTML and must not be escaped"""
+
+
+def escape(value) -> str:
+    """HTML-escape a field value unless it is marked as Markup"""
+    if isinstance(value, Markup):
+        return value
+    return html.escape(str(value), quote=True)
+
+
+class CompiledTemplate:
+    """A layout parsed once into static chunks and named field slots.
+
+    Static chunks (header, CSS, footer) are joined once, so rendering only
+    escapes the variable fields and splices them into a copy of the chunk
+    list. A layout with non-ASCII text always goes out quoted-printable,
+    so its static chunks are also kept pre-encoded and ``render_mime``
+    only encodes the fields.
+    """
+
+    def __init__(self, source: str, escape_fields: bool = True, **static_fields):
+        self._escape = escape if escape_fields else str
+        chunks: List[Optional[str]] = []
+        slots: List[Tuple[int, str]] = []
+        literal = ""
+        for text, field, _spec, _conversion in Formatter().parse(source):
+            literal += text
+            if field is None:
+                continue
+            if field in static_fields:
+                literal += escape(static_fields[field])
+                continue
+            chunks.append(literal)
+            literal = ""
+            slots.append((len(chunks), field))
+            chunks.append(None)
+        chunks.append(literal)
+
+        self.fields = tuple(name for _, name in slots)
+        self._chunks = chunks
+        self._slots = slots
+        self._encoded_chunks: Optional[List[Optional[bytes]]] = None
+        if not all(chunk.isascii() for chunk in chunks if chunk is not None):
+            self._encoded_chunks = [
+                qp_encode(chunk, QP_PIECE_WIDTH) if chunk is not None else None for chunk in chunks
+            ]
+
+    def render(self, **context) -> str:
+        start = time.perf_counter()
+        out = self._chunks.copy()
+        for index, name in self._slots:
+            out[index] = self._escape(context[name])
+        html_text = "".join(out)
+        PHASE_SECONDS.observe(time.perf_counter() - start, "template_render")
+        return html_text
+
+    def render_mime(self, **context) -> Tuple[str, Optional[bytes]]:
+        """Render to HTML and to its encoded text/html MIME part.
+
+        The part is None for an all-ASCII layout, which ``encode_body`` may
+        send as 7bit instead.
+        """
+        start = time.perf_counter()
+        out = self._chunks.copy()
+        encoded = self._encoded_chunks.copy() if self._encoded_chunks is not None else None
+        for index, name in self._slots:
+            value = self._escape(context[name])
+            out[index] = value
+            if encoded is not None:
+                encoded[index] = qp_encode(value, QP_PIECE_WIDTH)
+        html_text = "".join(out)
+        part = qp_part("html", qp_join(encoded)) if encoded is not None else None
+        PHASE_SECONDS.observe(time.perf_counter() - start, "template_render")
+        return html_text, part
+
+
+class MergeTemplate:
+    """Subject, text body and optional HTML body of a mail-merge campaign.
+
+    Placeholders use the same ``{column}`` syntax as the layouts above
+    (``{{`` and ``}}`` for literal braces) and are compiled once; each row
+    then only fills the slots. Only the HTML body escapes its values, and
+    line breaks in the subject are flattened so a row cannot add headers.
+    """
+
+    def __init__(self, subject: str, body: str, html_body: Optional[str] = None):
+        self.subject = CompiledTemplate(subject, escape_fields=False)
+        self.body = CompiledTemplate(body, escape_fields=False)
+        self.html_body = CompiledTemplate(html_body) if html_body else None
+        parts = [self.subject, self.body] + ([self.html_body] if self.html_body else [])
+        self.fields = tuple(dict.fromkeys(field for part in parts for field in part.fields))
+
+    def missing(self, row: Dict[str, str]) -> List[str]:
+        """Placeholders the row has no value for"""
+        return [field for field in self.fields if row.get(field) is None]
+
+    def render(self, row: Dict[str, str]) -> Tuple[str, str, Optional[str]]:
+        context = {field: row[field] for field in self.fields}
+        subject = " ".join(self.subject.render(**context).splitlines())
+        html_text = self.html_body.render(**context) if self.html_body else None
+        return subject, self.body.render(**context), html_text
+
+
+def compile_layout(content_source: str, **static_fields) -> CompiledTemplate:
+    """Compile a content layout wrapped in the shared base template"""
+    return CompiledTemplate(BASE_TEMPLATE.replace("{content}", content_source), **static_fields)
+
+
+OTP_TEMPLATE = compile_layout(OTP_CONTENT, title="Admin Login OTP")
+CONTACT_FORM_TEMPLATE = compile_layout(CONTACT_FORM_CONTENT, title="New Contact Form Submission")
+ATTENDANCE_TEMPLATE = compile_layout(ATTENDANCE_CONTENT, title="Attendance Update")
+ATTENDANCE_DIGEST_TEMPLATE = compile_layout(ATTENDANCE_DIGEST_CONTENT, title="Daily Attendance Summary")
+NOTIFICATION_TEMPLATE = compile_layout(NOTIFICATION_CONTENT)
+
+PRESENT_BOX = Markup("<div class='success-box'><p><strong>🎉 Great job!</strong> Keep up the excellent attendance record!</p></div>")
+ABSENT_BOX = Markup("<div class='warning-box'><p><strong>⚠️ Important Notice:</strong> Please ensure regular attendance for better academic performance.</p></div>")
+
+NOTIFICATION_TYPES: Dict[str, Dict[str, str]] = {
+    "general": {"emoji": "📢", "color": "#667eea"},
+    "urgent": {"emoji": "🚨", "color": "#dc3545"},
+    "info": {"emoji": "ℹ️", "color": "#17a2b8"},
+    "success": {"emoji": "✅", "color": "#28a745"},
+    "warning": {"emoji": "⚠️", "color": "#ffc107"}
+}
+
+
+def _now() -> str:
+    return datetime.now().strftime("%B %d, %Y at %I:%M %p")
+
+
+def get_otp_email_template(otp: str, user_name: str = "User"):
+    """OTP email template"""
+    return OTP_TEMPLATE.render(otp=otp, user_name=user_name, current_time=_now())
+
+
+def get_contact_form_template(name: str, email: str, subject: str, message: str):
+    """Contact form submission template"""
+    return CONTACT_FORM_TEMPLATE.render(
+        name=name, email=email, subject=subject, message=message, current_time=_now()
+    )
+
+
+def attendance_fields(student_name: str, subject: str, date: str, period: str, status: str) -> dict:
+    """Template fields for one attendance notification"""
+    present = status.lower() == "present"
+    return {
+        "student_name": student_name,
+        "subject": subject,
+        "date": date,
+        "period": period,
+        "current_time": _now(),
+        "status_class": "status-present" if present else "status-absent",
+        "status_emoji": "✅" if present else "❌",
+        "status_label": status.upper(),
+        "status_box": PRESENT_BOX if present else ABSENT_BOX,
+    }
+
+
+def get_attendance_email_template(student_name: str, subject: str, date: str, period: str, status: str):
+    """Attendance notification template"""
+    return ATTENDANCE_TEMPLATE.render(**attendance_fields(student_name, subject, date, period, status))
+
+
+def get_attendance_email_part(
+    student_name: str, subject: str, date: str, period: str, status: str
+) -> Tuple[str, Optional[bytes]]:
+    """Attendance notification template and its encoded MIME part"""
+    return ATTENDANCE_TEMPLATE.render_mime(**attendance_fields(student_name, subject, date, period, status))
+
+
+def attendance_digest_row(subject: str, period: str, status: str) -> str:
+    """One table row of the attendance digest, with its fields escaped"""
+    present = status.lower() == "present"
+    return (
+        f'<tr style="border-bottom: 1px solid #e9ecef;">'
+        f'<td style="padding: 8px 4px;">{escape(period)}</td>'
+        f'<td style="padding: 8px 4px;">{escape(subject)}</td>'
+        f'<td style="padding: 8px 4px;"><span class="attendance-status {"status-present" if present else "status-absent"}">'
+        f'{"✅" if present else "❌"} {escape(status.upper())}</span></td>'
+        f'</tr>'
+    )
+
+
+def get_attendance_digest_template(student_name: str, date: str, entries: List[Dict[str, str]]):
+    """Attendance digest: one row per period, from entries with subject, period and status"""
+    absent = sum(1 for entry in entries if entry["status"].lower() != "present")
+    return ATTENDANCE_DIGEST_TEMPLATE.render(
+        student_name=student_name,
+        date=date,
+        rows=Markup("".join(
+            attendance_digest_row(entry["subject"], entry["period"], entry["status"]) for entry in entries
+        )),
+        present_count=len(entries) - absent,
+        absent_count=absent,
+        total_count=len(entries),
+        current_time=_now(),
+        status_box=ABSENT_BOX if absent else PRESENT_BOX,
+    )
+
+
+def notification_fields(subject: str, message: str, notification_type: str = "general") -> dict:
+    """Template fields for one notification"""
+    config = NOTIFICATION_TYPES.get(notification_type.lower(), NOTIFICATION_TYPES["general"])
+    return {
+        "title": f"{notification_type.title()} Notification",
+        "emoji": config["emoji"],
+        "color": config["color"],
+        "type_label": notification_type.upper(),
+        "type_title": notification_type.title(),
+        "subject": subject,
+        "message": message,
+        "current_time": _now(),
+    }
+
+
+def get_notification_template(subject: str, message: str, notification_type: str = "general"):
+    """Generic notification template"""
+    return NOTIFICATION_TEMPLATE.render(**notification_fields(subject, message, notification_type))
+
+
+def get_notification_part(
+    subject: str, message: str, notification_type: str = "general"
+) -> Tuple[str, Optional[bytes]]:
+    """Notification template and its encoded MIME part"""
+    return NOTIFICATION_TEMPLATE.render_mime(**notification_fields(subject, message, notification_type))
@@ -1,16 +1,31 @@
 // EmailService.jsx
 const API_BASE_URL = 'http://localhost:8000';
 
+// Pass the same key when retrying a send so the server returns the
+// original response instead of sending the email twice
+const newIdempotencyKey = () => crypto.randomUUID();
+
 class EmailService {
-  async sendEmail(emailData) {
+  // attachments: File or Blob objects, sent as a multipart upload
+  async sendEmail(emailData, idempotencyKey = newIdempotencyKey(), attachments = []) {
     try {
-      const response = await fetch(`${API_BASE_URL}/send-email`, {
-        method: 'POST',
-        headers: {
-          'Content-Type': 'application/json',
-        },
-        body: JSON.stringify(emailData),
-      });
+      let request;
+      if (attachments.length) {
+        const form = new FormData();
+        form.append('email', JSON.stringify(emailData));
+        attachments.forEach((file) => form.append('attachments', file, file.name));
+        request = { headers: { 'Idempotency-Key': idempotencyKey }, body: form };
+      } else {
+        request = {
+          headers: {
+            'Content-Type': 'application/json',
+            'Idempotency-Key': idempotencyKey,
+          },
+          body: JSON.stringify(emailData),
+        };
+      }
+
+      const response = await fetch(`${API_BASE_URL}/send-email`, { method: 'POST', ...request });
 
       if (!response.ok) {
         const errorData = await response.json();
@@ -24,12 +39,13 @@ class EmailService {
     }
   }
 
-  async sendContactForm(contactData) {
+  async sendContactForm(contactData, idempotencyKey = newIdempotencyKey()) {
     try {
       const response = await fetch(`${API_BASE_URL}/contact-form`, {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
+          'Idempotency-Key': idempotencyKey,
         },
         body: JSON.stringify(contactData),
       });
@@ -46,12 +62,13 @@ class EmailService {
     }
   }
 
-  async sendNotification(recipient, subject, message, type = 'general') {
+  async sendNotification(recipient, subject, message, type = 'general', idempotencyKey = newIdempotencyKey()) {
     try {
       const response = await fetch(`${API_BASE_URL}/send-notification`, {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
+          'Idempotency-Key': idempotencyKey,
         },
         body: JSON.stringify({
           recipient,
@@ -73,6 +90,87 @@ class EmailService {
     }
   }
 
+  // One email per row of a CSV or NDJSON file; subject and body use
+  // {column} placeholders. With dryRun nothing is sent and the response
+  // reports throughput, rejected rows and a preview of the first message
+  async sendMailMerge(file, { subject, body, htmlBody, emailField, dryRun = false, sendAt } = {},
+                      idempotencyKey = newIdempotencyKey()) {
+    try {
+      const form = new FormData();
+      form.append('file', file);
+      form.append('subject', subject);
+      form.append('body', body);
+      if (htmlBody) form.append('html_body', htmlBody);
+      if (emailField) form.append('email_field', emailField);
+      if (sendAt) form.append('send_at', sendAt);
+      form.append('dry_run', dryRun ? 'true' : 'false');
+
+      const response = await fetch(`${API_BASE_URL}/mail-merge`, {
+        method: 'POST',
+        headers: { 'Idempotency-Key': idempotencyKey },
+        body: form,
+      });
+
+      if (!response.ok) {
+        const errorData = await response.json();
+        throw new Error(errorData.detail || 'Failed to start mail merge');
+      }
+
+      return await response.json();
+    } catch (error) {
+      console.error('Mail merge error:', error);
+      throw error;
+    }
+  }
+
+  // Render and mail a certificate to everyone in a CSV or NDJSON roster
+  // (name, email, optional hours and credential_id columns); follow the
+  // returned batch_id with watchJob
+  async sendCertificates(file, { event, date, template = 'classic', signature, instructor, watermark, hours } = {},
+                         idempotencyKey = newIdempotencyKey()) {
+    try {
+      const form = new FormData();
+      form.append('file', file);
+      form.append('event', event);
+      form.append('date', date);
+      form.append('template', template);
+      if (signature) form.append('signature', signature);
+      if (instructor) form.append('instructor', instructor);
+      if (watermark) form.append('watermark', watermark);
+      if (hours) form.append('hours', hours);
+
+      const response = await fetch(`${API_BASE_URL}/send-certificates`, {
+        method: 'POST',
+        headers: { 'Idempotency-Key': idempotencyKey },
+        body: form,
+      });
+
+      if (!response.ok) {
+        const errorData = await response.json();
+        throw new Error(errorData.detail || 'Failed to send certificates');
+      }
+
+      return await response.json();
+    } catch (error) {
+      console.error('Certificate batch error:', error);
+      throw error;
+    }
+  }
+
+  // Follow a queued job's progress over Server-Sent Events; returns a
+  // function that stops watching
+  watchJob(jobId, onProgress) {
+    const source = new EventSource(`${API_BASE_URL}/jobs/${jobId}/events`);
+    const handle = (event) => onProgress(JSON.parse(event.data), event.type === 'done');
+    source.addEventListener('progress', handle);
+    source.addEventListener('done', (event) => {
+      handle(event);
+      source.close();
+    });
+    source.addEventListener('not_found', () => source.close());
+    return () => source.close();
+  }
+
   async checkHealth() {
     try {
       const response = await fetch(`${API_BASE_URL}/health`);
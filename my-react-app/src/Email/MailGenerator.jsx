@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import EmailService from '../Email/EmailService';
 import { collection, getDocs } from 'firebase/firestore';
 import { db } from '../Firebase/firebase.jsx';
@@ -8,11 +8,13 @@ const MailGenerator = () => {
     to: '',
     subject: '',
     body: '',
-    html_body: ''
+    html_body: '',
+    send_at: ''
   });
   const [emailType, setEmailType] = useState('single');
   const [loading, setLoading] = useState(false);
   const [status, setStatus] = useState(null);
+  const stopWatching = useRef(null);
   const [students, setStudents] = useState([]);
   const [selectedStudents, setSelectedStudents] = useState([]);
   const [templates, setTemplates] = useState({
@@ -321,10 +323,13 @@ useEffect(() => {
     }
   };
 
+  useEffect(() => () => stopWatching.current?.(), []);
+
   const handleSubmit = async (e) => {
     e.preventDefault();
     setLoading(true);
     setStatus(null);
+    stopWatching.current?.();
 
     try {
       const recipients = getRecipientEmails();
@@ -337,18 +342,37 @@ useEffect(() => {
         to: recipients,
         subject: emailData.subject,
         body: emailData.body,
-        html_body: emailData.html_body || undefined
+        html_body: emailData.html_body || undefined,
+        // Send lists in Bcc batches so recipients don't see each other
+        fanout: recipients.length > 1 ? 'bcc' : undefined,
+        // datetime-local has no zone; send it as an absolute time
+        send_at: emailData.send_at ? new Date(emailData.send_at).toISOString() : undefined
       };
 
       const result = await EmailService.sendEmail(emailPayload);
       setStatus({ 
         type: 'success', 
-        message: `Email sent successfully to ${recipients.length} recipient(s)!` 
+        message: result.scheduled_for
+          ? `Email scheduled for ${recipients.length} recipient(s) at ${new Date(result.scheduled_for).toLocaleString()}`
+          : `Email queued for ${recipients.length} recipient(s)` 
       });
       
+      // Fan-out sends are delivered in the background; show their progress
+      if (result.batches && !result.scheduled_for) {
+        stopWatching.current = EmailService.watchJob(result.email_id, (progress, done) => {
+          const { sent, failed, total } = progress.counts;
+          setStatus({
+            type: failed > 0 && done ? 'error' : 'success',
+            message: done
+              ? `Delivered ${sent} of ${total} message(s) to ${recipients.length} recipient(s)${failed ? `, ${failed} failed` : ''}`
+              : `Sending… ${sent + failed} of ${total} message(s) done`
+          });
+        });
+      }
+      
       // Reset form if single email
       if (emailType === 'single') {
-        setEmailData({ to: '', subject: '', body: '', html_body: '' });
+        setEmailData({ to: '', subject: '', body: '', html_body: '', send_at: '' });
       }
       
     } catch (error) {
@@ -470,6 +494,21 @@ useEffect(() => {
                   />
                 </div>
 
+                {/* Schedule */}
+                <div>
+                  <label htmlFor="send_at" className="block text-sm font-medium text-gray-700 mb-2">
+                    Send At <span className="text-gray-400 font-normal">(optional, sends now if empty)</span>
+                  </label>
+                  <input
+                    type="datetime-local"
+                    id="send_at"
+                    name="send_at"
+                    value={emailData.send_at}
+                    onChange={handleInputChange}
+                    className="w-full px-4 py-3 border border-gray-300 rounded-md focus:outline-none focus:ring-2 focus:ring-blue-500 focus:border-transparent"
+                  />
+                </div>
+
                 {/* Message Body */}
                 <div>
                   <label htmlFor="body" className="block text-sm font-medium text-gray-700 mb-2">
@@ -581,7 +620,7 @@ useEffect(() => {
                 <div className="space-y-2">
                   <button
                     type="button"
-                    onClick={() => setEmailData({ to: '', subject: '', body: '', html_body: '' })}
+                    onClick={() => setEmailData({ to: '', subject: '', body: '', html_body: '', send_at: '' })}
                     className="w-full text-left text-sm text-gray-600 hover:text-gray-900 py-1"
                   >
                     Clear Form